@@ -0,0 +1,116 @@
+"""Headless batch export: retime GIFs to a list of BPMs without opening a window.
+
+Example:
+    python batch_export.py clips/ extra/*.gif --bpm-range 80 180 5 -o out/
+"""
+import argparse
+import concurrent.futures
+import glob
+import os
+import sys
+import time
+
+from gif_export import read_gif_frames, save_retimed_gif
+from sync_math import extract_beats_from_filename, target_loop_duration
+
+
+def find_gifs(inputs):
+    """Expand directories (recursively) and glob patterns into a sorted list of GIF paths"""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*"), recursive=True)
+        else:
+            matches = glob.glob(item, recursive=True)
+        for path in matches:
+            if path.lower().endswith(".gif") and os.path.isfile(path):
+                paths.add(os.path.normpath(path))
+    return sorted(paths)
+
+
+def output_name(gif_path, bpm):
+    stem = os.path.splitext(os.path.basename(gif_path))[0]
+    return f"{stem}_{bpm:g}bpm.gif"
+
+
+def export_file(gif_path, bpms, output_dir, beats=None):
+    """Decode one GIF once and write a retimed copy for every BPM (runs in a worker)"""
+    start = time.perf_counter()
+    frames, durations = read_gif_frames(gif_path)
+    if beats is None:
+        beats = extract_beats_from_filename(gif_path)
+    written = []
+    for bpm in bpms:
+        out_path = os.path.join(output_dir, output_name(gif_path, bpm))
+        save_retimed_gif(frames, durations, target_loop_duration(beats, bpm), out_path)
+        written.append(out_path)
+    return gif_path, written, time.perf_counter() - start
+
+
+def parse_bpms(args):
+    bpms = list(args.bpm or [])
+    if args.bpm_range:
+        start, stop, step = args.bpm_range
+        if step <= 0:
+            raise SystemExit("--bpm-range step must be positive")
+        bpm = start
+        while bpm <= stop + 1e-9:
+            bpms.append(round(bpm, 3))
+            bpm += step
+    bpms = sorted(set(b for b in bpms if b > 0))
+    if not bpms:
+        raise SystemExit("Give at least one BPM with --bpm or --bpm-range")
+    return bpms
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Retime GIFs to one or more BPMs without the GUI")
+    parser.add_argument("inputs", nargs="+", help="GIF files, directories or glob patterns")
+    parser.add_argument("--bpm", type=float, nargs="+", help="target BPMs, e.g. --bpm 120 128 140")
+    parser.add_argument("--bpm-range", type=float, nargs=3, metavar=("START", "STOP", "STEP"),
+                        help="every BPM from START to STOP inclusive, e.g. --bpm-range 80 180 1")
+    parser.add_argument("--beats", type=float,
+                        help="beats per loop for every input (default: parsed from _XB.gif names)")
+    parser.add_argument("-o", "--output-dir", default="exports", help="where to write the GIFs")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+
+    bpms = parse_bpms(args)
+    gif_paths = find_gifs(args.inputs)
+    if not gif_paths:
+        raise SystemExit("No GIFs found")
+
+    # Output names only use the file stem, so two inputs with the same name would collide
+    stems = {}
+    for path in gif_paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if stem in stems:
+            raise SystemExit(f"Duplicate GIF name {stem!r}: {stems[stem]} and {path}")
+        stems[stem] = path
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    total = len(gif_paths)
+    print(f"Exporting {total} GIFs x {len(bpms)} BPMs to {args.output_dir} with {args.workers} workers")
+
+    start = time.perf_counter()
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(export_file, path, bpms, args.output_dir, args.beats): path
+                   for path in gif_paths}
+        for n, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            path = futures[future]
+            try:
+                _, written, elapsed = future.result()
+                print(f"[{n}/{total}] {path}: {len(written)} files in {elapsed:.2f}s")
+            except Exception as e:
+                failures += 1
+                print(f"[{n}/{total}] {path}: FAILED ({e})")
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {(total - failures) * len(bpms)} files in {elapsed:.2f}s, {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
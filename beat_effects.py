@@ -0,0 +1,283 @@
+"""Beat-reactive stage effects: pulse zoom, color flashes, hue cycling, strobe and trails.
+
+Effects sit between frame selection and the blit in draw_gif_on_stage. The
+beat position is quantized to PHASE_BUCKETS steps per beat and every enabled
+effect turns it into a small integer level (0 is off), so a frame only ever
+needs a handful of variants. Color work runs once per (frame, levels) with
+NumPy lookup tables on the surface's pixel buffer, never per pixel in
+Python, and the result is cached like a scaled frame. Pulse and strobe only
+move or hide dancers, so they cost nothing per pixel.
+"""
+import collections
+import functools
+import math
+
+import numpy as np
+
+EFFECTS = ("pulse", "flash", "hue", "strobe", "trails")  # F1-F5 in the main window toggle these in order
+BEATS_PER_BAR = 4  # The pulse hits on the first beat of every bar
+PHASE_BUCKETS = 16  # Beat phase resolution; effect levels change at most this often per beat
+PULSE_ZOOM = 0.15  # Extra dancer size at the peak of the downbeat pulse
+PULSE_BUCKETS = 6  # The pulse shrinks back over this many phase buckets
+FLASH_STRENGTH = 0.7  # How far colors move towards the flash color at the peak of a flash
+FLASH_BUCKETS = 4  # A flash fades over this many phase buckets
+FLASH_COLORS = ((255, 255, 255), (255, 60, 170), (60, 200, 255), (255, 220, 60))  # One per beat, in turn
+HUE_CYCLE_BEATS = 8  # Beats for a full turn of the color wheel
+HUE_STEPS = 16  # Hue angles per turn, each one a precomputed lookup table
+HUE_BITS = 6  # Bits per channel indexing the hue tables (2 ** (3 * HUE_BITS) entries each)
+STROBE_DIVISION = 4  # Strobe cycles per beat
+STROBE_DUTY = 0.5  # Share of each strobe cycle the dancers are visible
+TRAIL_ALPHA = (0.45, 0.25, 0.12)  # Opacity of the ghosts of the previous frames, newest first
+DEFAULT_CACHE_MB = 128
+
+EffectLevels = collections.namedtuple("EffectLevels", "pulse flash flash_color hue strobe trails")
+NO_EFFECTS = EffectLevels(0, 0, 0, 0, 0, 0)
+
+
+def parse_effects(text):
+    """Effect names from a comma-separated list such as "pulse,flash" """
+    names = [name.strip() for name in text.split(",") if name.strip()]
+    for name in names:
+        if name not in EFFECTS:
+            raise ValueError(f"unknown effect {name!r} (choose from {', '.join(EFFECTS)})")
+    return names
+
+
+def effect_levels(effects, beat):
+    """Levels of the enabled effects at a beat position; they only change on phase bucket boundaries"""
+    if not effects:
+        return NO_EFFECTS
+    step = math.floor(beat * PHASE_BUCKETS)
+    beat_index, bucket = divmod(step, PHASE_BUCKETS)
+    quantized = step / PHASE_BUCKETS
+    pulse = flash = flash_color = hue = strobe = trails = 0
+    if "pulse" in effects and beat_index % BEATS_PER_BAR == 0 and bucket < PULSE_BUCKETS:
+        pulse = PULSE_BUCKETS - bucket
+    if "flash" in effects and bucket < FLASH_BUCKETS:
+        flash = FLASH_BUCKETS - bucket
+        flash_color = beat_index % len(FLASH_COLORS)
+    if "hue" in effects:
+        hue = int(quantized % HUE_CYCLE_BEATS / HUE_CYCLE_BEATS * HUE_STEPS)
+    if "strobe" in effects and quantized * STROBE_DIVISION % 1.0 >= STROBE_DUTY:
+        strobe = 1
+    if "trails" in effects:
+        trails = len(TRAIL_ALPHA)
+    return EffectLevels(pulse, flash, flash_color, hue, strobe, trails)
+
+
+@functools.lru_cache(maxsize=64)
+def pulse_layout(layout, level):
+    """A stage layout with every dancer grown by the pulse, feet kept on the same spot"""
+    scale = 1.0 + PULSE_ZOOM * level / PULSE_BUCKETS
+    pulsed = []
+    for x, y, width, height, offset in layout:
+        new_width = max(1, int(width * scale))
+        new_height = max(1, int(height * scale))
+        pulsed.append((x + (width - new_width) // 2, y + height - new_height, new_width, new_height, offset))
+    return tuple(pulsed)
+
+
+def _byte_index(mask):
+    """Which of a pixel's four bytes in memory holds the channel with this mask"""
+    return int(np.array([mask], dtype=np.uint32).view(np.uint8).nonzero()[0][0])
+
+
+def _shift(mask):
+    return (mask & -mask).bit_length() - 1
+
+
+def _word_tables(byte_luts):
+    """Lookup tables over the two 16-bit halves of a pixel, from a 256-entry table per byte (None keeps it)"""
+    pairs = np.arange(65536, dtype=np.uint16).view(np.uint8).reshape(-1, 2)
+    tables = []
+    for word in (0, 1):
+        luts = byte_luts[2 * word:2 * word + 2]
+        if luts[0] is None and luts[1] is None:
+            tables.append(None)
+            continue
+        mapped = pairs.copy()
+        for half, lut in enumerate(luts):
+            if lut is not None:
+                mapped[:, half] = lut[pairs[:, half]]
+        tables.append(mapped.view(np.uint16).ravel())
+    return tuple(tables)
+
+
+@functools.lru_cache(maxsize=FLASH_BUCKETS * len(FLASH_COLORS) * 2)
+def _flash_tables(level, color_index, masks):
+    """Word tables moving each color channel towards a flash color; alpha is left alone"""
+    strength = FLASH_STRENGTH * level / FLASH_BUCKETS
+    values = np.arange(256, dtype=np.float32)
+    byte_luts = [None] * 4
+    for mask, target in zip(masks[:3], FLASH_COLORS[color_index]):
+        byte_luts[_byte_index(mask)] = np.round(values + (target - values) * strength).astype(np.uint8)
+    return _word_tables(byte_luts)
+
+
+@functools.lru_cache(maxsize=len(TRAIL_ALPHA) * 2)
+def _ghost_tables(age, masks):
+    """Word tables fading a frame's alpha to the opacity of a ghost `age` frames old"""
+    byte_luts = [None] * 4
+    byte_luts[_byte_index(masks[3])] = np.round(np.arange(256) * TRAIL_ALPHA[age - 1]).astype(np.uint8)
+    return _word_tables(byte_luts)
+
+
+@functools.lru_cache(maxsize=HUE_STEPS * 2)
+def _hue_table(step, masks):
+    """Packed-pixel table for one hue angle, indexed by the top HUE_BITS bits of R, G and B"""
+    angle = 2.0 * math.pi * step / HUE_STEPS
+    cos, sin = math.cos(angle), math.sin(angle)
+    # Hue rotation about the luminance axis (the CSS hue-rotate matrix)
+    matrix = np.array([
+        [0.213 + cos * 0.787 - sin * 0.213, 0.715 - cos * 0.715 - sin * 0.715, 0.072 - cos * 0.072 + sin * 0.928],
+        [0.213 - cos * 0.213 + sin * 0.143, 0.715 + cos * 0.285 + sin * 0.140, 0.072 - cos * 0.072 - sin * 0.283],
+        [0.213 - cos * 0.213 - sin * 0.787, 0.715 - cos * 0.715 + sin * 0.715, 0.072 + cos * 0.928 + sin * 0.072],
+    ], dtype=np.float32)
+    # Each index stands for the middle of its bucket of 8-bit values
+    levels = (np.arange(1 << HUE_BITS, dtype=np.float32) + 0.5) * (1 << (8 - HUE_BITS))
+    rgb = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), axis=-1).reshape(-1, 3)
+    rotated = np.clip(rgb @ matrix.T + 0.5, 0, 255).astype(np.uint32)
+    red, green, blue = (_shift(mask) for mask in masks[:3])
+    return (rotated[:, 0] << red) | (rotated[:, 1] << green) | (rotated[:, 2] << blue)
+
+
+def apply_word_tables(surface, tables):
+    """Run word tables over a 32-bit surface's pixels in place"""
+    words = np.frombuffer(surface.get_view("1"), dtype=np.uint16).reshape(-1, 2)
+    for word, table in enumerate(tables):
+        if table is not None:
+            words[:, word] = np.take(table, words[:, word])
+
+
+def apply_hue(surface, step):
+    """Rotate the hue of a 32-bit surface's pixels in place, keeping alpha"""
+    masks = surface.get_masks()
+    red, green, blue = (_shift(mask) + 8 - HUE_BITS for mask in masks[:3])
+    channel = (1 << HUE_BITS) - 1
+    pixels = np.frombuffer(surface.get_view("1"), dtype=np.uint32)
+    index = (pixels >> red) & channel
+    index <<= HUE_BITS
+    index |= (pixels >> green) & channel
+    index <<= HUE_BITS
+    index |= (pixels >> blue) & channel
+    rotated = np.take(_hue_table(step, masks), index)
+    rotated |= pixels & masks[3]
+    pixels[:] = rotated
+
+
+class BeatEffects:
+    """The enabled beat effects, their levels at the current beat and a cache of effected frames.
+
+    set_beat() is called once per loop iteration; draw_gif_on_stage then asks
+    for frames through get(), which builds a frame's variant for the current
+    levels from the scaled frame cache on a miss. Entries are keyed on
+    (slot index, frame index, size, flip, levels) and capped by pixel memory,
+    least recently used first.
+    """
+
+    def __init__(self, effects=(), max_bytes=DEFAULT_CACHE_MB * 1024 * 1024):
+        self.enabled = set(effects)
+        self.levels = NO_EFFECTS
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def toggle(self, name):
+        """Switch an effect on or off; returns True if it is now on"""
+        if name in self.enabled:
+            self.enabled.discard(name)
+        else:
+            self.enabled.add(name)
+        return name in self.enabled
+
+    def set_effects(self, names):
+        self.enabled = set(names)
+
+    def set_beat(self, beat):
+        """Move the effects to a beat position (see effect_levels)"""
+        self.levels = effect_levels(self.enabled, beat)
+
+    def beats_to_next_change(self, beat):
+        """Beats until the levels can next change, None if no effect is on"""
+        if not self.enabled:
+            return None
+        return (math.floor(beat * PHASE_BUCKETS) + 1) / PHASE_BUCKETS - beat
+
+    def layout(self, layout):
+        """Where to draw the dancers this beat; empty while the strobe is dark"""
+        if self.levels.strobe:
+            return ()
+        if self.levels.pulse:
+            return pulse_layout(layout, self.levels.pulse)
+        return layout
+
+    def get(self, frame_cache, slot, frame_idx, size, flip=False):
+        """The scaled frame with this beat's trails and color effects applied"""
+        levels = self.levels
+        if not (levels.flash or levels.hue or levels.trails):
+            return frame_cache.get(slot, frame_idx, size, flip)
+        key = (slot.index, frame_idx, size, flip, frame_cache.smooth, levels.trails, levels.flash,
+               levels.flash_color, levels.hue)
+        surface = self._entries.get(key)
+        if surface is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        frame = frame_cache.get(slot, frame_idx, size, flip)
+        if frame.get_bytesize() != 4:
+            return frame
+        cacheable = True
+        if levels.trails and frame.get_masks()[3]:
+            surface = frame.copy()
+            surface.fill((0, 0, 0, 0))
+            # Oldest ghost first, so the newest frames end up on top
+            for age in range(levels.trails, 0, -1):
+                ghost_idx = (frame_idx - age) % slot.frame_count
+                if slot.is_streaming and not slot.pixels.ready(ghost_idx):
+                    cacheable = False  # Not decoded yet; build the full trail once it is
+                    continue
+                ghost = frame_cache.get(slot, ghost_idx, size, flip).copy()
+                apply_word_tables(ghost, _ghost_tables(age, ghost.get_masks()))
+                surface.blit(ghost, (0, 0))
+            surface.blit(frame, (0, 0))
+        else:
+            # Never touch the scaled frame itself, it is shared with the frame cache
+            surface = frame.copy()
+        if levels.hue:
+            apply_hue(surface, levels.hue)
+        if levels.flash:
+            apply_word_tables(surface, _flash_tables(levels.flash, levels.flash_color, surface.get_masks()))
+        if cacheable:
+            self._store(key, surface)
+        return surface
+
+    def _store(self, key, surface):
+        size_bytes = surface.get_width() * surface.get_height() * surface.get_bytesize()
+        if size_bytes > self.max_bytes:
+            return
+        self._entries[key] = surface
+        self.current_bytes += size_bytes
+        while self.current_bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        surface = self._entries.pop(key)
+        self.current_bytes -= surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def invalidate_slot(self, slot_index):
+        """Drop every effected frame of a slot (e.g. after a reload)"""
+        for key in [k for k in self._entries if k[0] == slot_index]:
+            self._drop(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def summary(self):
+        enabled = ", ".join(name for name in EFFECTS if name in self.enabled) or "none"
+        return (f"Beat effects: {enabled}; {self.hits} hits, {self.misses} misses, {len(self._entries)} frames, "
+                f"{self.current_bytes / (1024 * 1024):.1f}/{self.max_bytes / (1024 * 1024):.0f} MB")
@@ -0,0 +1,523 @@
+"""Live beat tracking: tempo and beat phase from an audio stream.
+
+Audio comes from a sound device (needs the optional sounddevice package), a
+WAV file, or raw/WAV PCM on a FIFO or stdin. A worker thread turns it into an
+onset-strength envelope (spectral flux of short FFT frames), finds the tempo by
+autocorrelating the last few seconds of that envelope and the beat phase with a
+comb filter, and posts estimates the main loop picks up with poll().
+
+Example:
+    python beat_tracker.py analyze song.wav --expect 128
+    python beat_tracker.py selftest
+    python beat_tracker.py listen device
+    arecord -f S16_LE -r 44100 -c 1 | python beat_tracker.py listen -
+"""
+import argparse
+import os
+import queue
+import stat
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+try:
+    import sounddevice
+except ImportError:  # Only needed to read a sound device
+    sounddevice = None
+
+DEFAULT_SAMPLE_RATE = 44100
+FFT_SIZE = 1024
+HOP_SIZE = 256  # 5.8 ms between onset envelope values at 44.1 kHz
+READ_FRAMES = 1024  # Samples read from the source per worker iteration
+FLUX_COMPRESSION = 1.0  # log(1 + C*|X|); bigger values let the noise floor swamp the onsets
+ANALYSIS_SECONDS = 8.0  # Envelope history the tempo is estimated from
+MIN_ANALYSIS_SECONDS = 3.0  # No estimate until this much audio has been heard
+UPDATE_SECONDS = 0.25  # Time between estimates
+BASELINE_SECONDS = 0.4  # Onset strength is measured against its moving average over this long
+MIN_BPM = 70.0
+MAX_BPM = 180.0
+PRIOR_BPM = 120.0  # Tempo the octave prior favours when two candidates score alike
+PRIOR_OCTAVES = 1.0  # Width of that prior
+SUBDIVISION_RATIO = 0.8  # Take a faster tempo when a period 1/2 or 2/3 as long correlates almost as well
+CONFIDENCE_GATE = 0.3  # Estimates below this confidence are not posted
+OCTAVE_TOLERANCE = 0.06  # How close to double or half the current tempo counts as the same tempo
+
+WAV_SAMPLE_TYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+def pcm_to_mono(data, sample_width, channels):
+    """Little-endian PCM bytes to a float32 mono array in -1..1"""
+    sample_type = WAV_SAMPLE_TYPES.get(sample_width)
+    if sample_type is None:
+        raise ValueError(f"{sample_width * 8}-bit PCM is not supported")
+    samples = np.frombuffer(data, dtype=sample_type)
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+    mono = samples.mean(axis=1, dtype=np.float32)
+    if sample_width == 1:
+        return (mono - 128.0) / 128.0  # 8-bit WAV is unsigned
+    return mono / float(2 ** (8 * sample_width - 1))
+
+
+class PcmSource:
+    """Mono float blocks from a WAV or raw PCM byte stream.
+
+    read_frames(n) returns the bytes of up to n sample frames (b'' at the end).
+    A paced source sleeps so blocks come out in real time, which is how a WAV
+    file on disk stands in for live input.
+    """
+
+    def __init__(self, read_frames, sample_rate, sample_width=2, channels=1, paced=False, close=None):
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.paced = paced
+        self._read_frames = read_frames
+        self._close = close
+        self._samples_read = 0
+        self._start = None
+
+    def read(self, frames=READ_FRAMES):
+        """Next block of samples, or None at the end of the stream"""
+        data = self._read_frames(frames)
+        if not data:
+            return None
+        samples = pcm_to_mono(data, self.sample_width, self.channels)
+        if self.paced:
+            if self._start is None:
+                self._start = time.monotonic()
+            self._samples_read += len(samples)
+            delay = self._start + self._samples_read / self.sample_rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return samples
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+
+
+class DeviceSource:
+    """Mono float blocks from a sound input device (sounddevice package)"""
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, device=None):
+        if sounddevice is None:
+            raise RuntimeError("reading a sound device needs the sounddevice package (pip install sounddevice)")
+        self.sample_rate = sample_rate
+        self._blocks = queue.Queue()
+        self._stream = sounddevice.InputStream(samplerate=sample_rate, channels=1, dtype="float32",
+                                               blocksize=HOP_SIZE, device=device, callback=self._callback)
+        self._stream.start()
+
+    def _callback(self, indata, frames, time_info, status):
+        self._blocks.put(indata[:, 0].copy())
+
+    def read(self, frames=READ_FRAMES):
+        try:
+            return self._blocks.get(timeout=1.0)
+        except queue.Empty:
+            return np.zeros(0, dtype=np.float32)  # Device stalled; let the worker check for stop
+
+    def close(self):
+        self._stream.stop()
+        self._stream.close()
+
+
+def wav_source(f, paced, close=None):
+    try:
+        wav = wave.open(f, "rb")
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"not a PCM WAV stream: {e}")
+    return PcmSource(wav.readframes, wav.getframerate(), wav.getsampwidth(), wav.getnchannels(),
+                     paced=paced, close=close)
+
+
+def stream_source(f, sample_rate, close=None):
+    """PCM from a pipe: a WAV stream if it starts with a RIFF header, raw 16-bit mono otherwise"""
+    if f.peek(12)[:4] == b"RIFF":
+        return wav_source(f, paced=False, close=close)
+    return PcmSource(lambda frames: f.read(frames * 2), sample_rate, close=close)
+
+
+def open_source(spec, sample_rate=DEFAULT_SAMPLE_RATE):
+    """Open an audio source: 'device' or 'device:N', '-' for stdin, or a WAV file or FIFO path"""
+    if spec == "device" or spec.startswith("device:"):
+        device = spec.partition(":")[2] or None
+        if device is not None and device.isdigit():
+            device = int(device)
+        return DeviceSource(sample_rate, device)
+    if spec == "-":
+        return stream_source(sys.stdin.buffer, sample_rate)
+    f = open(spec, "rb")
+    if stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+        return wav_source(f, paced=True, close=f.close)
+    return stream_source(f, sample_rate, close=f.close)
+
+
+class OnsetDetector:
+    """Incremental spectral-flux onset strength, one value per hop of audio"""
+
+    def __init__(self, fft_size=FFT_SIZE, hop=HOP_SIZE):
+        self.fft_size = fft_size
+        self.hop = hop
+        self._window = np.hanning(fft_size).astype(np.float32)
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._last_spectrum = None
+
+    def feed(self, samples):
+        """Add samples; return the onset strengths of the frames they completed"""
+        buffered = np.concatenate((self._pending, samples))
+        count = (len(buffered) - self.fft_size) // self.hop + 1
+        if count <= 0:
+            self._pending = buffered
+            return np.zeros(0, dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(buffered, self.fft_size)[::self.hop][:count]
+        spectrum = np.log1p(FLUX_COMPRESSION * np.abs(np.fft.rfft(frames * self._window, axis=1)))
+        previous = np.empty_like(spectrum)
+        previous[0] = spectrum[0] if self._last_spectrum is None else self._last_spectrum
+        previous[1:] = spectrum[:-1]
+        self._last_spectrum = spectrum[-1]
+        self._pending = buffered[count * self.hop:]
+        return np.maximum(spectrum - previous, 0.0).sum(axis=1).astype(np.float32)
+
+
+def emphasize_onsets(envelope, envelope_rate):
+    """Onset strength above its local average, so a steady noise floor doesn't mask the beat"""
+    width = max(1, int(BASELINE_SECONDS * envelope_rate))
+    baseline = np.convolve(envelope, np.ones(width, dtype=np.float32) / width, mode="same")
+    return np.maximum(envelope - baseline, 0.0)
+
+
+def _parabolic_peak(values, i):
+    """Sub-sample position of the peak at values[i]"""
+    if i <= 0 or i >= len(values) - 1:
+        return float(i)
+    left, centre, right = values[i - 1], values[i], values[i + 1]
+    denominator = left - 2 * centre + right
+    if denominator == 0:
+        return float(i)
+    return i + 0.5 * (left - right) / denominator
+
+
+def estimate_tempo(envelope, envelope_rate, min_bpm=MIN_BPM, max_bpm=MAX_BPM):
+    """(bpm, confidence) of an onset envelope from its autocorrelation.
+
+    Confidence is the normalized autocorrelation at the beat period: close to 1
+    for a steady pulse, close to 0 for noise or silence.
+    """
+    x = envelope - envelope.mean()
+    n = len(x)
+    spectrum = np.fft.rfft(x, 2 * n)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    if autocorr[0] <= 0:
+        return 0.0, 0.0
+    # Undo the bias towards short lags that comes from fewer overlapping samples
+    autocorr = autocorr / autocorr[0] * n / (n - np.arange(n))
+    min_lag = max(1, int(envelope_rate * 60.0 / max_bpm))
+    max_lag = min(n - 2, int(np.ceil(envelope_rate * 60.0 / min_bpm)))
+    if max_lag <= min_lag:
+        return 0.0, 0.0
+    lags = np.arange(min_lag, max_lag + 1)
+    prior = np.exp(-0.5 * (np.log2(envelope_rate * 60.0 / lags / PRIOR_BPM) / PRIOR_OCTAVES) ** 2)
+    lag = int(lags[np.argmax(autocorr[lags] * prior)])
+    # Off-beat hi-hats make 2 or 1.5 beats correlate as well as 1 beat does; the real beat
+    # period is the shorter one that still correlates
+    for fraction in (0.5, 2.0 / 3.0):
+        shorter = int(round(lag * fraction))
+        if shorter - 1 >= min_lag:
+            shorter = shorter - 1 + int(np.argmax(autocorr[shorter - 1:shorter + 2]))
+            if autocorr[shorter] >= SUBDIVISION_RATIO * autocorr[lag]:
+                lag = shorter
+                break
+    confidence = float(np.clip(autocorr[lag], 0.0, 1.0))
+    # Refine on the furthest multiple of the period that fits, where one frame is a smaller fraction of it
+    multiple = max(1, min(4, (n - 2) // (lag + 1)))
+    centre = lag * multiple
+    search = np.arange(max(1, centre - multiple), min(n - 1, centre + multiple + 1))
+    peak = int(search[np.argmax(autocorr[search])])
+    period = _parabolic_peak(autocorr, peak) / multiple
+    return envelope_rate * 60.0 / period, confidence
+
+
+def estimate_beat(envelope, envelope_rate, bpm):
+    """Frames back from the end of the envelope to the most recent beat (comb filter over the history)"""
+    period = envelope_rate * 60.0 / bpm
+    offsets = np.arange(int(np.ceil(period)))
+    beats = np.arange(int(len(envelope) // period))
+    positions = np.rint(len(envelope) - 1 - offsets[:, None] - beats[None, :] * period).astype(np.intp)
+    scores = np.where(positions >= 0, envelope[np.maximum(positions, 0)], 0.0).sum(axis=1)
+    return int(offsets[np.argmax(scores)])
+
+
+def match_octave(bpm, current_bpm, tolerance=OCTAVE_TOLERANCE):
+    """Fold an estimate that is double or half current_bpm back onto it.
+
+    Audio alone can't tell 90 BPM with eighth-note hats from 180 BPM; the tempo
+    already playing (perhaps halved by hand) decides.
+    """
+    for factor in (0.5, 2.0):
+        if abs(bpm * factor / current_bpm - 1.0) <= tolerance:
+            return bpm * factor
+    return bpm
+
+
+class BeatEstimate:
+    """A tempo reading: bpm, the time of a recent beat and how sure the tracker is"""
+
+    __slots__ = ('bpm', 'beat_time', 'confidence')
+
+    def __init__(self, bpm, beat_time, confidence):
+        self.bpm = bpm
+        self.beat_time = beat_time
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"BeatEstimate({self.bpm:.2f} BPM, beat at {self.beat_time:.3f}, confidence {self.confidence:.2f})"
+
+
+class BeatTracker:
+    """Tempo and beat phase of an audio source, estimated on a worker thread.
+
+    Beat times are on the time.monotonic clock so they can be handed straight
+    to FrameScheduler.align_beat(). The stream's start time is taken from the
+    earliest-arriving block (now minus the audio already read), so buffering
+    in a pipe or driver only ever makes a block late, never early.
+    """
+
+    def __init__(self, source, min_bpm=MIN_BPM, max_bpm=MAX_BPM, confidence_gate=CONFIDENCE_GATE,
+                 clock=time.monotonic):
+        self.source = source
+        self.min_bpm = min_bpm
+        self.max_bpm = max_bpm
+        self.confidence_gate = confidence_gate
+        self.error = None
+        self._clock = clock
+        self._detector = OnsetDetector()
+        self._envelope_rate = source.sample_rate / self._detector.hop
+        self._history = int(ANALYSIS_SECONDS * self._envelope_rate)
+        self._envelope = np.zeros(self._history, dtype=np.float32)
+        self._envelope_count = 0  # Envelope values ever produced
+        self._samples_read = 0
+        self._start_time = None
+        self._next_update = MIN_ANALYSIS_SECONDS
+        self._latest = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="beat-tracker", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    @property
+    def running(self):
+        """False once the source has ended or failed"""
+        return self._thread.is_alive()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=2.0)
+        self.source.close()
+
+    def poll(self):
+        """The newest confident estimate since the last poll, or None"""
+        with self._lock:
+            latest, self._latest = self._latest, None
+        return latest
+
+    def process(self, samples, arrival_time):
+        """Analyse a block that finished arriving at arrival_time; returns a new estimate or None"""
+        self._samples_read += len(samples)
+        start = arrival_time - self._samples_read / self.source.sample_rate
+        if self._start_time is None or start < self._start_time:
+            self._start_time = start
+        onsets = self._detector.feed(samples)
+        if len(onsets) == 0:
+            return None
+        if len(onsets) >= self._history:
+            self._envelope[:] = onsets[-self._history:]
+        else:
+            self._envelope = np.roll(self._envelope, -len(onsets))
+            self._envelope[-len(onsets):] = onsets
+        self._envelope_count += len(onsets)
+
+        heard = self._samples_read / self.source.sample_rate
+        if heard < self._next_update:
+            return None
+        self._next_update = heard + UPDATE_SECONDS
+        envelope = emphasize_onsets(self._envelope[-min(self._envelope_count, self._history):],
+                                    self._envelope_rate)
+        bpm, confidence = estimate_tempo(envelope, self._envelope_rate, self.min_bpm, self.max_bpm)
+        if bpm <= 0:
+            return None
+        frames_back = estimate_beat(envelope, self._envelope_rate, bpm)
+        # Envelope value j covers the FFT frame centred on sample j*hop + fft_size/2
+        beat_frame = self._envelope_count - 1 - frames_back
+        beat_sample = beat_frame * self._detector.hop + self._detector.fft_size / 2
+        return BeatEstimate(bpm, self._start_time + beat_sample / self.source.sample_rate, confidence)
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                samples = self.source.read()
+                if samples is None:
+                    break
+                estimate = self.process(samples, self._clock())
+                if estimate is not None and estimate.confidence >= self.confidence_gate:
+                    with self._lock:
+                        self._latest = estimate
+        except Exception as e:
+            self.error = e
+            print(f"Beat tracker stopped: {e}")
+
+
+def analyze(source, min_bpm=MIN_BPM, max_bpm=MAX_BPM):
+    """Run a tracker over a whole (unpaced) source as fast as it decodes; returns every estimate.
+
+    Times are seconds from the start of the audio.
+    """
+    tracker = BeatTracker(source, min_bpm, max_bpm)
+    estimates = []
+    heard = 0
+    samples = source.read()
+    while samples is not None:
+        heard += len(samples)
+        estimate = tracker.process(samples, heard / source.sample_rate)
+        if estimate is not None:
+            estimates.append(estimate)
+        samples = source.read()
+    source.close()
+    return estimates
+
+
+def settled_estimate(estimates, confidence_gate=CONFIDENCE_GATE):
+    """Median tempo of the confident estimates in the second half of a run, or None"""
+    late = [e for e in estimates[len(estimates) // 2:] if e.confidence >= confidence_gate]
+    if not late:
+        return None
+    return float(np.median([e.bpm for e in late])), float(np.median([e.confidence for e in late]))
+
+
+def click_track(bpm, seconds, sample_rate=DEFAULT_SAMPLE_RATE, first_beat=0.1, noise=0.05, seed=0):
+    """Synthetic test signal: a short decaying 1 kHz click on every beat over a noise floor"""
+    rng = np.random.default_rng(seed)
+    signal = rng.normal(0.0, noise, int(seconds * sample_rate)).astype(np.float32)
+    click_length = int(0.03 * sample_rate)
+    t = np.arange(click_length) / sample_rate
+    click = (np.sin(2 * np.pi * 1000.0 * t) * np.exp(-t * 150.0)).astype(np.float32)
+    beat = first_beat
+    while beat * sample_rate + click_length < len(signal):
+        start = int(round(beat * sample_rate))
+        signal[start:start + click_length] += click
+        beat += 60.0 / bpm
+    return signal
+
+
+def write_wav(path, signal, sample_rate=DEFAULT_SAMPLE_RATE):
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((np.clip(signal, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+
+
+def phase_error(estimate, bpm, first_beat):
+    """Seconds between an estimated beat and the nearest real beat of a click track"""
+    period = 60.0 / bpm
+    offset = (estimate.beat_time - first_beat) % period
+    return min(offset, period - offset)
+
+
+def selftest(tolerance_bpm, max_phase_ms):
+    """Track synthetic click tracks written to WAV files; returns the number of failures"""
+    failures = 0
+    first_beat = 0.1
+    with tempfile.TemporaryDirectory() as tmp:
+        for bpm in (72.0, 100.0, 127.5, 128.0, 140.0, 174.0):
+            path = os.path.join(tmp, f"click_{bpm:g}.wav")
+            write_wav(path, click_track(bpm, 20.0, first_beat=first_beat))
+            estimates = analyze(wav_source(path, paced=False))
+            settled = settled_estimate(estimates)
+            if settled is None:
+                print(f"FAIL {bpm:g} BPM click track: no confident estimate")
+                failures += 1
+                continue
+            found, confidence = settled
+            worst_phase = max(phase_error(e, bpm, first_beat) for e in estimates[len(estimates) // 2:]) * 1000
+            ok = abs(found - bpm) <= tolerance_bpm and worst_phase <= max_phase_ms
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {bpm:g} BPM click track: {found:.2f} BPM, "
+                  f"confidence {confidence:.2f}, worst beat phase error {worst_phase:.1f} ms")
+        path = os.path.join(tmp, "noise.wav")
+        write_wav(path, np.random.default_rng(1).normal(0.0, 0.2, 20 * DEFAULT_SAMPLE_RATE))
+        settled = settled_estimate(analyze(wav_source(path, paced=False)))
+        ok = settled is None
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} white noise: " + ("no confident tempo" if ok else f"{settled[0]:.2f} BPM"))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Track the tempo and beat of an audio stream")
+    commands = parser.add_subparsers(dest="command", required=True)
+    analyze_parser = commands.add_parser("analyze", help="track a WAV file offline and report its tempo")
+    analyze_parser.add_argument("wav", help="WAV file")
+    analyze_parser.add_argument("--expect", type=float, help="known tempo; exit with status 1 if it isn't found")
+    analyze_parser.add_argument("--tolerance", type=float, default=0.5, help="BPM tolerance for --expect")
+    analyze_parser.add_argument("-v", "--verbose", action="store_true", help="print every estimate")
+    selftest_parser = commands.add_parser("selftest", help="track synthetic click tracks of known tempo")
+    selftest_parser.add_argument("--tolerance", type=float, default=0.5, help="BPM tolerance")
+    selftest_parser.add_argument("--max-phase-ms", type=float, default=15.0, help="beat phase tolerance")
+    listen_parser = commands.add_parser("listen", help="print live estimates from an audio source")
+    listen_parser.add_argument("source", help="'device', 'device:N', '-' for stdin, or a WAV file or FIFO")
+    listen_parser.add_argument("--rate", type=int, default=DEFAULT_SAMPLE_RATE, help="sample rate of raw PCM")
+    for command in (analyze_parser, listen_parser):
+        command.add_argument("--min-bpm", type=float, default=MIN_BPM)
+        command.add_argument("--max-bpm", type=float, default=MAX_BPM)
+    args = parser.parse_args(argv)
+
+    if args.command == "selftest":
+        failures = selftest(args.tolerance, args.max_phase_ms)
+        print("All click tracks tracked" if not failures else f"{failures} failures")
+        return 1 if failures else 0
+
+    if args.command == "analyze":
+        start = time.perf_counter()
+        estimates = analyze(wav_source(args.wav, paced=False), args.min_bpm, args.max_bpm)
+        elapsed = time.perf_counter() - start
+        if args.verbose:
+            for estimate in estimates:
+                print(estimate)
+        settled = settled_estimate(estimates)
+        if settled is None:
+            print(f"No confident tempo in {args.wav} ({len(estimates)} estimates, {elapsed:.2f}s)")
+            return 1 if args.expect is not None else 0
+        bpm, confidence = settled
+        print(f"{args.wav}: {bpm:.2f} BPM, confidence {confidence:.2f} ({len(estimates)} estimates, {elapsed:.2f}s)")
+        if args.expect is not None and abs(bpm - args.expect) > args.tolerance:
+            print(f"Expected {args.expect:g} BPM")
+            return 1
+        return 0
+
+    tracker = BeatTracker(open_source(args.source, args.rate), args.min_bpm, args.max_bpm)
+    tracker.start()
+    try:
+        while True:
+            running = tracker.running
+            estimate = tracker.poll()
+            if estimate is not None:
+                print(f"{estimate.bpm:7.2f} BPM  confidence {estimate.confidence:.2f}  "
+                      f"last beat {time.monotonic() - estimate.beat_time:5.3f}s ago")
+            if not running:
+                break
+            time.sleep(UPDATE_SECONDS)
+    except KeyboardInterrupt:
+        pass
+    tracker.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
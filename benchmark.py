@@ -0,0 +1,350 @@
+"""Benchmarks for the decode, scale, composite and export hot paths.
+
+Synthetic GIFs are generated from a fixed seed so every run measures the same
+work. Drawing runs under SDL's dummy video driver, so no display is needed.
+
+Example:
+    python benchmark.py run -o before.json
+    python benchmark.py run -o after.json
+    python benchmark.py compare before.json after.json --threshold 0.10
+"""
+import os
+
+# Drawing benchmarks blit to an off-screen display
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pygame
+from PIL import Image
+
+from beat_effects import BeatEffects, EFFECTS
+from crowd import FORMATIONS, MAX_CROWD_SIZE
+from frame_cache import ScaledFrameCache
+from frame_disk_cache import FrameDiskCache
+from gif_export import write_retimed_gif
+from gif_loader import GifLoadJob, decode_into, load_cached
+from gif_slot import GifSlot
+from stage_render import StageBackground, draw_gif_on_stage
+from sync_math import extract_beats_from_filename
+from thumbnail_strip import ThumbnailStrip
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SEED = 1234
+STAGE_SIZE = (1920, 1080)
+THUMBNAIL_STRIP_SIZE = (1920, 100)
+BACKGROUND_SIZE = (3840, 2160)
+# name -> (width, height, frames, colors, transparent)
+BENCH_GIFS = {
+    "small": (160, 120, 12, 16, False),
+    "medium": (480, 360, 48, 256, False),
+    "large_alpha": (800, 600, 60, 128, True),
+}
+CROWD_BENCH_ZOOM = 0.5  # Crowd benchmarks zoom the lead out so the formation fits the stage
+# Beat positions where each effect is at work: the downbeat pulse and flash peak, a hue step, a dark strobe
+EFFECT_BENCH_BEATS = {"pulse": 0.0, "flash": 0.0, "hue": 1.0, "strobe": 0.2, "trails": 0.0}
+QUICK_FRAME_LIMIT = 8  # --quick caps every synthetic GIF at this many frames
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+def make_gif(path, width, height, frames, colors, transparent, seed=SEED):
+    """Write a deterministic GIF: a blocky random pattern that scrolls every frame"""
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, (256, 3), dtype=np.uint8)
+    blocks = rng.integers(1 if transparent else 0, colors, (height // 8 + 2, width // 8 + 2), dtype=np.uint8)
+    pattern = np.kron(blocks, np.ones((8, 8), dtype=np.uint8))
+    if transparent:
+        # A transparent hole in every frame so disposal and alpha paths are exercised
+        pattern[height // 4:height // 2, width // 4:width // 2] = 0
+    images = []
+    for i in range(frames):
+        indices = np.roll(pattern, (i * 2, i * 3), axis=(0, 1))[:height, :width]
+        image = Image.fromarray(np.ascontiguousarray(indices), "P")
+        image.putpalette(palette.tobytes())
+        images.append(image)
+    save_kwargs = {"transparency": 0, "disposal": 2} if transparent else {}
+    images[0].save(path, save_all=True, append_images=images[1:], duration=40, loop=0, optimize=False,
+                   **save_kwargs)
+
+
+def decode_gif(path):
+    job = GifLoadJob(path, 0)
+    for _ in decode_into(job):
+        pass
+    return job
+
+
+def slot_from_job(job, index=0):
+    slot = GifSlot(index)
+    slot.set_frames(job.pixels, job.durations, job.palettes)
+    slot.original_size = job.size
+    slot.is_loaded = True
+    return slot
+
+
+def time_op(fn, repeat):
+    """Per-call seconds of fn over `repeat` runs, after one warm-up call"""
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench(results, name, fn, items, unit, repeat):
+    times = time_op(fn, repeat)
+    median = statistics.median(times)
+    results[name] = {
+        "seconds": median,
+        "best_seconds": min(times),
+        "throughput": items / median if median > 0 else float("inf"),
+        "unit": f"{unit}/s",
+        "repeat": repeat,
+    }
+    print(f"{name:<40} {median * 1000:9.2f} ms  {results[name]['throughput']:12.1f} {unit}/s")
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_suite(workdir, repeat, quick=False, name_filter=None):
+    pygame.init()
+    screen = pygame.display.set_mode(STAGE_SIZE)
+    stage_rect = screen.get_rect()
+    results = {}
+
+    def wanted(name):
+        return name_filter is None or name_filter in name
+
+    # Beat parsing: many filenames per call, like scanning a clip library
+    names = [f"/clips/set_{i}/dance_move_{i % 17}_{i % 8 + 1}B.gif" for i in range(10000)]
+    if wanted("extract_beats"):
+        bench(results, "extract_beats_from_filename", lambda: [extract_beats_from_filename(n) for n in names],
+              len(names), "calls", repeat)
+
+    disk_cache = FrameDiskCache(os.path.join(workdir, "frames"))
+    for gif_name, (width, height, frames, colors, transparent) in BENCH_GIFS.items():
+        if quick:
+            frames = min(frames, QUICK_FRAME_LIMIT)
+        path = os.path.join(workdir, f"bench_{gif_name}_4B.gif")
+        make_gif(path, width, height, frames, colors, transparent)
+        job = decode_gif(path)
+        frame_count = job.frame_count
+        pixels_per_op = frame_count * width * height / 1e6
+
+        if wanted(f"load_gif decode {gif_name}"):
+            bench(results, f"load_gif decode {gif_name}", lambda: decode_gif(path), pixels_per_op, "Mpx", repeat)
+        key = disk_cache.key_for(path)
+        disk_cache.store(key, job.pixels, job.durations, job.palettes, 4)
+        if wanted(f"load_gif disk cache {gif_name}"):
+            bench(results, f"load_gif disk cache {gif_name}",
+                  lambda: load_cached(GifLoadJob(path, 0), disk_cache, key), frame_count, "frames", repeat)
+
+        slot = slot_from_job(job)
+        for squad in (False, True):
+            mode = "squad" if squad else "normal"
+            warm_cache = ScaledFrameCache(1024 * 1024 * 1024)
+
+            def draw_loop(cache, clear=False):
+                for i in range(frame_count):
+                    if clear:
+                        cache.clear()
+                    slot.frame_idx = i
+                    draw_gif_on_stage(screen, stage_rect, slot, cache, 1.0, squad, 0.5, 80, False)
+
+            if wanted(f"draw_gif_on_stage {mode} {gif_name}"):
+                bench(results, f"draw_gif_on_stage {mode} {gif_name}", lambda: draw_loop(warm_cache),
+                      frame_count, "frames", repeat)
+            if wanted(f"draw_gif_on_stage {mode} cold {gif_name}"):
+                cold_cache = ScaledFrameCache(1024 * 1024 * 1024)
+                bench(results, f"draw_gif_on_stage {mode} cold {gif_name}",
+                      lambda: draw_loop(cold_cache, clear=True), frame_count, "frames", repeat)
+
+        # A full crowd on the 1080p stage; 60 fps needs well under 16.7 ms per frame
+        for formation in FORMATIONS[1:]:
+            name = f"draw_gif_on_stage crowd {formation} {gif_name}"
+            if not wanted(name):
+                continue
+            crowd_cache = ScaledFrameCache(1024 * 1024 * 1024)
+
+            def crowd_loop():
+                for i in range(frame_count):
+                    slot.frame_idx = i
+                    draw_gif_on_stage(screen, stage_rect, slot, crowd_cache, CROWD_BENCH_ZOOM, formation, 0.5, 80,
+                                      False, MAX_CROWD_SIZE)
+
+            bench(results, name, crowd_loop, frame_count, "frames", repeat)
+
+        # One effect at a time on the 1080p stage; cold clears the effect cache so every frame pays for the LUTs
+        effect_frame_cache = ScaledFrameCache(1024 * 1024 * 1024)
+        for effect in EFFECTS:
+            effects = BeatEffects([effect], 1024 * 1024 * 1024)
+            effects.set_beat(EFFECT_BENCH_BEATS[effect])
+
+            def effect_loop(clear=False):
+                for i in range(frame_count):
+                    if clear:
+                        effects.clear()
+                    slot.frame_idx = i
+                    draw_gif_on_stage(screen, stage_rect, slot, effect_frame_cache, 1.0, False, 0.5, 80, False,
+                                      effects=effects)
+
+            if wanted(f"beat effect {effect} {gif_name}"):
+                bench(results, f"beat effect {effect} {gif_name}", effect_loop, frame_count, "frames", repeat)
+            if wanted(f"beat effect {effect} cold {gif_name}"):
+                bench(results, f"beat effect {effect} cold {gif_name}", lambda: effect_loop(clear=True),
+                      frame_count, "frames", repeat)
+
+        if wanted(f"draw_thumbnail_strip {gif_name}"):
+            strip = ThumbnailStrip(*THUMBNAIL_STRIP_SIZE, 10)
+            strip_slots = [slot_from_job(job, i) for i in range(10)]
+            for strip_slot in strip_slots:
+                strip.build_thumbnails(strip_slot)
+            idle = [None] * 10
+
+            def strip_loop():
+                for i in range(frame_count):
+                    for strip_slot in strip_slots:
+                        strip_slot.frame_idx = i
+                    strip.update(strip_slots, 0, False, idle)
+                    strip.draw(screen, STAGE_SIZE[1] - THUMBNAIL_STRIP_SIZE[1])
+
+            bench(results, f"draw_thumbnail_strip {gif_name}", strip_loop, frame_count * 10, "cells", repeat)
+
+        if wanted(f"export_adjusted_gif {gif_name}"):
+            open_frames = slot.export_frames()
+            out_path = os.path.join(workdir, f"export_{gif_name}.gif")
+            bench(results, f"export_adjusted_gif {gif_name}",
+                  lambda: write_retimed_gif(open_frames, slot.durations, sum(slot.durations) / 1.5, out_path),
+                  frame_count, "frames", repeat)
+
+    if wanted("draw_stage_background"):
+        rng = np.random.default_rng(SEED)
+        bg_path = os.path.join(workdir, "bench_background.png")
+        noise = rng.integers(0, 256, (BACKGROUND_SIZE[1] // 16, BACKGROUND_SIZE[0] // 16, 3), dtype=np.uint8)
+        Image.fromarray(np.kron(noise, np.ones((16, 16, 1), dtype=np.uint8))).save(bg_path)
+        background = StageBackground(downscale_on_load=False)
+        background.set_image(bg_path)
+        bench(results, "draw_stage_background image", lambda: background.draw(screen, stage_rect), 1, "draws", repeat)
+
+        def cold_background():
+            background.clear_scaled()
+            background.draw(screen, stage_rect)
+
+        bench(results, "draw_stage_background image cold", cold_background, 1, "draws", repeat)
+        color_background = StageBackground()
+        bench(results, "draw_stage_background color", lambda: color_background.draw(screen, stage_rect),
+              1, "draws", repeat)
+
+    pygame.quit()
+    return results
+
+
+def run(args):
+    with tempfile.TemporaryDirectory(prefix="bpmdotgif-bench-") as workdir:
+        start = time.perf_counter()
+        results = run_suite(workdir, args.repeat, args.quick, args.filter)
+        elapsed = time.perf_counter() - start
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "quick": args.quick,
+            "elapsed_seconds": elapsed,
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    rss = report["peak_rss_mb"]
+    print(f"{len(results)} benchmarks in {elapsed:.1f}s, peak RSS "
+          f"{'n/a' if rss is None else f'{rss:.0f} MB'} -> {args.output}")
+    return 0
+
+
+def compare(args):
+    """Print per-benchmark changes; exit 1 if any got slower than the threshold allows"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    regressions = []
+    print(f"{'benchmark':<40} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    for name, base in baseline["results"].items():
+        new = candidate["results"].get(name)
+        if new is None:
+            print(f"{name:<40} {base['seconds'] * 1000:8.2f}ms {'missing':>10}")
+            continue
+        change = new["seconds"] / base["seconds"] - 1.0 if base["seconds"] > 0 else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -args.threshold:
+            flag = "  faster"
+        print(f"{name:<40} {base['seconds'] * 1000:8.2f}ms {new['seconds'] * 1000:8.2f}ms {change:+7.1%}{flag}")
+    for name in candidate["results"]:
+        if name not in baseline["results"]:
+            print(f"{name:<40} {'new':>10} {candidate['results'][name]['seconds'] * 1000:8.2f}ms")
+
+    base_rss, new_rss = baseline.get("peak_rss_mb"), candidate.get("peak_rss_mb")
+    if base_rss and new_rss:
+        rss_change = new_rss / base_rss - 1.0
+        flag = ""
+        if rss_change > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append("peak RSS")
+        print(f"{'peak RSS':<40} {base_rss:8.0f}MB {new_rss:8.0f}MB {rss_change:+7.1%}{flag}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print(f"No regressions over {args.threshold:.0%}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the GIF BPM Sync Tool hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks and write a JSON report")
+    run_parser.add_argument("-o", "--output", default="benchmark_results.json", help="report file")
+    run_parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark (median is reported)")
+    run_parser.add_argument("--quick", action="store_true", help=f"cap GIFs at {QUICK_FRAME_LIMIT} frames")
+    run_parser.add_argument("--filter", help="only run benchmarks whose name contains this text")
+    compare_parser = commands.add_parser("compare", help="compare two reports and flag regressions")
+    compare_parser.add_argument("baseline", help="report from the reference build")
+    compare_parser.add_argument("candidate", help="report from the build being checked")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                                help="relative slowdown that counts as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return run(args)
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,601 @@
+"""Remote control over the network: OSC over UDP, WebSocket JSON and HTTP.
+
+Lets a lighting desk or a second laptop drive the slot, tempo, pause, taps
+and set list banks. The server runs an asyncio loop on its own thread and
+hands commands to the main loop through a deque. Appends and pops on a deque
+are atomic, so neither side takes a lock. The main loop applies them once per
+tick with drain(). Taps are stamped with time.monotonic() the moment their
+packet arrives, so the tempo fit sees when the operator tapped and not when
+the main loop got round to it. State the main loop publishes is pushed to
+every WebSocket client and served at GET /state.
+
+OSC addresses (argument in brackets is optional):
+    /bpm f   /nudge f   /halve   /double   /tap   /pause [T|F|i]   /play
+    /slot i (1-10)   /bank i (1-n)   /bank/next   /bank/prev
+WebSocket text messages are JSON objects (or lists of them) with the same
+names, e.g. {"cmd": "bpm", "value": 128} or {"cmd": "bank_next"}. Browsers
+send an Origin header, and only pages served from this machine or from an
+allowed origin may connect; tools that send no Origin are always accepted.
+
+Example:
+    python control_server.py bench
+    python control_server.py bench --count 2000 --tick-ms 16.7
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import math
+import os
+import socket
+import statistics
+import struct
+import sys
+import threading
+import time
+
+DEFAULT_HOST = "127.0.0.1"  # Use 0.0.0.0 to accept the lighting desk and other machines
+DEFAULT_HTTP_PORT = 8765  # HTTP and WebSocket
+DEFAULT_OSC_PORT = 9000
+MAX_MESSAGE_BYTES = 64 * 1024
+MAX_PENDING_BYTES = 256 * 1024  # State pushes to a WebSocket client this far behind are skipped
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# command -> argument type (None for commands without an argument)
+COMMAND_ARGS = {
+    "bpm": float,
+    "nudge": float,
+    "halve": None,
+    "double": None,
+    "tap": None,
+    "pause": bool,  # No argument toggles
+    "play": None,
+    "slot": int,
+    "bank": int,
+    "bank_next": None,
+    "bank_prev": None,
+}
+OPTIONAL_ARGS = {"pause"}
+LOCAL_ORIGIN_HOSTS = {"localhost", "127.0.0.1", "[::1]"}
+
+
+class ControlCommand:
+    """A remote command: its name, argument (or None) and the monotonic time it arrived"""
+
+    __slots__ = ('name', 'value', 'time', 'source')
+
+    def __init__(self, name, value, time, source):
+        self.name = name
+        self.value = value
+        self.time = time
+        self.source = source
+
+    def __repr__(self):
+        return f"ControlCommand({self.name}, {self.value!r}, from {self.source} at {self.time:.4f})"
+
+
+def make_command(name, value, received, source):
+    """Validate a command and convert its argument; raises ValueError"""
+    if name not in COMMAND_ARGS:
+        raise ValueError(f"unknown command {name!r}")
+    kind = COMMAND_ARGS[name]
+    if kind is None:
+        value = None
+    elif value is None:
+        if name not in OPTIONAL_ARGS:
+            raise ValueError(f"{name} needs a value")
+    elif kind is bool:
+        if not isinstance(value, (bool, int)):
+            raise ValueError(f"{name} takes true/false")
+        value = bool(value)
+    else:
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{name} takes a number")
+        if kind is int and value != int(value):
+            raise ValueError(f"{name} takes a whole number")
+        value = kind(value)
+    return ControlCommand(name, value, received, source)
+
+
+def _osc_string(data, offset):
+    end = data.find(b"\0", offset)
+    if end < 0:
+        raise ValueError("unterminated OSC string")
+    return data[offset:end].decode("utf-8"), (end + 4) & ~3
+
+
+def parse_osc(data):
+    """(address, arguments) of every message in an OSC packet; bundles are flattened.
+
+    Raises ValueError (or struct.error) on a malformed packet.
+    """
+    if data.startswith(b"#bundle\0"):
+        messages = []
+        offset = 16  # "#bundle\0" and the 8-byte time tag
+        while offset < len(data):
+            size, = struct.unpack_from(">i", data, offset)
+            offset += 4
+            if size <= 0 or offset + size > len(data):
+                raise ValueError("bad OSC bundle element size")
+            messages.extend(parse_osc(data[offset:offset + size]))
+            offset += size
+        return messages
+    address, offset = _osc_string(data, 0)
+    if not address.startswith("/"):
+        raise ValueError(f"bad OSC address {address!r}")
+    tags = ","
+    if offset < len(data):
+        tags, offset = _osc_string(data, offset)
+    if not tags.startswith(","):
+        raise ValueError("missing OSC type tags")
+    args = []
+    for tag in tags[1:]:
+        if tag == "i":
+            args.append(struct.unpack_from(">i", data, offset)[0])
+            offset += 4
+        elif tag == "f":
+            args.append(struct.unpack_from(">f", data, offset)[0])
+            offset += 4
+        elif tag == "h":
+            args.append(struct.unpack_from(">q", data, offset)[0])
+            offset += 8
+        elif tag == "d":
+            args.append(struct.unpack_from(">d", data, offset)[0])
+            offset += 8
+        elif tag == "s":
+            value, offset = _osc_string(data, offset)
+            args.append(value)
+        elif tag in "TF":
+            args.append(tag == "T")
+        elif tag == "N":
+            args.append(None)
+        else:
+            raise ValueError(f"unsupported OSC type tag {tag!r}")
+    return [(address, args)]
+
+
+def _osc_pad(data):
+    return data + b"\0" * (4 - len(data) % 4)
+
+
+def osc_message(address, *args):
+    """Encode an OSC message (ints, floats, strings and bools)"""
+    tags = ","
+    payload = b""
+    for arg in args:
+        if isinstance(arg, bool):
+            tags += "T" if arg else "F"
+        elif isinstance(arg, int):
+            tags += "i"
+            payload += struct.pack(">i", arg)
+        elif isinstance(arg, float):
+            tags += "f"
+            payload += struct.pack(">f", arg)
+        else:
+            tags += "s"
+            payload += _osc_pad(str(arg).encode("utf-8"))
+    return _osc_pad(address.encode("utf-8")) + _osc_pad(tags.encode("ascii")) + payload
+
+
+def websocket_frame(opcode, payload, mask=None):
+    """Encode a single-frame WebSocket message (clients must pass a 4-byte mask)"""
+    length = len(payload)
+    mask_bit = 0x80 if mask is not None else 0
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, mask_bit | length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, mask_bit | 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, mask_bit | 127, length)
+    if mask is None:
+        return header + payload
+    return header + mask + _apply_mask(payload, mask)
+
+
+def _apply_mask(payload, mask):
+    if not payload:
+        return payload
+    key = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(len(payload), "big")
+
+
+async def read_websocket_frame(reader):
+    """(final fragment, opcode, unmasked payload) of the next frame"""
+    head = await reader.readexactly(2)
+    length = head[1] & 0x7F
+    if length == 126:
+        length, = struct.unpack(">H", await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack(">Q", await reader.readexactly(8))
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError("message too big")
+    mask = await reader.readexactly(4) if head[1] & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask is not None:
+        payload = _apply_mask(payload, mask)
+    return bool(head[0] & 0x80), head[0] & 0x0F, payload
+
+
+def http_response(status, body=b"", content_type="application/json"):
+    return (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Cache-Control: no-store\r\nConnection: close\r\n\r\n").encode("ascii") + body
+
+
+def origin_allowed(origin, allowed_origins=()):
+    """True for requests without an Origin, from a page on this machine or from an allowed origin"""
+    if origin is None:
+        return True  # Not a browser (OSC bridges, scripts, the bench client)
+    origin = origin.lower().rstrip("/")
+    if origin in allowed_origins:
+        return True
+    scheme, _, host = origin.partition("://")
+    if scheme not in ("http", "https"):
+        return False
+    if host.startswith("["):
+        host = host[:host.find("]") + 1]
+    else:
+        host = host.split(":")[0]
+    return host in LOCAL_ORIGIN_HOSTS
+
+
+class _OscProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        received = time.monotonic()
+        try:
+            messages = parse_osc(data)
+        except (ValueError, struct.error, UnicodeDecodeError) as e:
+            self.server.reject(f"OSC from {addr[0]}: {e}")
+            return
+        for address, args in messages:
+            name = address.strip("/").replace("/", "_")
+            error = self.server.submit(name, args[0] if args else None, received, "osc")
+            if error is not None:
+                self.server.reject(f"OSC {address} from {addr[0]}: {error}")
+
+
+class ControlServer:
+    """HTTP/WebSocket and OSC control endpoints on an asyncio thread.
+
+    Ports of None turn an endpoint off; port 0 picks a free one (the real
+    port is in http_port/osc_port after start()). HTTP and WebSocket
+    requests from a browser page are refused unless the page is on this
+    machine or its origin is in allowed_origins. Commands wait in a deque
+    until the main loop calls drain(); wake, if given, is called on the
+    server thread when a command arrives to an empty queue so a sleeping
+    main loop can wake up. publish() sends the app state to WebSocket
+    clients whenever it changes.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, http_port=DEFAULT_HTTP_PORT, osc_port=DEFAULT_OSC_PORT, wake=None,
+                 allowed_origins=()):
+        self.host = host
+        self.allowed_origins = {origin.lower().rstrip("/") for origin in allowed_origins}
+        self.http_port = http_port
+        self.osc_port = osc_port
+        self.wake = wake
+        self.error = None
+        self.received = 0
+        self.rejected = 0
+        self._commands = collections.deque()
+        self._state = {}
+        self._state_message = b"{}"
+        self._websockets = set()
+        self._servers = []
+        self._loop = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="control-server", daemon=True)
+
+    def start(self):
+        """Open the endpoints; raises OSError if a port can't be bound"""
+        self._thread.start()
+        self._ready.wait()
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        if self._loop is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=2.0)
+
+    def drain(self):
+        """Commands received since the last call, oldest first (main thread)"""
+        commands = []
+        while self._commands:
+            commands.append(self._commands.popleft())
+        return commands
+
+    def publish(self, state):
+        """Push the app state to WebSocket clients if it changed (main thread)"""
+        if state == self._state:
+            return
+        self._state = state
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._broadcast, json.dumps(state).encode("utf-8"))
+
+    def submit(self, name, value, received, source):
+        """Queue a command; returns an error message if it was rejected"""
+        try:
+            command = make_command(name, value, received, source)
+        except ValueError as e:
+            return str(e)
+        was_empty = not self._commands
+        self._commands.append(command)
+        self.received += 1
+        if was_empty and self.wake is not None:
+            self.wake()
+        return None
+
+    def reject(self, message):
+        self.rejected += 1
+        print(f"Control: rejected {message}")
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._open(loop))
+        except OSError as e:
+            self.error = e
+            self._ready.set()
+            loop.run_until_complete(self._close())
+            loop.close()
+            return
+        self._loop = loop
+        self._ready.set()
+        loop.run_forever()
+        loop.run_until_complete(self._close())
+        loop.close()
+
+    async def _open(self, loop):
+        if self.http_port is not None:
+            server = await asyncio.start_server(self._client, self.host, self.http_port)
+            self._servers.append(server)
+            self.http_port = server.sockets[0].getsockname()[1]
+        if self.osc_port is not None:
+            transport, _ = await loop.create_datagram_endpoint(lambda: _OscProtocol(self),
+                                                               local_addr=(self.host, self.osc_port))
+            self._servers.append(transport)
+            self.osc_port = transport.get_extra_info("sockname")[1]
+
+    async def _close(self):
+        for writer in list(self._websockets):
+            writer.close()
+        for server in self._servers:
+            server.close()
+
+    def _broadcast(self, message):
+        self._state_message = message
+        frame = websocket_frame(0x1, message)
+        for writer in list(self._websockets):
+            # A client that stopped reading misses updates instead of growing our buffer
+            if writer.transport.get_write_buffer_size() < MAX_PENDING_BYTES:
+                writer.write(frame)
+
+    async def _client(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            lines = request.decode("latin-1").split("\r\n")
+            method, path = lines[0].split(" ")[:2]
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    key, value = line.split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+            if not origin_allowed(headers.get("origin"), self.allowed_origins):
+                self.reject(f"request from origin {headers['origin']}")
+                writer.write(http_response("403 Forbidden", b'{"error": "origin not allowed"}'))
+            elif headers.get("upgrade", "").lower() == "websocket" and "sec-websocket-key" in headers:
+                await self._websocket(reader, writer, headers["sec-websocket-key"])
+            elif method != "GET":
+                writer.write(http_response("405 Method Not Allowed"))
+            elif path.split("?")[0] == "/state":
+                writer.write(http_response("200 OK", self._state_message))
+            else:
+                writer.write(http_response("404 Not Found", b'{"error": "try GET /state or a WebSocket"}'))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._websockets.discard(writer)
+            writer.close()
+
+    async def _websocket(self, reader, writer, key):
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        writer.write(websocket_frame(0x1, self._state_message))
+        self._websockets.add(writer)
+        message = b""
+        while True:
+            final, opcode, payload = await read_websocket_frame(reader)
+            received = time.monotonic()
+            if opcode == 0x8:
+                writer.write(websocket_frame(0x8, payload[:2]))
+                return
+            if opcode == 0x9:
+                writer.write(websocket_frame(0xA, payload))
+                continue
+            if opcode not in (0x0, 0x1):
+                continue  # Pongs and binary frames
+            message += payload
+            if len(message) > MAX_MESSAGE_BYTES:
+                raise ValueError("message too big")
+            if not final:
+                continue
+            errors = self._websocket_commands(message, received)
+            message = b""
+            if errors:
+                writer.write(websocket_frame(0x1, json.dumps({"error": "; ".join(errors)}).encode("utf-8")))
+
+    def _websocket_commands(self, message, received):
+        try:
+            data = json.loads(message)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            self.rejected += 1
+            return [f"not JSON: {e}"]
+        errors = []
+        for item in data if isinstance(data, list) else [data]:
+            if not isinstance(item, dict) or not isinstance(item.get("cmd"), str):
+                error = "a command is an object with a \"cmd\""
+            else:
+                error = self.submit(item["cmd"], item.get("value"), received, "websocket")
+            if error is not None:
+                self.rejected += 1
+                errors.append(error)
+        return errors
+
+
+class WebSocketClient:
+    """Minimal blocking WebSocket client, used by the loopback benchmark"""
+
+    def __init__(self, host, port, path="/"):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        self.sock.sendall((f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\n"
+                           f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                           f"Sec-WebSocket-Version: 13\r\n\r\n").encode("ascii"))
+        self._buffer = b""
+        response = self._read_until(b"\r\n\r\n")
+        if not response.startswith(b"HTTP/1.1 101"):
+            raise ConnectionError(f"WebSocket handshake failed: {response.splitlines()[0]!r}")
+
+    def _read_until(self, marker):
+        while marker not in self._buffer:
+            self._fill()
+        head, self._buffer = self._buffer.split(marker, 1)
+        return head
+
+    def _fill(self):
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("connection closed")
+        self._buffer += chunk
+
+    def _read(self, n):
+        while len(self._buffer) < n:
+            self._fill()
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def send_json(self, data):
+        self.sock.sendall(websocket_frame(0x1, json.dumps(data).encode("utf-8"), os.urandom(4)))
+
+    def recv_json(self):
+        """Next text message from the server, decoded"""
+        while True:
+            head = self._read(2)
+            length = head[1] & 0x7F
+            if length == 126:
+                length, = struct.unpack(">H", self._read(2))
+            elif length == 127:
+                length, = struct.unpack(">Q", self._read(8))
+            payload = self._read(length)
+            if head[0] & 0x0F == 0x1:
+                return json.loads(payload)
+
+    def close(self):
+        try:
+            self.sock.sendall(websocket_frame(0x8, struct.pack(">H", 1000), os.urandom(4)))
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def percentiles_ms(seconds):
+    ordered = sorted(seconds)
+
+    def at(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": ordered[-1] * 1000,
+            "mean": statistics.fmean(ordered) * 1000}
+
+
+def bench(count=1000, tick_ms=1000 / 60, interval_ms=1.0):
+    """Drive a server over loopback and report latencies in ms; returns {name: percentiles}.
+
+    A thread stands in for the main loop: every tick_ms it drains the queue
+    and publishes the new tempo, like the app does once per frame.
+    """
+    server = ControlServer(DEFAULT_HOST, 0, 0)
+    server.start()
+    sent = {}  # nudge value -> perf time it was sent
+    receipt, applied = [], []
+    stopping = threading.Event()
+    published = {"bpm": 0.0}
+
+    def main_loop():
+        while not stopping.is_set():
+            now = time.monotonic()
+            for command in server.drain():
+                if command.name == "nudge":
+                    receipt.append(command.time - sent[command.value])
+                    applied.append(now - sent[command.value])
+                elif command.name == "bpm":
+                    published["bpm"] = command.value
+            server.publish(dict(published))
+            time.sleep(tick_ms / 1000)
+
+    consumer = threading.Thread(target=main_loop, daemon=True)
+    consumer.start()
+    osc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for i in range(count):
+        sent[float(i)] = time.monotonic()
+        osc.sendto(osc_message("/nudge", float(i)), (DEFAULT_HOST, server.osc_port))
+        time.sleep(interval_ms / 1000)
+    deadline = time.monotonic() + 2.0
+    while len(applied) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    osc.close()
+
+    client = WebSocketClient(DEFAULT_HOST, server.http_port)
+    client.recv_json()  # Current state, sent on connect
+    round_trips = []
+    for i in range(count):
+        bpm = 100.0 + i % 100 + 0.5
+        start = time.monotonic()
+        client.send_json({"cmd": "bpm", "value": bpm})
+        while client.recv_json().get("bpm") != bpm:
+            pass
+        round_trips.append(time.monotonic() - start)
+    client.close()
+    stopping.set()
+    consumer.join()
+    server.stop()
+
+    results = {
+        "osc receipt": percentiles_ms(receipt),
+        "osc to main loop": percentiles_ms(applied),
+        "websocket round trip": percentiles_ms(round_trips),
+    }
+    lost = count - len(receipt)
+    print(f"{count} commands per test, main loop tick {tick_ms:.1f} ms, {lost} OSC packets lost")
+    print(f"{'latency (ms)':<24} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for name, stats in results.items():
+        print(f"{name:<24} {stats['p50']:8.3f} {stats['p95']:8.3f} {stats['p99']:8.3f} {stats['max']:8.3f}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remote control server for the GIF BPM Sync Tool")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench_parser = commands.add_parser("bench", help="measure command latency with a loopback client")
+    bench_parser.add_argument("--count", type=int, default=1000, help="commands sent per test")
+    bench_parser.add_argument("--tick-ms", type=float, default=1000 / 60,
+                              help="simulated main loop tick (default: 60 fps)")
+    bench_parser.add_argument("--interval-ms", type=float, default=1.0, help="time between OSC sends")
+    bench_parser.add_argument("-o", "--output", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+    results = bench(args.count, args.tick_ms, args.interval_ms)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""Crowd layouts for squad mode: the lead dancer plus backup dancers in formation.
+
+A layout is a table of (x, y, width, height, frame offset) entries, back to
+front, computed once per stage size and setting and then reused every frame.
+Backup dancers stand on whole depth rows and their phase offsets are rounded
+to a few steps, so even a crowd of a hundred shares a handful of scaled frames.
+"""
+import functools
+import math
+
+FORMATIONS = ("squad", "rows", "arc", "grid")  # The Squad button cycles through these, then off
+CROWD_SIZES = (3, 5, 10, 20, 30, 50, 75, 100)  # Dancer counts (lead included) that [ and ] step through
+DEFAULT_CROWD_SIZE = 3  # The lead and two backup dancers
+MAX_CROWD_SIZE = 100
+DEPTH_STEP = 0.35  # A dancer n rows back is drawn at 1 / (1 + n * DEPTH_STEP) of the front size
+HORIZON = 0.2  # Rows recede towards this height, as a fraction of the stage from the top
+PHASE_SPREAD = 0.25  # Largest phase offset between dancers, as a fraction of the GIF loop
+PHASE_STEPS = 4  # Offsets are rounded to this many steps so dancers share frames
+
+
+def formation_for(squad_mode):
+    """Formation name for a squad setting: True is the classic squad, False is none"""
+    if squad_mode is True:
+        return FORMATIONS[0]
+    if not squad_mode:
+        return None
+    if squad_mode not in FORMATIONS:
+        raise ValueError(f"unknown formation {squad_mode!r} (choose from {', '.join(FORMATIONS)})")
+    return squad_mode
+
+
+def next_formation(squad_mode):
+    """The squad setting after squad_mode in the Squad button's cycle"""
+    formation = formation_for(squad_mode)
+    if formation is None:
+        return FORMATIONS[0]
+    index = FORMATIONS.index(formation) + 1
+    return FORMATIONS[index] if index < len(FORMATIONS) else False
+
+
+def step_crowd_size(crowd_size, step):
+    """The next crowd size up (step > 0) or down from crowd_size"""
+    if step > 0:
+        return next((n for n in CROWD_SIZES if n > crowd_size), CROWD_SIZES[-1])
+    return next((n for n in reversed(CROWD_SIZES) if n < crowd_size), CROWD_SIZES[0])
+
+
+def _squad_places(count, offset):
+    """Backup dancers in pairs either side of the lead, the outermost pair at the back"""
+    pairs = (count + 1) // 2
+    places = []
+    for i in range(count):
+        pair = i // 2 + 1
+        side = -1 if i % 2 == 0 else 1
+        places.append((side * pair * offset, pair, (pair - 1) / max(1, pairs - 1)))
+    places.sort(key=lambda place: -place[1])
+    return places
+
+
+def _row_places(count, step, visible_width):
+    """Staggered rows that fill the stage width, more dancers per row further back"""
+    places = []
+    row = 0
+    while len(places) < count:
+        row += 1
+        capacity = max(2, int(visible_width * (1 + row * DEPTH_STEP) / step))
+        n = min(capacity, count - len(places))
+        stagger = step / 2 if row % 2 == 0 and n < capacity else 0.0
+        for i in range(n):
+            places.append(((i - (n - 1) / 2) * step + stagger, row))
+    widest = max(abs(wx) for wx, _ in places) or 1.0
+    # A wave that starts at the middle and runs out to both wings
+    return [(wx, row, abs(wx) / widest) for wx, row in places]
+
+
+def _grid_places(count, step):
+    """A block of aligned columns, about twice as wide as it is deep"""
+    columns = max(1, math.ceil(math.sqrt(count * 2)))
+    rows = math.ceil(count / columns)
+    places = []
+    for i in range(count):
+        row, column = divmod(i, columns)
+        n = columns if row < rows - 1 else count - row * columns
+        wx = (column - (n - 1) / 2) * step
+        # A ripple running diagonally from the front middle to the back corners
+        places.append((wx, row + 1, (row + abs(column - (n - 1) / 2)) / max(1, rows - 1 + (columns - 1) / 2)))
+    return places
+
+
+def _arc_places(count, step):
+    """Half rings opening towards the audience, a wider ring behind each full one"""
+    places = []
+    ring = 0
+    while len(places) < count:
+        ring += 1
+        radius = ring * step * 1.5
+        capacity = max(3, int(math.pi * radius / step) + 1)
+        n = min(capacity, count - len(places))
+        for i in range(n):
+            angle = math.pi * (i + 0.5) / n if n < capacity else math.pi * i / (n - 1)
+            depth = 1 + round(2 * radius * math.sin(angle))
+            # A sweep from one end of the arc to the other
+            places.append((-radius * math.cos(angle), depth, angle / math.pi))
+    return places
+
+
+@functools.lru_cache(maxsize=32)
+def crowd_layout(stage_rect, slot_size, frame_count, zoom_level, squad_mode, squad_spacing, squad_size,
+                 crowd_size=DEFAULT_CROWD_SIZE):
+    """Layout table for a stage: (x, y, width, height, frame offset) per dancer, back to front.
+
+    stage_rect is an (x, y, width, height) tuple. The lead dancer comes last
+    and always has offset 0. Results are cached, so calling this every frame
+    costs a dictionary lookup until a setting changes.
+    """
+    stage_x, stage_y, stage_width, stage_height = stage_rect
+    slot_width, slot_height = slot_size
+    lead_scale = min(stage_width / slot_width, stage_height / slot_height) * zoom_level
+    lead_width = int(slot_width * lead_scale)
+    lead_height = int(slot_height * lead_scale)
+    lead_x = stage_x + (stage_width - lead_width) // 2
+    lead_y = stage_y + (stage_height - lead_height) // 2
+    lead = (lead_x, lead_y, lead_width, lead_height, 0)
+    formation = formation_for(squad_mode)
+    if formation is None:
+        return (lead,)
+
+    # Backup dancer size and spacing from the Size and Spacing sliders
+    size_multiplier = 0.25 + (squad_size / 100.0) * 0.75
+    backup_scale = lead_scale * size_multiplier
+    count = max(1, min(crowd_size, MAX_CROWD_SIZE) - 1)
+    lead_center_x = lead_x + lead_width / 2.0
+    if formation == "squad":
+        # Side by side with the lead, centered on it; spacing 0 is directly behind
+        backup_width = int(slot_width * backup_scale)
+        backup_height = int(slot_height * backup_scale)
+        backup_y = int(lead_y + (lead_height - backup_height) / 2.0)
+        places = _squad_places(count, squad_spacing ** 2 * lead_width)
+        dancers = [(int(lead_center_x + wx - backup_width / 2.0), backup_y, backup_width, backup_height, phase)
+                   for wx, _, phase in places]
+    else:
+        # Rows recede towards the horizon; x is in lead widths and depth in rows
+        step = size_multiplier * (0.6 + 1.4 * squad_spacing ** 2)
+        if formation == "rows":
+            places = _row_places(count, step, stage_width / max(1, lead_width))
+        elif formation == "grid":
+            places = _grid_places(count, step)
+        else:
+            places = _arc_places(count, step)
+        horizon = stage_y + stage_height * HORIZON
+        lead_bottom = lead_y + lead_height
+        dancers = []
+        for wx, depth, phase in sorted(places, key=lambda place: -place[1]):
+            depth_scale = 1.0 / (1.0 + depth * DEPTH_STEP)
+            width = max(1, int(slot_width * backup_scale * depth_scale))
+            height = max(1, int(slot_height * backup_scale * depth_scale))
+            bottom = horizon + (lead_bottom - horizon) * depth_scale
+            x = lead_center_x + wx * lead_width * depth_scale - width / 2.0
+            dancers.append((int(x), int(bottom - height), width, height, phase))
+
+    # Phase offsets become whole frames, rounded to PHASE_STEPS steps
+    table = []
+    for x, y, width, height, phase in dancers:
+        offset = round(round(phase * (PHASE_STEPS - 1)) / (PHASE_STEPS - 1) * PHASE_SPREAD * frame_count)
+        table.append((x, y, width, height, offset % frame_count))
+    table.append(lead)
+    return tuple(table)
+
+
+def dancer_frame(slot, offset):
+    """The frame a dancer offset by `offset` frames from the slot's current frame shows"""
+    if offset == 0:
+        return slot.frame_idx
+    frame_idx = (slot.frame_idx + offset) % slot.frame_count
+    if slot.is_streaming and not slot.pixels.ready(frame_idx):
+        # Only the decode window is in memory; fall in step with the lead
+        return slot.frame_idx
+    return frame_idx
@@ -0,0 +1,51 @@
+import time
+
+import pygame
+
+
+class DamageTracker:
+    """Collects the screen regions redrawn this tick and counts redrawn pixels.
+
+    The main loop adds a rect for everything it draws and hands flush() to
+    pygame.display.update, so unchanged parts of the window are never pushed.
+    pixels_per_second and full_fraction (redrawn pixels relative to redrawing
+    the whole window every tick) are refreshed once a second.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._rects = []
+        self._window_start = clock()
+        self._window_pixels = 0
+        self._window_full_pixels = 0
+        self.pixels_per_second = 0.0
+        self.full_fraction = 0.0
+
+    def add(self, rect):
+        self._rects.append(pygame.Rect(rect))
+
+    def __bool__(self):
+        return bool(self._rects)
+
+    def flush(self, screen_size):
+        """Return this tick's damaged rects (clipped to the screen) and reset"""
+        screen_rect = pygame.Rect((0, 0), screen_size)
+        rects = [r.clip(screen_rect) for r in self._rects]
+        rects = [r for r in rects if r.width and r.height]
+        self._rects = []
+
+        self._window_pixels += sum(r.width * r.height for r in rects)
+        self._window_full_pixels += screen_rect.width * screen_rect.height
+        now = self._clock()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.pixels_per_second = self._window_pixels / elapsed
+            self.full_fraction = self._window_pixels / max(1, self._window_full_pixels)
+            self._window_start = now
+            self._window_pixels = 0
+            self._window_full_pixels = 0
+        return rects
+
+    def summary(self):
+        return (f"{self.pixels_per_second / 1e6:.1f} Mpx/s redrawn "
+                f"({self.full_fraction:.0%} of full redraws)")
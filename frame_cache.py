@@ -0,0 +1,97 @@
+import collections
+
+import pygame
+
+
+class ScaledFrameCache:
+    """Bounded LRU cache of scaled, flipped and display-converted GIF frames.
+
+    Entries are keyed on (slot index, frame index, target size, flip) so a
+    playing GIF only pays for smoothscale during its first loop. The cache is
+    capped by the pixel memory of the stored surfaces, not by entry count.
+    With smooth off (the frame governor's first quality step) misses use the
+    cheaper nearest-neighbour scale; once smooth is back on, those frames are
+    rescaled properly the next time they are drawn.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.smooth = True
+        self._entries = collections.OrderedDict()
+        self._rough = set()  # Keys of entries scaled while smooth was off
+
+    def get(self, slot, frame_idx, size, flip=False):
+        """Return the frame scaled to size (and flipped), scaling it on a miss"""
+        key = (slot.index, frame_idx, size, flip)
+        surface = self._entries.get(key)
+        if surface is not None and not (self.smooth and key in self._rough):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        scale = pygame.transform.smoothscale if self.smooth else pygame.transform.scale
+        surface = scale(slot.get_frame(frame_idx), size)
+        if flip:
+            surface = pygame.transform.flip(surface, True, False)
+        if pygame.display.get_surface() is not None:
+            # Match the display pixel format so the blit is a straight copy
+            surface = surface.convert_alpha()
+        self._store(key, surface)
+        if not self.smooth and key in self._entries:
+            self._rough.add(key)
+        return surface
+
+    def _store(self, key, surface):
+        size_bytes = surface.get_width() * surface.get_height() * surface.get_bytesize()
+        if key in self._entries:
+            # A rough frame being replaced by its smooth version
+            self._drop(key)
+        if size_bytes > self.max_bytes:
+            # Too big to ever fit, don't flush everything else for it
+            return
+        self._entries[key] = surface
+        self.current_bytes += size_bytes
+        while self.current_bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        surface = self._entries.pop(key)
+        self.current_bytes -= surface.get_width() * surface.get_height() * surface.get_bytesize()
+        self._rough.discard(key)
+
+    def invalidate_slot(self, slot_index):
+        """Drop every cached frame belonging to a slot (e.g. after a reload)"""
+        for key in [k for k in self._entries if k[0] == slot_index]:
+            self._drop(key)
+
+    def clear(self):
+        """Drop all cached frames (e.g. when zoom or stage size changes)"""
+        self._entries.clear()
+        self._rough.clear()
+        self.current_bytes = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hit_rate': self.hit_rate(),
+        }
+
+    def summary(self):
+        return (f"Scaled frame cache: {self.hits} hits, {self.misses} misses "
+                f"({self.hit_rate():.1%} hit rate), {len(self._entries)} frames, "
+                f"{self.current_bytes / (1024 * 1024):.1f}/{self.max_bytes / (1024 * 1024):.0f} MB")
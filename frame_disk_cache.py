@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                                 "bpmdotgif", "frames")
+CACHE_FORMAT_VERSION = 1
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Content hash of a file, so renamed or copied GIFs share a cache entry"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CachedFrames:
+    """A cache hit: memory-mapped frame arrays plus the GIF's metadata"""
+
+    def __init__(self, pixels, palettes, durations, beats, size):
+        self.pixels = pixels
+        self.palettes = palettes
+        self.durations = durations
+        self.beats = beats
+        self.size = size
+
+
+class FrameDiskCache:
+    """Content-addressed on-disk cache of decoded GIF frames.
+
+    Each entry is a directory holding the frame buffer as a .npy file (plus
+    palettes for indexed storage) and a meta.json with durations and beats.
+    Loading maps the .npy files read-only instead of decoding the GIF. The
+    cache is capped in bytes; entries are evicted least recently used first,
+    using the meta.json mtime as the access time.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=2048 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key_for(self, gif_path, indexed=False):
+        return f"{hash_file(gif_path)}-{'indexed' if indexed else 'rgba'}"
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def contains(self, key):
+        return os.path.exists(os.path.join(self._entry_dir(key), "meta.json"))
+
+    def load(self, key):
+        """Map a cached entry, or return None on a miss or a damaged entry"""
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, "meta.json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("version") != CACHE_FORMAT_VERSION:
+                raise ValueError("old cache format")
+            pixels = np.load(os.path.join(entry_dir, "pixels.npy"), mmap_mode="r")
+            palettes = None
+            if meta.get("indexed"):
+                palettes = np.load(os.path.join(entry_dir, "palettes.npy"), mmap_mode="r")
+            os.utime(meta_path)  # Mark as recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Discarding damaged cache entry {key}: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedFrames(pixels, palettes, meta["durations"], meta.get("beats"), tuple(meta["size"]))
+
+    def store(self, key, pixels, durations, palettes=None, beats=None):
+        """Write an entry atomically (temp dir + rename), then enforce the size cap"""
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        try:
+            np.save(os.path.join(tmp_dir, "pixels.npy"), pixels)
+            if palettes is not None:
+                np.save(os.path.join(tmp_dir, "palettes.npy"), palettes)
+            meta = {
+                "version": CACHE_FORMAT_VERSION,
+                "durations": list(durations),
+                "beats": beats,
+                "size": [int(pixels.shape[2]), int(pixels.shape[1])],
+                "indexed": palettes is not None,
+            }
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            try:
+                os.replace(tmp_dir, self._entry_dir(key))
+            except OSError:
+                # Another loader stored the same GIF first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except OSError as e:
+            print(f"Could not write frame cache entry: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(name)
+            if name.startswith(".") or not os.path.isdir(entry_dir):
+                continue
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(entry_dir))
+                last_used = os.stat(os.path.join(entry_dir, "meta.json")).st_mtime
+            except OSError:
+                continue
+            entries.append((last_used, size, entry_dir))
+        return entries
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def summary(self):
+        return (f"Frame disk cache: {self.hits} hits, {self.misses} misses, "
+                f"{self.total_bytes() / (1024 * 1024):.0f}/{self.max_bytes / (1024 * 1024):.0f} MB "
+                f"in {self.cache_dir}")
@@ -0,0 +1,144 @@
+import collections
+import time
+
+import pygame
+
+DEFAULT_MAX_FPS = 60  # Loop rate cap when the display doesn't report its refresh rate
+MIN_LOOP_FPS = 15  # Even a slow GIF polls input, loads and the beat tracker this often
+SPIN_SECONDS = 0.002  # The end of a sleep is spent yielding in a loop, event waits can oversleep
+FRAME_CHANGE_SLACK = 0.0005  # Wake this long after a frame change, so the new frame is due
+DECIDE_FRAMES = 30  # Frame work times looked at before stepping quality down
+OVERRUN_SHARE = 0.25  # Step down when more than this share of those frames overran the budget
+RESTORE_FRAMES = 120  # Frames that must all stay under the headroom mark before stepping up
+HEADROOM = 0.5  # A frame has headroom when its work takes less than this share of the budget
+RELAPSE_SECONDS = 5.0  # Overload this soon after stepping up doubles the wait for the next step up
+MAX_RESTORE_BACKOFF = 8
+
+QUALITY_FULL = 0
+QUALITY_FAST_SCALING = 1  # Scaled frame cache misses use scale instead of smoothscale
+QUALITY_SLOW_THUMBNAILS = 2  # Thumbnails only change frame THUMBNAIL_REDUCED_FPS times a second
+QUALITY_LOW_RES_BACKGROUND = 3  # The background image is downsampled and flattened
+QUALITY_NAMES = ("full quality", "fast scaling", "slow thumbnails", "low-res background")
+THUMBNAIL_REDUCED_FPS = 8
+BACKGROUND_DOWNSAMPLE = 2
+
+
+def display_refresh_rate():
+    """Refresh rate of the current display, DEFAULT_MAX_FPS if unknown"""
+    try:
+        rate = pygame.display.get_current_refresh_rate()
+    except (AttributeError, pygame.error):
+        rate = 0
+    return rate if rate > 0 else DEFAULT_MAX_FPS
+
+
+class FrameGovernor:
+    """Paces the main loop from the beat clock and trades quality for time under load.
+
+    Instead of ticking at a fixed rate, the loop runs at the fastest visible
+    GIF frame rate (after BPM scaling, capped at max_fps) and sleeps until
+    the next scheduled frame change, waking early for input. The measured
+    work of each frame is compared with the frame budget: when frames keep
+    overrunning, quality steps down one level (fast scaling, then slow
+    thumbnails, then a low-res background), and after a long stretch with
+    headroom it steps back up. Every decision is printed.
+    """
+
+    def __init__(self, max_fps=DEFAULT_MAX_FPS, min_fps=MIN_LOOP_FPS, adaptive_quality=True,
+                 clock=time.perf_counter, log=print):
+        self.max_fps = max_fps
+        self.min_fps = min(min_fps, max_fps)
+        self.adaptive_quality = adaptive_quality
+        self.clock = clock
+        self.log = log
+        self.quality = QUALITY_FULL
+        self.loop_fps = max_fps
+        self.decisions = 0
+        self._work = collections.deque(maxlen=max(DECIDE_FRAMES, RESTORE_FRAMES * MAX_RESTORE_BACKOFF))
+        self._restore_backoff = 1
+        self._stepped_up_at = None
+        self._frame_start = clock()
+        self._deadline = self._frame_start
+
+    @property
+    def budget(self):
+        """Seconds one frame of work may take at the current loop rate"""
+        return 1.0 / self.loop_fps
+
+    def _decide(self, message):
+        self.decisions += 1
+        self.log(f"Frame governor: {message}")
+
+    def set_rate(self, fastest_fps):
+        """Run at the fastest visible frame rate, within min_fps and max_fps"""
+        loop_fps = min(self.max_fps, max(self.min_fps, fastest_fps))
+        if round(loop_fps) != round(self.loop_fps):
+            self._decide(f"loop rate {loop_fps:.0f} fps (fastest visible GIF {fastest_fps:.1f} fps)")
+        self.loop_fps = loop_fps
+
+    def wait(self):
+        """Sleep until the planned deadline (or input); returns seconds since the previous frame began"""
+        wait_ms = int((self._deadline - self.clock() - SPIN_SECONDS) * 1000)
+        event = pygame.event.wait(wait_ms) if wait_ms > 0 else None
+        if event is not None and event.type != pygame.NOEVENT:
+            pygame.event.post(event)  # Input cuts the sleep short; the loop handles it now
+        else:
+            while self.clock() < self._deadline:
+                time.sleep(0)
+        now = self.clock()
+        elapsed = now - self._frame_start
+        self._frame_start = now
+        return elapsed
+
+    def end_frame(self, seconds_to_next_frame, busy):
+        """Record this frame's work and plan the next wake-up; returns True if quality changed.
+
+        seconds_to_next_frame is when the next visible GIF frame is due (None
+        if nothing animates); busy loops (UI animating, GIFs loading) run at
+        max_fps regardless.
+        """
+        now = self.clock()
+        changed = self._update_quality(now - self._frame_start, now)
+        interval = 1.0 / self.min_fps
+        if busy:
+            interval = 1.0 / self.max_fps
+        elif seconds_to_next_frame is not None:
+            interval = min(interval, now - self._frame_start + seconds_to_next_frame + FRAME_CHANGE_SLACK)
+        self._deadline = self._frame_start + max(interval, 1.0 / self.max_fps)
+        return changed
+
+    def _update_quality(self, work, now):
+        if not self.adaptive_quality:
+            return False
+        self._work.append(work)
+        recent = list(self._work)[-DECIDE_FRAMES:]
+        overruns = sum(1 for w in recent if w > self.budget)
+        if (self.quality < len(QUALITY_NAMES) - 1 and len(recent) == DECIDE_FRAMES
+                and overruns > OVERRUN_SHARE * DECIDE_FRAMES):
+            if self._stepped_up_at is not None and now - self._stepped_up_at < RELAPSE_SECONDS:
+                self._restore_backoff = min(MAX_RESTORE_BACKOFF, self._restore_backoff * 2)
+            self.quality += 1
+            self._work.clear()
+            self._decide(f"{overruns}/{DECIDE_FRAMES} frames over the {self.budget * 1000:.1f} ms budget "
+                         f"(median {sorted(recent)[len(recent) // 2] * 1000:.1f} ms), "
+                         f"quality down to {QUALITY_NAMES[self.quality]}")
+            return True
+        restore_frames = RESTORE_FRAMES * self._restore_backoff
+        if self.quality > QUALITY_FULL and len(self._work) >= restore_frames:
+            slowest = max(list(self._work)[-restore_frames:])
+            if slowest < HEADROOM * self.budget:
+                self.quality -= 1
+                self._work.clear()
+                self._stepped_up_at = now
+                self._decide(f"{restore_frames} frames under {HEADROOM * self.budget * 1000:.1f} ms "
+                             f"(slowest {slowest * 1000:.1f} ms), quality up to {QUALITY_NAMES[self.quality]}")
+                return True
+        if (self.quality == QUALITY_FULL and self._stepped_up_at is not None
+                and now - self._stepped_up_at > RELAPSE_SECONDS):
+            self._restore_backoff = 1
+            self._stepped_up_at = None
+        return False
+
+    def summary(self):
+        return (f"Frame governor: {self.loop_fps:.0f} fps loop, {QUALITY_NAMES[self.quality]}, "
+                f"{self.decisions} decisions")
@@ -0,0 +1,141 @@
+import bisect
+import time
+
+from tempo import TempoEngine
+
+
+class FrameScheduler:
+    """Beat-phase clock that maps elapsed monotonic time to exact GIF frames.
+
+    The clock itself is a TempoEngine (fractional BPM plus a beat-phase
+    anchor), shared with whoever sets the tempo. A slot's frame is found by
+    placing the beat phase inside its loop and binary searching the
+    cumulative frame durations.
+    """
+
+    def __init__(self, bpm=120.0, clock=time.monotonic, tempo=None):
+        self.tempo = tempo if tempo is not None else TempoEngine(bpm, clock)
+        self._cumulative = {}  # slot index -> (durations list, cumulative end times)
+
+    @property
+    def bpm(self):
+        return self.tempo.bpm
+
+    @property
+    def paused(self):
+        return self.tempo.paused
+
+    def beat_position(self, now=None):
+        """Beats elapsed on the clock (frozen while paused)"""
+        return self.tempo.beat_position(now)
+
+    def set_bpm(self, bpm):
+        self.tempo.set_bpm(bpm)
+
+    def set_paused(self, paused):
+        self.tempo.set_paused(paused)
+
+    def align_beat(self, beat_time, tolerance=0.0):
+        self.tempo.align_beat(beat_time, tolerance)
+
+    def anchor(self):
+        return self.tempo.anchor()
+
+    def set_anchor(self, anchor_time, anchor_beat, bpm, paused):
+        """Follow another scheduler's clock (see TempoEngine.set_anchor)"""
+        self.tempo.set_anchor(anchor_time, anchor_beat, bpm, paused)
+
+    def _cumulative_for(self, slot):
+        cached = self._cumulative.get(slot.index)
+        if cached is None or cached[0] is not slot.durations:
+            ends = []
+            total = 0
+            for duration in slot.durations:
+                total += duration
+                ends.append(total)
+            cached = (slot.durations, ends)
+            self._cumulative[slot.index] = cached
+        return cached[1]
+
+    def frame_for(self, slot, beat=None):
+        """Return the frame index a slot should show at a beat position"""
+        if beat is None:
+            beat = self.beat_position()
+        frame_count = len(slot.durations)
+        if frame_count <= 1:
+            return 0
+        if slot.beats > 0:
+            loop_phase = (beat % slot.beats) / slot.beats
+        elif self.bpm > 0 and slot.original_loop_duration > 0:
+            # No beat count: play at the GIF's own speed
+            loop_phase = ((beat * 60000.0 / self.bpm) % slot.original_loop_duration) / slot.original_loop_duration
+        else:
+            loop_phase = 0.0
+        if slot.original_loop_duration <= 0:
+            # Zero-delay GIF, spread the frames evenly over the loop
+            return min(int(loop_phase * frame_count), frame_count - 1)
+        ends = self._cumulative_for(slot)
+        loop_time = loop_phase * ends[-1]
+        return min(bisect.bisect_right(ends, loop_time), frame_count - 1)
+
+    def beats_to_next_frame(self, slot, beat):
+        """Beats from beat until frame_for(slot) changes; None if it never does"""
+        frame_count = len(slot.durations)
+        if frame_count <= 1:
+            return None
+        if slot.beats > 0:
+            loop_beats = slot.beats
+        elif self.bpm > 0 and slot.original_loop_duration > 0:
+            loop_beats = slot.original_loop_duration * self.bpm / 60000.0
+        else:
+            return None
+        loop_beat = beat % loop_beats
+        if slot.original_loop_duration <= 0:
+            frame_beats = loop_beats / frame_count
+            return (int(loop_beat / frame_beats) + 1) * frame_beats - loop_beat
+        ends = self._cumulative_for(slot)
+        next_end = ends[min(bisect.bisect_right(ends, loop_beat / loop_beats * ends[-1]), frame_count - 1)]
+        return next_end / ends[-1] * loop_beats - loop_beat
+
+    def seconds_to_next_frame(self, slots, indices):
+        """Seconds until any of the loaded slots at indices changes frame; None if none will"""
+        if self.paused or self.bpm <= 0:
+            return None
+        beat = self.beat_position()
+        soonest = None
+        for index in indices:
+            slot = slots[index]
+            if not slot.is_loaded:
+                continue
+            beats = self.beats_to_next_frame(slot, beat)
+            if beats is not None and (soonest is None or beats < soonest):
+                soonest = beats
+        return soonest * 60.0 / self.bpm if soonest is not None else None
+
+    def frame_rate(self, slot):
+        """Fastest rate at which a slot changes frames at the current tempo (frames per second)"""
+        if len(slot.durations) <= 1 or self.bpm <= 0:
+            return 0.0
+        if slot.beats > 0:
+            loop_seconds = slot.beats * 60.0 / self.bpm
+        else:
+            loop_seconds = slot.original_loop_duration / 1000.0
+        if loop_seconds <= 0:
+            return 0.0
+        shortest = min(slot.durations) / slot.original_loop_duration if slot.original_loop_duration > 0 else 0.0
+        return 1.0 / (loop_seconds * (shortest or 1.0 / len(slot.durations)))
+
+    def update(self, slots, visible_indices):
+        """Set frame_idx on the visible loaded slots; return the ones that changed"""
+        beat = self.beat_position()
+        changed = []
+        for index in visible_indices:
+            slot = slots[index]
+            if not slot.is_loaded:
+                continue
+            # Streaming slots may show an earlier frame while the wanted one decodes
+            frame_idx = slot.prepare_frame(self.frame_for(slot, beat))
+            if frame_idx != slot.frame_idx:
+                slot.frame_idx = frame_idx
+                changed.append(slot)
+        return changed
@@ -1,241 +1,269 @@
 import pygame
 import pygame_gui
-from PIL import Image, ImageSequence
 import time
 import os
+import sys
+import argparse
+import threading
+import cProfile
+import pstats
 import tkinter as tk
 from tkinter import filedialog
+from frame_cache import ScaledFrameCache
+from gif_loader import GifLoader, prewarm_disk_cache
+from frame_scheduler import FrameScheduler
+from tempo import TempoEngine, format_bpm
+from gif_slot import GifSlot
+from frame_disk_cache import FrameDiskCache, DEFAULT_CACHE_DIR
+from sync_math import extract_beats_from_filename, speed_multiplier
+from gif_export import write_retimed_gif
+from thumbnail_strip import ThumbnailStrip
+from damage_tracker import DamageTracker
+from stage_render import StageBackground, draw_gif_on_stage
+from crowd import DEFAULT_CROWD_SIZE, formation_for, next_formation, step_crowd_size
+from beat_effects import BeatEffects, EFFECTS, PHASE_BUCKETS
+from stage_output import StageOutput, parse_size
+from stage_stream import StageStream, DEFAULT_STREAM_SIZE, DEFAULT_SHM_NAME
+from perf_stats import PerfStats, PerfOverlay
+from frame_governor import (FrameGovernor, display_refresh_rate, BACKGROUND_DOWNSAMPLE, QUALITY_FAST_SCALING,
+                            QUALITY_LOW_RES_BACKGROUND, QUALITY_SLOW_THUMBNAILS, THUMBNAIL_REDUCED_FPS)
+from gif_library import GifLibrary, LibraryPanel, DEFAULT_LIBRARY_PATH
+from session import Session, SetListPlayer
+from control_server import ControlServer, DEFAULT_HOST, DEFAULT_HTTP_PORT, DEFAULT_OSC_PORT
+from beat_tracker import BeatTracker, DEFAULT_SAMPLE_RATE, match_octave, open_source
 
 # CONFIG
-DEFAULT_BEATS = 2
 MIN_WINDOW_WIDTH = 800
 MIN_WINDOW_HEIGHT = 300  # Much smaller minimum height
 # Dynamic UI height - will be calculated based on actual content
 UI_HEIGHT = 0  # Will be calculated dynamically
 THUMBNAIL_HEIGHT = 100
 MAX_SLOTS = 10
+MIN_BPM = 30
 MAX_BPM = 600
+DEFAULT_BPM = 120.0
 STAGE_HEIGHT_RATIO = 0.85  # 85% of available height for stage (0.1 to 0.9)
+SCALED_FRAME_CACHE_MB = 256  # Memory cap for pre-scaled stage frames
+EFFECT_CACHE_MB = 128  # Memory cap for stage frames with beat effects applied
+INDEXED_FRAME_STORAGE = False  # Keep frames as palette indices (~4x smaller) and expand on demand
+USE_DISK_CACHE = True  # Keep decoded frames on disk so reloading a GIF is a file map
+DISK_CACHE_DIR = DEFAULT_CACHE_DIR
+DISK_CACHE_MB = 2048  # Least recently used GIFs are evicted past this size
+STREAMING_BUDGET_MB = 512  # GIFs that would decode to more than this play from a sliding window of frames
+STREAMING_WINDOW_FRAMES = 64  # Frames decoded ahead of the playhead for streaming GIFs
+DIRTY_RECT_RENDERING = True  # Only redraw and push the parts of the window that changed
+UI_SETTLE_SECONDS = 0.5  # Keep redrawing the controls this long after input (hover/press animations)
+IDLE_WAIT_MS = 250  # Longest sleep while paused with nothing to redraw
+LOOP_MAX_FPS = None  # Main loop rate cap; None follows the display's refresh rate
+ADAPTIVE_QUALITY = True  # Let the frame governor lower quality while frames overrun
+BACKGROUND_DOWNSCALE_ON_LOAD = True  # Shrink background images larger than the biggest monitor
+LIBRARY_PATH = DEFAULT_LIBRARY_PATH  # SQLite index behind the Library panel
+PERF_WINDOW_FRAMES = 600  # Frames of phase timings kept for the perf overlay percentiles
+BEAT_ALIGN_TOLERANCE = 0.02  # Beat tracker phase corrections smaller than this many beats are skipped
+SESSION_PREFETCH_BANKS = 1  # Set list banks decoded ahead of the one playing
+SESSION_PREFETCH_MB = 1024  # Memory cap for prefetched banks
 
 # Pop-out window settings
 POPOUT_WIDTH = 800
 POPOUT_HEIGHT = 600
-popout_window = None
-popout_screen = None
-popout_active = False
-current_window = "main"  # "main" or "stage"
-stage_background_color = (20, 20, 20)  # Default dark gray
-stage_background_image = None
-stage_background_image_surface = None
+STAGE_OUTPUT_FPS = 60  # Frame rate target of the stage window, independent of the main window
+STAGE_OUTPUT_VSYNC = True  # Sync stage window presents to the display (falls back if unsupported)
+STAGE_OUTPUT_RENDERER = "cpu"  # "gpu" draws the stage window with SDL textures instead of smoothscale
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="GIF BPM Sync Tool")
+    parser.add_argument("--prewarm-cache", metavar="DIR",
+                        help="decode every GIF under DIR into the frame disk cache and exit")
+    parser.add_argument("--no-disk-cache", action="store_true",
+                        help="always decode GIFs instead of using the frame disk cache")
+    parser.add_argument("--stage-renderer", choices=("cpu", "gpu"), default=STAGE_OUTPUT_RENDERER,
+                        help="how the stage window scales and flips frames (default: %(default)s)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="run the session under cProfile and write the stats to FILE")
+    parser.add_argument("--perf-json", metavar="FILE", help="write loop timing stats as JSON at exit")
+    parser.add_argument("--perf-csv", metavar="FILE", help="write per-phase timing percentiles as CSV at exit")
+    parser.add_argument("--library", metavar="DIR", action="append",
+                        help="add DIR to the clip library (remembered; can be given more than once)")
+    parser.add_argument("--audio-input", metavar="SOURCE",
+                        help="follow the tempo of 'device', 'device:N', '-' (stdin) or a WAV file/FIFO")
+    parser.add_argument("--audio-rate", type=int, default=DEFAULT_SAMPLE_RATE,
+                        help="sample rate of raw 16-bit PCM on stdin or a FIFO (default: %(default)s)")
+    parser.add_argument("--control", action="store_true",
+                        help=f"accept remote control over HTTP/WebSocket (port {DEFAULT_HTTP_PORT}) and OSC "
+                             f"(UDP port {DEFAULT_OSC_PORT})")
+    parser.add_argument("--control-host", default=DEFAULT_HOST,
+                        help="address the control server listens on (default: %(default)s; 0.0.0.0 for the network)")
+    parser.add_argument("--control-port", type=int, default=DEFAULT_HTTP_PORT, help="HTTP/WebSocket port")
+    parser.add_argument("--osc-port", type=int, default=DEFAULT_OSC_PORT, help="OSC UDP port")
+    parser.add_argument("--control-origin", action="append", metavar="ORIGIN",
+                        help="also accept browser pages from ORIGIN, e.g. http://desk.local:8080 (repeatable)")
+    parser.add_argument("--stream-port", type=int, metavar="PORT",
+                        help="serve the stage as MJPEG at http://HOST:PORT/stream.mjpg")
+    parser.add_argument("--stream-host", default="127.0.0.1",
+                        help="address the stage stream listens on (default: %(default)s)")
+    parser.add_argument("--stream-size", type=parse_size, default=DEFAULT_STREAM_SIZE, metavar="WxH",
+                        help="resolution of the stage stream and shared-memory feed (default: 1280x720)")
+    parser.add_argument("--shm-feed", nargs="?", const=DEFAULT_SHM_NAME, metavar="NAME",
+                        help=f"publish raw RGBA stage frames in shared memory (default name: {DEFAULT_SHM_NAME})")
+    parser.add_argument("--session", metavar="FILE",
+                        help="play the set list in FILE (created on Ctrl+S if it doesn't exist)")
+    return parser.parse_args()
+
+args = parse_args()
+frame_disk_cache = None
+if USE_DISK_CACHE and not args.no_disk_cache:
+    frame_disk_cache = FrameDiskCache(DISK_CACHE_DIR, DISK_CACHE_MB * 1024 * 1024)
+if args.prewarm_cache:
+    if frame_disk_cache is None:
+        sys.exit("--prewarm-cache needs the disk cache enabled")
+    prewarm_disk_cache(frame_disk_cache, args.prewarm_cache, INDEXED_FRAME_STORAGE, extract_beats_from_filename)
+    sys.exit(0)
+
+beat_tracker = None
+if args.audio_input:
+    try:
+        beat_tracker = BeatTracker(open_source(args.audio_input, args.audio_rate))
+    except (OSError, RuntimeError, ValueError) as e:
+        sys.exit(f"--audio-input {args.audio_input}: {e}")
+
+session = Session.empty(MAX_SLOTS)
+if args.session:
+    if os.path.exists(args.session):
+        try:
+            session = Session.load(args.session, MAX_SLOTS)
+        except (OSError, ValueError) as e:
+            sys.exit(f"--session {args.session}: {e}")
+    else:
+        session.path = args.session
+
+profiler = None
+if args.profile:
+    profiler = cProfile.Profile()
+    profiler.enable()
 
 # INIT
 tk.Tk().withdraw()
 pygame.init()
 pygame.display.set_caption("GIF BPM Sync Tool v3")
 
-class GifSlot:
-    def __init__(self, index):
-        self.index = index
-        self.frames = [pygame.Surface((300, 300))]
-        self.frames[0].fill((30, 30, 30))
-        self.durations = [100]
-        self.frames_pil = [Image.new("RGBA", (300, 300), (0, 0, 0, 255))]
-        self.width = 300
-        self.height = 300
-        self.beats = DEFAULT_BEATS
-        self.frame_idx = 0
-        self.original_loop_duration = sum(self.durations)
-        self.is_loaded = False
-        self.original_size = (300, 300)
+control_server = None
+if args.control:
+    # Remote commands post an event so the loop wakes up even while it idles
+    remote_event = pygame.event.custom_type()
+    control_server = ControlServer(args.control_host, args.control_port, args.osc_port,
+                                   lambda: pygame.event.post(pygame.event.Event(remote_event)),
+                                   args.control_origin or ())
+    try:
+        control_server.start()
+    except OSError as e:
+        sys.exit(f"--control: {e}")
+    print(f"Remote control on http://{args.control_host}:{control_server.http_port}/state "
+          f"(WebSocket on the same port) and OSC UDP port {control_server.osc_port}")
 
 # Global State
 slots = [GifSlot(i) for i in range(MAX_SLOTS)]
 active_slot = 0
 window_width = MIN_WINDOW_WIDTH
 window_height = 800  # Start with a taller default height
-bpm = 120  # Set a default BPM instead of 0
 zoom_level = 1.0
 paused = False
-tap_times = []
-last_tap_time = 0
+follow_audio = True  # Take tempo and beat phase from the beat tracker when there is one
 squad_mode = False
 squad_spacing = 0.5  # 0-1 range: 0=directly behind, 1=3x gif width spacing
 squad_size = 80  # 0-100 range: 0=25% size, 100=100% size
+crowd_size = DEFAULT_CROWD_SIZE  # Dancers in the squad formation, lead included
 horizontal_flip = False  # Whether to flip the GIF horizontally
 stage_height_ratio = STAGE_HEIGHT_RATIO  # Configurable stage height ratio
+scaled_frame_cache = ScaledFrameCache(SCALED_FRAME_CACHE_MB * 1024 * 1024)
+beat_effects = BeatEffects(max_bytes=EFFECT_CACHE_MB * 1024 * 1024)  # Toggled with F1-F5
+gif_loader = GifLoader(indexed=INDEXED_FRAME_STORAGE, disk_cache=frame_disk_cache,
+                       stream_budget=STREAMING_BUDGET_MB * 1024 * 1024, stream_window=STREAMING_WINDOW_FRAMES)
+set_list = SetListPlayer(session, gif_loader, SESSION_PREFETCH_BANKS, SESSION_PREFETCH_MB * 1024 * 1024)
+tempo = TempoEngine(DEFAULT_BPM, min_bpm=MIN_BPM, max_bpm=MAX_BPM)  # The one tempo everything follows
+frame_scheduler = FrameScheduler(tempo=tempo)
+stage_background = StageBackground(downscale_on_load=BACKGROUND_DOWNSCALE_ON_LOAD)
+stage_output = StageOutput(POPOUT_WIDTH, POPOUT_HEIGHT, STAGE_OUTPUT_FPS, STAGE_OUTPUT_VSYNC,
+                           frame_disk_cache.cache_dir if frame_disk_cache is not None else None,
+                           INDEXED_FRAME_STORAGE, args.stage_renderer)
+slot_paths = [None] * MAX_SLOTS  # GIF file behind each loaded slot, replayed to the stage window
+stage_stream = None
+if args.stream_port is not None or args.shm_feed:
+    try:
+        stage_stream = StageStream(args.stream_size, args.stream_host, args.stream_port, args.shm_feed)
+    except OSError as e:
+        sys.exit(f"Stage stream: {e}")
+    stage_stream.start()
+    if stage_stream.port is not None:
+        print(f"Streaming the stage at http://{args.stream_host}:{stage_stream.port}/stream.mjpg")
+    if stage_stream.feed is not None:
+        print(f"Raw RGBA stage frames in shared memory '{stage_stream.feed.name}'")
+last_streamed_state = None
+damage = DamageTracker()
+perf = PerfStats(PERF_WINDOW_FRAMES)
+full_redraw = True  # Set whenever the whole window has to be repainted
+last_stage_state = None
+ui_dirty_until = 0.0
+export_thread = None
 
 # Setup
 screen = pygame.display.set_mode((window_width, window_height), pygame.RESIZABLE)
+governor = FrameGovernor(LOOP_MAX_FPS or display_refresh_rate(), adaptive_quality=ADAPTIVE_QUALITY)
+last_thumbnail_update = 0.0
 manager = pygame_gui.UIManager((window_width, window_height))
+thumbnail_strip = ThumbnailStrip(window_width, THUMBNAIL_HEIGHT, MAX_SLOTS)
+gif_loader.thumbnail_box = thumbnail_strip.thumbnail_box()  # Loads come with their thumbnails scaled
+perf_overlay = PerfOverlay(perf)
+if beat_tracker is not None:
+    beat_tracker.start()
+    print(f"Following the beat of {args.audio_input} (A toggles)")
 
 def create_popout_window():
-    """Create the pop-out window for streaming/OBS"""
-    global popout_window, popout_screen, popout_active, current_window
-    if popout_window is None:
-        # Create a separate window for the stage
-        popout_window = pygame.display.set_mode((POPOUT_WIDTH, POPOUT_HEIGHT), pygame.RESIZABLE)
-        popout_screen = popout_window
-        popout_active = True
-        current_window = "stage"
-        pygame.display.set_caption("BPMdotGIF - Stage Window")
-        print("Stage window created!")
-        print("For OBS: Use 'Window Capture' and select 'BPMdotGIF - Stage Window'")
-        print("Press ESC to return to main window")
+    """Open the stage window for streaming/OBS in its own process"""
+    if stage_output.running:
+        return
+    stage_output.start()
+    # Hand the stage process every GIF that is already loaded
+    for slot in slots:
+        if slot_paths[slot.index] is not None:
+            stage_output.load(slot.index, slot_paths[slot.index], slot.beats)
+    print("Stage window opened. Press ESC or click Stage again to close it.")
 
 def close_popout_window():
-    """Close the pop-out window"""
-    global popout_window, popout_screen, popout_active, current_window
-    if popout_window is not None:
-        # Restore the main window
-        pygame.display.set_mode((window_width, window_height), pygame.RESIZABLE)
-        pygame.display.set_caption("GIF BPM Sync Tool v3")
-        popout_window = None
-        popout_screen = None
-        popout_active = False
-        current_window = "main"
+    """Close the stage window"""
+    if stage_output.running:
+        stage_output.stop()
         print("Stage window closed.")
 
+def stage_output_state():
+    """Everything the stage window needs to draw the same stage as the main window"""
+    return {
+        'active_slot': active_slot,
+        'zoom': zoom_level,
+        'squad_mode': squad_mode,
+        'squad_spacing': squad_spacing,
+        'squad_size': squad_size,
+        'crowd_size': crowd_size,
+        'flip': horizontal_flip,
+        'effects': [name for name in EFFECTS if name in beat_effects.enabled],
+        'bg_color': stage_background.color,
+        'bg_image': stage_background.image_path,
+        'beats': [slot.beats for slot in slots],
+        'clock': frame_scheduler.anchor(),
+    }
+
 def set_stage_background_color(color):
     """Set the stage background color"""
-    global stage_background_color
-    stage_background_color = color
+    stage_background.color = color
 
 def set_stage_background_image(image_path):
     """Set a custom background image for the stage"""
-    global stage_background_image, stage_background_image_surface
-    try:
-        if image_path and os.path.exists(image_path):
-            # Load and scale the background image
-            bg_image = pygame.image.load(image_path)
-            # Convert to ensure compatibility
-            bg_image = bg_image.convert_alpha()
-            stage_background_image = image_path
-            stage_background_image_surface = bg_image
-            print(f"Background image loaded: {image_path}")
-        else:
-            stage_background_image = None
-            stage_background_image_surface = None
-            print("No image file selected or file doesn't exist.")
-    except pygame.error as e:
-        print(f"Pygame error loading background image: {e}")
-        stage_background_image = None
-        stage_background_image_surface = None
-    except Exception as e:
-        print(f"Error loading background image: {e}")
-        stage_background_image = None
-        stage_background_image_surface = None
+    stage_background.set_image(image_path)
 
 def clear_stage_background():
     """Clear the stage background image"""
-    global stage_background_image, stage_background_image_surface
-    stage_background_image = None
-    stage_background_image_surface = None
+    stage_background.clear_image()
     print("Background image cleared")
 
-def draw_stage_background(target_screen, stage_rect):
-    """Draw the stage background (color or image)"""
-    if stage_background_image_surface is not None:
-        # Scale background image to fit the stage
-        scaled_bg = pygame.transform.smoothscale(stage_background_image_surface, 
-                                               (stage_rect.width, stage_rect.height))
-        target_screen.blit(scaled_bg, (stage_rect.x, stage_rect.y))
-    else:
-        # Draw solid color background
-        pygame.draw.rect(target_screen, stage_background_color, stage_rect)
-
-def draw_gif_on_stage(target_screen, stage_rect, slot, zoom_level, squad_mode, squad_size, horizontal_flip):
-    """Draw the GIF on the stage (extracted from draw_main_stage for reuse)"""
-    if not slot.is_loaded:
-        return
-        
-    if squad_mode:
-        # Squad mode: draw backup dancers first (behind), then main dancer
-        
-        # Calculate main GIF dimensions
-        main_scale = min(stage_rect.width / slot.width, stage_rect.height / slot.height) * zoom_level
-        main_width = int(slot.width * main_scale)
-        main_height = int(slot.height * main_scale)
-        
-        # Calculate backup dancer dimensions based on squad size slider
-        size_multiplier = 0.25 + (squad_size / 100.0) * 0.75
-        backup_scale = main_scale * size_multiplier
-        backup_width = int(slot.width * backup_scale)
-        backup_height = int(slot.height * backup_scale)
-        
-        # Calculate main GIF's top-left position
-        main_x = stage_rect.x + (stage_rect.width - main_width) // 2
-        main_y = stage_rect.y + (stage_rect.height - main_height) // 2
-        
-        # Calculate spacing based on slider value
-        effective_slider_value = squad_spacing ** 2
-        actual_offset = effective_slider_value * main_width
-        
-        # Calculate backup dancer center X positions
-        main_center_x = main_x + main_width / 2.0
-        
-        backup_center_x_left = main_center_x - actual_offset
-        backup_center_x_right = main_center_x + actual_offset
-        
-        # Convert backup dancer center positions to top-left blit positions
-        left_x = backup_center_x_left - backup_width / 2.0
-        right_x = backup_center_x_right - backup_width / 2.0
-        
-        # Vertical position for backup dancers
-        backup_y = main_y + (main_height - backup_height) / 2.0
-        
-        # Draw left backup dancer
-        current_frame = slot.frames[slot.frame_idx]
-        if horizontal_flip:
-            current_frame = pygame.transform.flip(current_frame, True, False)
-        left_backup = pygame.transform.smoothscale(current_frame, (backup_width, backup_height))
-        target_screen.blit(left_backup, (int(left_x), int(backup_y)))
-        
-        # Draw right backup dancer  
-        right_backup = pygame.transform.smoothscale(current_frame, (backup_width, backup_height))
-        target_screen.blit(right_backup, (int(right_x), int(backup_y)))
-        
-        # Draw main dancer (on top)
-        main_frame = pygame.transform.smoothscale(current_frame, (main_width, main_height))
-        target_screen.blit(main_frame, (main_x, main_y))
-        
-    else:
-        # Normal mode: single GIF centered
-        scale = min(stage_rect.width / slot.width, stage_rect.height / slot.height) * zoom_level
-        scaled_width = int(slot.width * scale)
-        scaled_height = int(slot.height * scale)
-        
-        # Center the GIF in the stage
-        x = stage_rect.x + (stage_rect.width - scaled_width) // 2
-        y = stage_rect.y + (stage_rect.height - scaled_height) // 2
-        
-        # Scale and draw the current frame
-        current_frame = slot.frames[slot.frame_idx]
-        if horizontal_flip:
-            current_frame = pygame.transform.flip(current_frame, True, False)
-        scaled_frame = pygame.transform.smoothscale(current_frame, (scaled_width, scaled_height))
-        target_screen.blit(scaled_frame, (x, y))
-
-def draw_popout_stage():
-    """Draw the stage in the pop-out window"""
-    if not popout_active or popout_screen is None:
-        return
-        
-    # Clear the popout screen
-    popout_screen.fill((0, 0, 0))
-    
-    # Calculate stage area (full window for popout)
-    stage_rect = pygame.Rect(0, 0, POPOUT_WIDTH, POPOUT_HEIGHT)
-    
-    # Draw stage background
-    draw_stage_background(popout_screen, stage_rect)
-    
-    # Draw active GIF
-    slot = slots[active_slot]
-    draw_gif_on_stage(popout_screen, stage_rect, slot, zoom_level, squad_mode, squad_size, horizontal_flip)
-    
-    # Update the stage window display
-    pygame.display.flip()
-
 def create_ui():
     global manager, window_width, window_height, UI_HEIGHT
     manager = pygame_gui.UIManager((window_width, window_height))
@@ -264,7 +292,7 @@ def create_ui():
     bpm_input = pygame_gui.elements.UITextEntryLine(pygame.Rect(x_offset, y_start + padding, element_width, 25), manager=manager)
     x_offset += element_width + spacing
     bpm_slider = pygame_gui.elements.UIHorizontalSlider(pygame.Rect(x_offset, y_start + padding, element_width, 25), 
-                                                       start_value=0, value_range=(30, MAX_BPM), manager=manager)
+                                                       start_value=MIN_BPM, value_range=(MIN_BPM, MAX_BPM), manager=manager)
     x_offset += element_width + spacing
     half_button = pygame_gui.elements.UIButton(pygame.Rect(x_offset, y_start + padding, element_width, 25), text="/2", manager=manager)
     x_offset += element_width + spacing
@@ -276,7 +304,7 @@ def create_ui():
     beats_input.set_text(str(slots[active_slot].beats))
     
     # Row 2: File and Mode controls (distributed across full width)
-    row2_elements = 5  # Upload, Export, Squad, Flip, Stage
+    row2_elements = 6  # Upload, Library, Export, Squad, Flip, Stage
     element_width = available_width // row2_elements
     spacing = (available_width % row2_elements) // (row2_elements - 1)
     
@@ -284,11 +312,14 @@ def create_ui():
     upload_button = pygame_gui.elements.UIButton(pygame.Rect(x_offset, y_start + padding + row_height + row_spacing, element_width, 25), 
                                                text="Upload", manager=manager)
     x_offset += element_width + spacing
+    library_button = pygame_gui.elements.UIButton(pygame.Rect(x_offset, y_start + padding + row_height + row_spacing, element_width, 25), 
+                                                text="Library", manager=manager)
+    x_offset += element_width + spacing
     export_button = pygame_gui.elements.UIButton(pygame.Rect(x_offset, y_start + padding + row_height + row_spacing, element_width, 25), 
                                                text="Export", manager=manager)
     x_offset += element_width + spacing
     squad_button = pygame_gui.elements.UIButton(pygame.Rect(x_offset, y_start + padding + row_height + row_spacing, element_width, 25), 
-                                              text="Squad", manager=manager)
+                                              text=squad_label(), manager=manager)
     x_offset += element_width + spacing
     flip_button = pygame_gui.elements.UIButton(pygame.Rect(x_offset, y_start + padding + row_height + row_spacing, element_width, 25), 
                                              text="Flip", manager=manager)
@@ -343,6 +374,7 @@ def create_ui():
         'beats_input': beats_input,
         'zoom_slider': zoom_slider,
         'upload_button': upload_button,
+        'library_button': library_button,
         'export_button': export_button,
         'half_button': half_button,
         'double_button': double_button,
@@ -357,150 +389,425 @@ def create_ui():
         'clear_bg_button': clear_bg_button
     }
 
+def squad_label():
+    """Squad button text: the formation and crowd size, or plain "Squad" when off"""
+    formation = formation_for(squad_mode)
+    return "Squad" if formation is None else f"{formation.title()} x{crowd_size}"
+
 ui_elements = create_ui()
 
-def extract_beats_from_filename(filepath):
-    """Extract number of beats from filename pattern _XB.gif where X is a number"""
-    filename = os.path.basename(filepath)
-    import re
-    match = re.search(r'_(\d+)B\.gif$', filename, re.IGNORECASE)
-    if match:
-        try:
-            return float(match.group(1))
-        except ValueError:
-            pass
-    return DEFAULT_BEATS
+def mark_ui_dirty():
+    global ui_dirty_until
+    ui_dirty_until = time.monotonic() + UI_SETTLE_SECONDS
 
-def load_gif(gif_path, slot_index):
-    slot = slots[slot_index]
-    
-    # Extract beats from filename
-    slot.beats = extract_beats_from_filename(gif_path)
-    ui_elements['beats_input'].set_text(str(slot.beats))
+def update_squad_ui():
+    ui_elements['squad_button'].set_text(squad_label())
+
+def update_bpm_ui():
+    """Show the current tempo in the BPM field and slider"""
+    ui_elements['bpm_input'].set_text(format_bpm(tempo.bpm))
+    ui_elements['bpm_slider'].set_current_value(tempo.bpm)
+    mark_ui_dirty()  # Tempo changes from the tap or beat tracker come without any input event
+
+update_bpm_ui()
+
+gif_library = GifLibrary(LIBRARY_PATH)
+for library_dir in args.library or []:
+    gif_library.add_root(library_dir)
+gif_library.scan()  # Picks up files added, changed or removed since the last run
+library_panel = LibraryPanel(gif_library, lambda path: load_gif(path, active_slot),
+                             lambda: filedialog.askdirectory(title="Add GIF Folder"))
+
+def load_gif(gif_path, slot_index, beats=None):
+    """Start decoding a GIF into a slot in the background.
+
+    The slot keeps playing its current content until the decode finishes and
+    finish_gif_load swaps the new frames in.
+    """
+    if beats is None:
+        beats = extract_beats_from_filename(gif_path)
+    gif_loader.submit(gif_path, slot_index, beats)
+    print(f"Loading {os.path.basename(gif_path)} into slot {slot_index + 1}...")
+
+def finish_gif_load(job):
+    """Swap a fully decoded GIF into its slot (main thread only)"""
+    if job.error is not None:
+        print(f"Error loading GIF {job.gif_path}: {job.error}")
+        return
+    slot = slots[job.slot_index]
     
-    pil_img = Image.open(gif_path)
-    frames_out = []
-    durations_out = []
-    pil_out = []
+    # Beats were parsed from the filename when the load started
+    slot.beats = job.beats
+    if job.slot_index == active_slot:
+        ui_elements['beats_input'].set_text(str(slot.beats))
+        mark_ui_dirty()
     
     # Store original size
-    slot.original_size = pil_img.size
-    
-    for frame in ImageSequence.Iterator(pil_img):
-        frame_rgba = frame.convert("RGBA")
-        pil_out.append(frame_rgba.copy())
-        duration = frame.info.get("duration", 100)
-        durations_out.append(duration)
-        mode = frame_rgba.mode
-        size = frame_rgba.size
-        data = frame_rgba.tobytes()
-        frames_out.append(pygame.image.frombuffer(data, size, mode))
+    slot.original_size = job.size
     
-    slot.frames = frames_out
-    slot.durations = durations_out
-    slot.frames_pil = pil_out
-    slot.width, slot.height = size
-    slot.original_loop_duration = sum(durations_out)
-    slot.frame_idx = 0
+    slot.set_frames(job.pixels, job.durations, job.palettes)
     slot.is_loaded = True
+    scaled_frame_cache.invalidate_slot(job.slot_index)
+    beat_effects.invalidate_slot(job.slot_index)
+    thumbnail_strip.build_thumbnails(slot, horizontal_flip, job.thumbnails)
+    slot_paths[job.slot_index] = job.gif_path
+    set_list.set_clip(job.slot_index, job.gif_path)
+    stage_output.load(job.slot_index, job.gif_path, slot.beats)
+    source = "from disk cache" if job.from_cache else "decoded"
+    if slot.is_streaming:
+        source = f"streaming, {slot.pixels.window} frame window"
+    print(f"Loaded {os.path.basename(job.gif_path)} into slot {job.slot_index + 1} "
+          f"({slot.frame_count} frames, {slot.memory_bytes() / (1024 * 1024):.1f} MB, {source})")
+
+def clear_slot(slot_index):
+    """Empty a slot (a set list bank with nothing in it)"""
+    gif_loader.cancel(slot_index)
+    slots[slot_index].clear()
+    scaled_frame_cache.invalidate_slot(slot_index)
+    beat_effects.invalidate_slot(slot_index)
+    thumbnail_strip.invalidate_slot(slot_index)
+    slot_paths[slot_index] = None
+    stage_output.clear(slot_index)
+
+def clip_settings():
+    """The settings the active clip is shown with, as a session stores them"""
+    return {
+        'bpm': round(tempo.bpm, 3),
+        'beats': slots[active_slot].beats,
+        'zoom': round(zoom_level, 3),
+        'squad': squad_mode,
+        'squad_spacing': round(squad_spacing, 3),
+        'squad_size': squad_size,
+        'crowd': crowd_size,
+        'flip': horizontal_flip,
+        'bg_color': stage_background.color,
+        'bg_image': stage_background.image_path,
+    }
+
+def apply_clip_settings(settings):
+    """Show a clip with its session settings; settings it doesn't have stay as they are"""
+    global zoom_level, squad_mode, squad_spacing, squad_size, crowd_size, horizontal_flip
+    if 'bpm' in settings:
+        tempo.set_bpm(settings['bpm'])
+        update_bpm_ui()
+    if 'zoom' in settings and settings['zoom'] != zoom_level:
+        zoom_level = settings['zoom']
+        ui_elements['zoom_slider'].set_current_value(zoom_level)
+        scaled_frame_cache.clear()
+    if 'squad' in settings:
+        squad_mode = formation_for(settings['squad']) or False
+    if 'crowd' in settings:
+        crowd_size = settings['crowd']
+    update_squad_ui()
+    if 'squad_spacing' in settings:
+        squad_spacing = settings['squad_spacing']
+        ui_elements['squad_spacing_slider'].set_current_value(squad_spacing)
+    if 'squad_size' in settings and settings['squad_size'] != squad_size:
+        squad_size = int(settings['squad_size'])
+        ui_elements['squad_size_slider'].set_current_value(squad_size)
+        scaled_frame_cache.clear()
+    if 'flip' in settings:
+        horizontal_flip = bool(settings['flip'])
+    if 'bg_color' in settings:
+        set_stage_background_color(tuple(settings['bg_color']))
+    if 'bg_image' in settings and settings['bg_image'] != stage_background.image_path:
+        if settings['bg_image']:
+            set_stage_background_image(settings['bg_image'])
+        else:
+            clear_stage_background()
+
+def remember_clip():
+    """Store the active clip's settings in the set list once its GIF is showing"""
+    if slots[active_slot].is_loaded and slot_paths[active_slot] == set_list.bank.path(active_slot):
+        set_list.remember(active_slot, clip_settings())
+
+def select_slot(slot_index):
+    """Make a slot active; the clip being left keeps the settings it was shown with"""
+    global active_slot
+    remember_clip()
+    active_slot = slot_index
+    apply_clip_settings(set_list.bank.settings_for(slot_index))
+    ui_elements['beats_input'].set_text(str(slots[active_slot].beats))
+
+def show_bank(bank_index):
+    """Put a set list bank in the slots; prefetched GIFs swap in at once"""
+    global active_slot
+    remember_clip()
+    bank = session.banks[bank_index]
+    for slot_index, (action, value) in enumerate(set_list.switch(bank_index, slot_paths)):
+        settings = bank.settings_for(slot_index)
+        if action == "ready":
+            gif_loader.cancel(slot_index)
+            finish_gif_load(value)
+        elif action == "keep":
+            gif_loader.cancel(slot_index)
+            slots[slot_index].beats = settings.get('beats', slots[slot_index].beats)
+        elif action == "load":
+            load_gif(value, slot_index, settings.get('beats'))
+        elif action == "clear":
+            clear_slot(slot_index)
+        # "loading": the prefetch is still decoding and arrives through finish_gif_load
+    active_slot = 0
+    apply_clip_settings(bank.settings_for(active_slot))
+    ui_elements['beats_input'].set_text(str(slots[active_slot].beats))
+    print(f"Bank {bank_index + 1}/{len(session.banks)}: {bank.name}")
+
+def save_session():
+    """Write the set list, asking for a file the first time"""
+    remember_clip()
+    path = session.path or filedialog.asksaveasfilename(defaultextension=".json",
+                                                        filetypes=[("Session", "*.json")])
+    if path:
+        try:
+            session.save(path)
+            print(f"Session saved to {path}")
+        except OSError as e:
+            print(f"Error saving session: {e}")
+
+def print_memory_report():
+    """Print how much frame memory each loaded slot and the scaled cache hold"""
+    total = 0
+    for slot in slots:
+        if slot.is_loaded:
+            storage = "indexed" if slot.is_indexed else "RGBA"
+            if slot.is_mapped:
+                storage += " mapped"
+            if slot.is_streaming:
+                storage = f"streaming ({slot.pixels.decoded_total} decoded, {slot.pixels.seeks} seeks)"
+            print(f"Slot {slot.index + 1}: {slot.frame_count} frames {slot.width}x{slot.height} "
+                  f"{storage}, {slot.memory_bytes() / (1024 * 1024):.1f} MB")
+            total += slot.memory_bytes()
+    print(f"Slots total: {total / (1024 * 1024):.1f} MB")
+    print(f"Set list prefetch: {set_list.prefetched_bytes() / (1024 * 1024):.1f} MB")
+    print(scaled_frame_cache.summary())
+    print(beat_effects.summary())
 
 def export_adjusted_gif(slot, speed_mult):
+    """Write the slot's GIF at speed_mult on a background thread, one frame at a time"""
+    global export_thread
+    if export_thread is not None and export_thread.is_alive():
+        print("Export: still writing the previous GIF")
+        return
     path = filedialog.asksaveasfilename(defaultextension=".gif", filetypes=[("GIF", "*.gif")])
-    if path:
-        # Convert frames to RGBA and ensure proper disposal while maintaining transparency
-        frames_pil = []
-        for frame in slot.frames_pil:
-            # Convert to RGBA to ensure transparency is preserved
-            frame_rgba = frame.convert('RGBA')
-            frames_pil.append(frame_rgba)
-
-        new_durs = [max(20, int(d / speed_mult)) for d in slot.durations]
-        
-        frames_pil[0].save(
-            path,
-            save_all=True,
-            append_images=frames_pil[1:],
-            duration=new_durs,
-            loop=0,
-            disposal=2,  # Clear the frame before rendering the next one
-            transparency=0,  # Use index 0 for transparency
-            optimize=False
-        )
+    if not path:
+        return
+    open_frames = slot.export_frames()
+    durations = list(slot.durations)
 
-def draw_main_stage():
+    def export():
+        start = time.perf_counter()
+        try:
+            write_retimed_gif(open_frames, durations, sum(durations) / speed_mult, path)
+        except (OSError, ValueError) as e:
+            print(f"Export: error writing {path}: {e}")
+            return
+        print(f"Exported {path} ({time.perf_counter() - start:.1f} s)")
+
+    export_thread = threading.Thread(target=export, name="gif-export", daemon=True)
+    export_thread.start()
+
+def main_stage_rect():
     # Calculate main stage area - extend all the way to controls
     controls_y = window_height - UI_HEIGHT - THUMBNAIL_HEIGHT
     stage_height = controls_y  # Stage fills from top to controls
-    stage_rect = pygame.Rect(0, 0, window_width, stage_height)
+    return pygame.Rect(0, 0, window_width, stage_height)
+
+def draw_main_stage():
+    stage_rect = main_stage_rect()
+    
+    # Keep zoomed GIFs inside the stage so they never paint over the controls
+    screen.set_clip(stage_rect)
     
     # Draw stage background
-    draw_stage_background(screen, stage_rect)
+    stage_background.draw(screen, stage_rect)
     
     # Draw active GIF if loaded
     slot = slots[active_slot]
-    draw_gif_on_stage(screen, stage_rect, slot, zoom_level, squad_mode, squad_size, horizontal_flip)
+    draw_gif_on_stage(screen, stage_rect, slot, scaled_frame_cache, zoom_level, squad_mode,
+                      squad_spacing, squad_size, horizontal_flip, crowd_size, beat_effects)
+    perf_overlay.draw(screen, (stage_rect.x + 5, stage_rect.y + 5))
+    screen.set_clip(None)
+
+def draw_stream_stage():
+    """Draw the clean stage (no overlays or panels) into the stream's frame and hand it over"""
+    surface = stage_stream.surface
+    stage_rect = surface.get_rect()
+    stage_background.draw(surface, stage_rect)
+    draw_gif_on_stage(surface, stage_rect, slots[active_slot], scaled_frame_cache, zoom_level, squad_mode,
+                      squad_spacing, squad_size, horizontal_flip, crowd_size, beat_effects)
+    stage_stream.publish()
+
+def stage_state():
+    """Everything that affects what the stage shows; the stage is redrawn when it changes"""
+    slot = slots[active_slot]
+    return (active_slot, slot.is_loaded, id(slot.pixels), slot.frame_idx, zoom_level, squad_mode,
+            squad_spacing, squad_size, crowd_size, horizontal_flip, stage_background.color,
+            id(stage_background.image), beat_effects.levels)
+
+def ui_needs_redraw():
+    # Focused text fields have a blinking cursor
+    return (time.monotonic() < ui_dirty_until or ui_elements['bpm_input'].is_focused
+            or ui_elements['beats_input'].is_focused or library_panel.is_focused)
+
+def draw_main_window():
+    """Draw the main window, pushing only damaged regions to the display"""
+    global full_redraw
+    stage_rect = main_stage_rect()
+    overlay_changed = perf_overlay.refresh(time.monotonic())
+    if full_redraw or not DIRTY_RECT_RENDERING:
+        screen.fill((30, 30, 30))
+        draw_main_stage()
+        perf.mark("stage")
+        draw_thumbnail_strip()
+        perf.mark("thumbnails")
+        manager.draw_ui(screen)
+        perf.mark("ui_draw")
+        damage.add(screen.get_rect())
+        full_redraw = False
+    else:
+        stage_drawn = overlay_changed or stage_state() != last_stage_state
+        if stage_drawn:
+            draw_main_stage()
+            damage.add(stage_rect)
+        perf.mark("stage")
+        strip_y = window_height - THUMBNAIL_HEIGHT
+        for rect in update_thumbnail_strip():
+            screen.blit(thumbnail_strip.surface, (rect.x, rect.y + strip_y), rect)
+            damage.add(rect.move(0, strip_y))
+        perf.mark("thumbnails")
+        # The library panel sits on the stage, so a stage redraw has to repaint it too
+        if ui_needs_redraw() or (stage_drawn and library_panel.visible):
+            controls_rect = pygame.Rect(0, stage_rect.bottom, window_width, UI_HEIGHT)
+            screen.fill((30, 30, 30), controls_rect)
+            manager.draw_ui(screen)
+            damage.add(controls_rect)
+            if library_panel.visible:
+                damage.add(library_panel.rect)
+        perf.mark("ui_draw")
+    rects = damage.flush(screen.get_size())
+    if rects:
+        pygame.display.update(rects)
+    perf.mark("flip")
+    return rects
+
+def update_thumbnail_strip():
+    # Redraw only the cells that changed; returns their rects within the strip
+    loading_progress = []
+    for i in range(MAX_SLOTS):
+        job = gif_loader.pending(i)
+        loading_progress.append(job.progress() if job is not None else None)
+    return thumbnail_strip.update(slots, active_slot, horizontal_flip, loading_progress)
 
 def draw_thumbnail_strip():
-    # Calculate thumbnail strip area
-    strip_y = window_height - THUMBNAIL_HEIGHT
-    thumbnail_width = window_width // MAX_SLOTS
-    
-    # Draw strip background
-    pygame.draw.rect(screen, (40, 40, 40), (0, strip_y, window_width, THUMBNAIL_HEIGHT))
-    
-    # Draw thumbnails
-    for i, slot in enumerate(slots):
-        x = i * thumbnail_width
-        y = strip_y
-        
-        # Draw slot background (highlighted if active)
-        bg_color = (60, 60, 60) if i == active_slot else (40, 40, 40)
-        pygame.draw.rect(screen, bg_color, (x, y, thumbnail_width, THUMBNAIL_HEIGHT))
-        
-        if slot.is_loaded:
-            # Calculate thumbnail dimensions
-            thumb_scale = min((thumbnail_width - 10) / slot.width, 
-                            (THUMBNAIL_HEIGHT - 20) / slot.height)
-            thumb_width = int(slot.width * thumb_scale)
-            thumb_height = int(slot.height * thumb_scale)
-            
-            # Center thumbnail in its slot
-            thumb_x = x + (thumbnail_width - thumb_width) // 2
-            thumb_y = y + (THUMBNAIL_HEIGHT - thumb_height) // 2
-            
-            # Draw thumbnail
-            current_frame = slot.frames[slot.frame_idx]
-            if horizontal_flip:
-                current_frame = pygame.transform.flip(current_frame, True, False)
-            thumbnail = pygame.transform.smoothscale(current_frame, (thumb_width, thumb_height))
-            screen.blit(thumbnail, (thumb_x, thumb_y))
-        
-        # Draw slot number
-        font = pygame.font.SysFont(None, 24)
-        number_text = font.render(str(i + 1), True, (200, 200, 200))
-        screen.blit(number_text, (x + 5, y + 5))
-
-def handle_tap():
-    global last_tap_time, bpm, tap_times
-    now = time.time()
-    if last_tap_time:
-        tap_times.append(now - last_tap_time)
-        if len(tap_times) > 5:
-            tap_times.pop(0)
-        if len(tap_times) >= 2:
-            avg = sum(tap_times) / len(tap_times)
-            new_bpm = max(30, min(int(60 / avg), MAX_BPM))
-            bpm = new_bpm
-            ui_elements['bpm_input'].set_text(str(bpm))
-            ui_elements['bpm_slider'].set_current_value(bpm)
-    last_tap_time = now
+    update_thumbnail_strip()
+    thumbnail_strip.draw(screen, window_height - THUMBNAIL_HEIGHT)
+
+def visible_slot_indices():
+    """Slots whose frames are on screen: the stage plus thumbnails"""
+    return range(MAX_SLOTS)
+
+def paced_slot_indices():
+    """Slots the loop keeps pace with; under load thumbnails only follow the stage now and then"""
+    if governor.quality < QUALITY_SLOW_THUMBNAILS:
+        return visible_slot_indices()
+    return [active_slot]
+
+def scheduled_slot_indices():
+    """Slots whose frames advance this frame"""
+    global last_thumbnail_update
+    now = time.monotonic()
+    if governor.quality >= QUALITY_SLOW_THUMBNAILS and now - last_thumbnail_update < 1.0 / THUMBNAIL_REDUCED_FPS:
+        return paced_slot_indices()
+    last_thumbnail_update = now
+    return visible_slot_indices()
+
+def apply_quality(level):
+    """Switch the quality savings of a frame governor level on or off"""
+    global full_redraw
+    scaled_frame_cache.smooth = level < QUALITY_FAST_SCALING
+    downsample = BACKGROUND_DOWNSAMPLE if level >= QUALITY_LOW_RES_BACKGROUND else 1
+    if downsample != stage_background.downsample:
+        stage_background.set_downsample(downsample)
+        full_redraw = True
+
+def fastest_frame_rate():
+    """Fastest frame rate among the paced slots at the current tempo (0 while paused)"""
+    if paused:
+        return 0.0
+    fastest = max((frame_scheduler.frame_rate(slots[i]) for i in paced_slot_indices() if slots[i].is_loaded),
+                  default=0.0)
+    if beat_effects.enabled:
+        # Beat effects can change the stage every phase bucket
+        fastest = max(fastest, PHASE_BUCKETS * tempo.bpm / 60.0)
+    return fastest
+
+def seconds_to_next_change():
+    """Seconds until a paced slot changes frame or the beat effects change level; None if nothing will"""
+    seconds = frame_scheduler.seconds_to_next_frame(slots, paced_slot_indices())
+    beats = beat_effects.beats_to_next_change(frame_scheduler.beat_position())
+    if beats is None or frame_scheduler.paused or tempo.bpm <= 0:
+        return seconds
+    effect_seconds = beats * 60.0 / tempo.bpm
+    return effect_seconds if seconds is None else min(seconds, effect_seconds)
+
+def handle_tap(tap_time=None):
+    # Taps set the tempo and put a beat on the last tap
+    if tempo.tap(tap_time):
+        update_bpm_ui()
+
+def apply_remote_command(command):
+    """Apply a command from the control server (main thread)"""
+    global paused
+    if command.name == "bpm":
+        tempo.set_bpm(command.value)
+    elif command.name == "nudge":
+        tempo.nudge(command.value)
+    elif command.name == "halve":
+        tempo.halve()
+    elif command.name == "double":
+        tempo.double()
+    elif command.name == "tap":
+        # Stamped when the packet arrived, so the tick it waited for doesn't skew the tempo
+        handle_tap(command.time)
+    elif command.name == "pause":
+        paused = not paused if command.value is None else command.value
+    elif command.name == "play":
+        paused = False
+    elif command.name == "slot" and 1 <= command.value <= MAX_SLOTS:
+        select_slot(command.value - 1)
+    elif command.name == "bank" and 1 <= command.value <= len(session.banks):
+        show_bank(command.value - 1)
+    elif command.name == "bank_next" and set_list.current + 1 < len(session.banks):
+        show_bank(set_list.current + 1)
+    elif command.name == "bank_prev" and set_list.current > 0:
+        show_bank(set_list.current - 1)
+    if command.name in ("bpm", "nudge", "halve", "double"):
+        update_bpm_ui()
+    mark_ui_dirty()
+
+def remote_state():
+    """What remote controllers see (pushed to them whenever it changes)"""
+    return {
+        'bpm': round(tempo.bpm, 3),
+        'paused': paused,
+        'slot': active_slot + 1,
+        'clips': [os.path.basename(path) if path else None for path in slot_paths],
+        'bank': set_list.current + 1,
+        'banks': len(session.banks),
+        'bank_name': set_list.bank.name,
+        'following_audio': beat_tracker is not None and follow_audio,
+    }
+
+if any(session.banks[0].clips):
+    show_bank(0)
 
 # Main Loop
-clock = pygame.time.Clock()
 running = True
+shown_redraw_rate = None
 
 while running:
-    time_delta = clock.tick(60) / 1000.0
+    time_delta = governor.wait()
+    perf.begin_frame()
     
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
@@ -516,95 +823,111 @@ while running:
             min_required_height = controls_height + THUMBNAIL_HEIGHT + 50  # 50px for stage minimum
             window_height = max(min_required_height, event.h)
             screen = pygame.display.set_mode((window_width, window_height), pygame.RESIZABLE)
+            scaled_frame_cache.clear()
+            stage_background.clear_scaled()
+            thumbnail_strip.resize(window_width, THUMBNAIL_HEIGHT)
+            gif_loader.thumbnail_box = thumbnail_strip.thumbnail_box()
+            full_redraw = True
             ui_elements = create_ui()
-            if bpm > 0:
-                ui_elements['bpm_input'].set_text(str(bpm))
-                ui_elements['bpm_slider'].set_current_value(bpm)
+            update_bpm_ui()
+            library_panel.build(manager, main_stage_rect())
         
         # Add tap input handling
         if event.type == pygame.MOUSEBUTTONDOWN:
             # Calculate stage area
             stage_height = window_height - UI_HEIGHT - THUMBNAIL_HEIGHT
-            if event.pos[1] <= stage_height:
+            if event.pos[1] <= stage_height and not library_panel.rect.collidepoint(event.pos):
                 handle_tap()
         
         if event.type == pygame.KEYDOWN:
-            # ESC key to switch between windows
+            # ESC closes the stage window
             if event.key == pygame.K_ESCAPE:
-                if current_window == "stage":
-                    close_popout_window()
-                elif current_window == "main" and popout_active:
-                    create_popout_window()
+                close_popout_window()
             
             # Check if any text entry field is focused to prevent hotkey conflicts
             text_field_focused = (ui_elements['bpm_input'].is_focused or 
-                                ui_elements['beats_input'].is_focused)
+                                ui_elements['beats_input'].is_focused or library_panel.is_focused)
             
-            if event.key == pygame.K_SPACE:
+            if event.key == pygame.K_SPACE and not library_panel.is_focused:
                 paused = not paused
             # Only process number key hotkeys if no text field is focused
             elif not text_field_focused:
                 if event.key in range(pygame.K_1, pygame.K_9 + 1):
-                    active_slot = event.key - pygame.K_1
-                    ui_elements['beats_input'].set_text(str(slots[active_slot].beats))
+                    select_slot(event.key - pygame.K_1)
                 elif event.key == pygame.K_0:
-                    active_slot = 9
-                    ui_elements['beats_input'].set_text(str(slots[active_slot].beats))
+                    select_slot(9)
+                elif event.key == pygame.K_PAGEDOWN and set_list.current + 1 < len(session.banks):
+                    show_bank(set_list.current + 1)
+                elif event.key == pygame.K_PAGEUP and set_list.current > 0:
+                    show_bank(set_list.current - 1)
+                elif event.key == pygame.K_s and pygame.key.get_mods() & pygame.KMOD_CTRL:
+                    save_session()
+                elif event.key in (pygame.K_LEFTBRACKET, pygame.K_RIGHTBRACKET):
+                    crowd_size = step_crowd_size(crowd_size, 1 if event.key == pygame.K_RIGHTBRACKET else -1)
+                    update_squad_ui()
+                    print(f"Crowd size: {crowd_size} dancers")
+                elif pygame.K_F1 <= event.key < pygame.K_F1 + len(EFFECTS):
+                    name = EFFECTS[event.key - pygame.K_F1]
+                    print(f"Beat effect {name}: {'on' if beat_effects.toggle(name) else 'off'}")
+                elif event.key == pygame.K_m:
+                    print_memory_report()
+                elif event.key == pygame.K_p:
+                    perf_overlay.toggle()
+                    full_redraw = True
+                elif event.key == pygame.K_a and beat_tracker is not None:
+                    follow_audio = not follow_audio
+                    print(f"Following the audio beat: {'on' if follow_audio else 'off'}")
             
-            # Arrow keys always work regardless of focus
-            if event.key == pygame.K_RIGHT:
-                bpm = min(MAX_BPM, bpm * 2)
-                ui_elements['bpm_input'].set_text(str(bpm))
-                ui_elements['bpm_slider'].set_current_value(bpm)
+            # Arrow keys always work regardless of focus, except while typing a library search
+            if library_panel.is_focused:
+                pass
+            elif event.key == pygame.K_RIGHT:
+                tempo.double()
+                update_bpm_ui()
             elif event.key == pygame.K_LEFT:
-                bpm = max(30, bpm // 2)
-                ui_elements['bpm_input'].set_text(str(bpm))
-                ui_elements['bpm_slider'].set_current_value(bpm)
+                tempo.halve()
+                update_bpm_ui()
             elif event.key == pygame.K_UP:
-                if pygame.key.get_mods() & pygame.KMOD_SHIFT:
-                    bpm = min(MAX_BPM, bpm + 10)
-                else:
-                    bpm = min(MAX_BPM, bpm + 1)
-                ui_elements['bpm_input'].set_text(str(bpm))
-                ui_elements['bpm_slider'].set_current_value(bpm)
+                tempo.nudge(10 if pygame.key.get_mods() & pygame.KMOD_SHIFT else 1)
+                update_bpm_ui()
             elif event.key == pygame.K_DOWN:
-                if pygame.key.get_mods() & pygame.KMOD_SHIFT:
-                    bpm = max(30, bpm - 10)
-                else:
-                    bpm = max(30, bpm - 1)
-                ui_elements['bpm_input'].set_text(str(bpm))
-                ui_elements['bpm_slider'].set_current_value(bpm)
+                tempo.nudge(-10 if pygame.key.get_mods() & pygame.KMOD_SHIFT else -1)
+                update_bpm_ui()
         
         if event.type == pygame_gui.UI_BUTTON_PRESSED:
             if event.ui_element == ui_elements['upload_button']:
                 path = filedialog.askopenfilename(filetypes=[("GIF", "*.gif")])
                 if path:
                     load_gif(path, active_slot)
+            elif event.ui_element == ui_elements['library_button']:
+                library_panel.toggle(manager, main_stage_rect())
+                full_redraw = True
             elif event.ui_element == ui_elements['export_button']:
                 if slots[active_slot].is_loaded:
-                    if bpm > 0:
-                        target_duration = (slots[active_slot].beats / bpm) * 60000
-                        effective_speed_multiplier = slots[active_slot].original_loop_duration / target_duration
-                        export_adjusted_gif(slots[active_slot], effective_speed_multiplier)
+                    slot = slots[active_slot]
+                    effective_speed_multiplier = speed_multiplier(slot.beats, tempo.bpm, slot.original_loop_duration)
+                    export_adjusted_gif(slot, effective_speed_multiplier)
             elif event.ui_element == ui_elements['half_button']:
-                bpm = max(30, bpm // 2)
-                ui_elements['bpm_input'].set_text(str(bpm))
-                ui_elements['bpm_slider'].set_current_value(bpm)
+                tempo.halve()
+                update_bpm_ui()
             elif event.ui_element == ui_elements['double_button']:
-                bpm = min(MAX_BPM, bpm * 2)
-                ui_elements['bpm_input'].set_text(str(bpm))
-                ui_elements['bpm_slider'].set_current_value(bpm)
+                tempo.double()
+                update_bpm_ui()
             elif event.ui_element == ui_elements['squad_button']:
-                squad_mode = not squad_mode
+                squad_mode = next_formation(squad_mode)
+                update_squad_ui()
             elif event.ui_element == ui_elements['flip_button']:
                 horizontal_flip = not horizontal_flip
             elif event.ui_element == ui_elements['popout_button']:
-                create_popout_window()
+                if stage_output.running:
+                    close_popout_window()
+                else:
+                    create_popout_window()
 
             elif event.ui_element == ui_elements['bg_color_button']:
                 # Simple color picker - cycle through some preset colors
                 colors = [(20, 20, 20), (0, 0, 0), (50, 50, 50), (100, 0, 100), (0, 100, 100)]
-                current_index = colors.index(stage_background_color) if stage_background_color in colors else 0
+                current_index = colors.index(stage_background.color) if stage_background.color in colors else 0
                 next_index = (current_index + 1) % len(colors)
                 set_stage_background_color(colors[next_index])
             elif event.ui_element == ui_elements['bg_image_button']:
@@ -622,11 +945,11 @@ while running:
         if event.type == pygame_gui.UI_TEXT_ENTRY_FINISHED:
             if event.ui_element == ui_elements['bpm_input']:
                 try:
-                    new_bpm = int(event.text)
-                    bpm = max(30, min(new_bpm, MAX_BPM))
-                    ui_elements['bpm_slider'].set_current_value(bpm)
+                    tempo.set_bpm(float(event.text))
                 except ValueError:
                     pass
+                # Show the tempo actually set (clamped, or unchanged if the text was invalid)
+                update_bpm_ui()
             elif event.ui_element == ui_elements['beats_input']:
                 try:
                     # Auto-update beats when user finishes typing
@@ -637,48 +960,125 @@ while running:
         
         if event.type == pygame_gui.UI_HORIZONTAL_SLIDER_MOVED:
             if event.ui_element == ui_elements['bpm_slider']:
-                bpm = int(event.value)
-                ui_elements['bpm_input'].set_text(str(bpm))
+                tempo.set_bpm(round(event.value))
+                ui_elements['bpm_input'].set_text(format_bpm(tempo.bpm))
             elif event.ui_element == ui_elements['zoom_slider']:
                 zoom_level = event.value
+                scaled_frame_cache.clear()
             elif event.ui_element == ui_elements['squad_spacing_slider']:
                 squad_spacing = event.value
             elif event.ui_element == ui_elements['squad_size_slider']:
                 squad_size = int(event.value)
+                scaled_frame_cache.clear()
 
         
-        # Only process UI events when in main window
-        if current_window == "main":
-            manager.process_events(event)
+        manager.process_events(event)
+        library_panel.process_event(event)
+        mark_ui_dirty()
+    if control_server is not None:
+        for command in control_server.drain():
+            apply_remote_command(command)
+    perf.mark("events")
     
-    # Only update UI when in main window
-    if current_window == "main":
-        manager.update(time_delta)
+    manager.update(time_delta)
+    perf.mark("ui_update")
     
-    # Update GIF frames
-    if not paused:
-        for slot in slots:
-            if slot.is_loaded:
-                if bpm > 0:
-                    target_duration = (slot.beats / bpm) * 60000
-                    effective_speed_multiplier = slot.original_loop_duration / target_duration
-                    current_duration = slot.durations[slot.frame_idx] / effective_speed_multiplier
-                else:
-                    current_duration = slot.durations[slot.frame_idx]
-                
-                if pygame.time.get_ticks() % int(current_duration) < 17:  # 17ms is roughly 1 frame at 60fps
-                    slot.frame_idx = (slot.frame_idx + 1) % len(slot.frames)
+    # Pick up GIFs decoded in the background
+    for job in gif_loader.poll():
+        if not set_list.collect(job):
+            finish_gif_load(job)
+    set_list.update()  # Decode the next bank while the loader has nothing else to do
+    if library_panel.update(time.monotonic()):
+        mark_ui_dirty()
+    perf.mark("loads")
     
-    # Draw based on current window
-    if current_window == "main":
-        # Draw main window
-        screen.fill((30, 30, 30))
-        draw_main_stage()
-        draw_thumbnail_strip()
-        manager.draw_ui(screen)
-        pygame.display.flip()
-    elif current_window == "stage":
-        # Draw stage window
-        draw_popout_stage()
+    # Tempo and beat phase from the audio input
+    if beat_tracker is not None:
+        estimate = beat_tracker.poll()
+        if estimate is not None and follow_audio:
+            tempo.set_bpm(match_octave(estimate.bpm, tempo.bpm))
+            tempo.align_beat(estimate.beat_time, BEAT_ALIGN_TOLERANCE)
+            if not ui_elements['bpm_input'].is_focused:
+                update_bpm_ui()
+            perf.set_gauge("beat confidence", estimate.confidence, ".1%")
+    
+    # Update GIF frames from the beat clock (re-anchored on tempo/pause changes)
+    frame_scheduler.set_paused(paused)
+    frame_scheduler.update(slots, scheduled_slot_indices())
+    beat_effects.set_beat(frame_scheduler.beat_position())
+    perf.mark("frames")
+    
+    # The stage window renders on its own; it only needs to hear about changes
+    if stage_output.running:
+        stage_output.sync(stage_output_state())
+    if control_server is not None:
+        control_server.publish(remote_state())
+    perf.mark("stage_output")
+    
+    # Drawn only while someone can see it; the encoder thread does the rest
+    if stage_stream is not None and (stage_stream.viewers or stage_stream.feed is not None):
+        if stage_state() != last_streamed_state:
+            draw_stream_stage()
+            last_streamed_state = stage_state()
+        perf.mark("stream")
+    
+    redrawn = bool(draw_main_window())
+    if DIRTY_RECT_RENDERING and damage.pixels_per_second != shown_redraw_rate:
+        shown_redraw_rate = damage.pixels_per_second
+        pygame.display.set_caption(f"GIF BPM Sync Tool v3 - {damage.summary()}")
+    last_stage_state = stage_state()
+    
+    # A frame is late if the beat clock already wants a different GIF frame than the one just shown
+    slot = slots[active_slot]
+    if slot.is_loaded and not paused:
+        perf.record_late(frame_scheduler.frame_for(slot) != slot.frame_idx)
+    perf.set_gauge("scaled cache hit rate", scaled_frame_cache.hit_rate(), ".1%")
+    perf.set_gauge("decode queue", gif_loader.queue_depth())
+    
+    # Sleep until the next GIF frame is due; overrunning frames cost quality instead of stutter
+    governor.set_rate(fastest_frame_rate())
+    busy = ui_needs_redraw() or gif_loader.queue_depth() > 0
+    if governor.end_frame(seconds_to_next_change(), busy):
+        apply_quality(governor.quality)
+    perf.set_gauge("loop fps", governor.loop_fps, ".1f")
+    perf.set_gauge("quality level", governor.quality)
+    
+    # Nothing to animate: sleep until input arrives instead of spinning at 60 fps
+    animating = not paused and any(slots[i].is_loaded for i in visible_slot_indices())
+    if DIRTY_RECT_RENDERING and not redrawn and not animating and gif_loader.queue_depth() == 0:
+        perf.skip_interval()
+        event = pygame.event.wait(IDLE_WAIT_MS)
+        if event.type != pygame.NOEVENT:
+            pygame.event.post(event)
 
+print_memory_report()
+print(governor.summary())
+if frame_disk_cache is not None:
+    print(frame_disk_cache.summary())
+close_popout_window()
+if export_thread is not None and export_thread.is_alive():
+    print("Waiting for the export to finish...")
+    export_thread.join()
+set_list.shutdown()
+gif_loader.shutdown()
+gif_library.stop()
+if beat_tracker is not None:
+    beat_tracker.stop()
+if control_server is not None:
+    control_server.stop()
+if stage_stream is not None:
+    print(stage_stream.summary())
+    stage_stream.stop()
 pygame.quit()
+
+if args.perf_json:
+    perf.write_json(args.perf_json)
+    print(f"Loop timings written to {args.perf_json}")
+if args.perf_csv:
+    perf.write_csv(args.perf_csv)
+    print(f"Loop timings written to {args.perf_csv}")
+if profiler is not None:
+    profiler.disable()
+    profiler.dump_stats(args.profile)
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    print(f"Profile written to {args.profile}")
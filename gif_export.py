@@ -0,0 +1,293 @@
+"""Retimed GIF export shared by the app's Export button and batch_export.py.
+
+Example:
+    python gif_export.py selftest
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+from PIL import GifImagePlugin, Image, ImageSequence
+
+GIF_DELAY_RESOLUTION = 10  # GIF delays are stored in centiseconds
+GIF_MIN_DELAY = 20  # Browsers play 0 and 10 ms delays at 100 ms, so never write them
+PALETTE_SAMPLE_FRAMES = 16  # Frames sampled when building the shared palette
+PALETTE_SAMPLE_SIZE = 256  # Longest side of each sampled frame
+ALPHA_THRESHOLD = 128  # Pixels below this alpha become the transparent index
+
+
+def read_gif_frames(gif_path):
+    """Return (rgba_frames, durations) for every frame of a GIF"""
+    frames = []
+    durations = []
+    for frame, duration in iter_rgba_frames(gif_path):
+        frames.append(frame)
+        durations.append(duration)
+    return frames, durations
+
+
+def retime_durations(durations, target_loop_ms, resolution=GIF_DELAY_RESOLUTION, min_delay=GIF_MIN_DELAY):
+    """Fit a loop of frame durations into target_loop_ms at GIF delay resolution.
+
+    Frame boundaries are scaled and then rounded on the cumulative timeline, so
+    rounding error is carried to the next frame instead of piling up and the
+    loop lasts target_loop_ms to the nearest centisecond. Frames that would be
+    shorter than min_delay are dropped and their time given to the frame
+    before them, except that a frame starting at the same time as the one
+    before replaces it. Returns a list of (source_frame_index, duration_ms).
+    """
+    total_source = sum(durations)
+    total_target = max(min_delay, int(round(target_loop_ms / resolution)) * resolution)
+    if len(durations) <= 1 or total_source <= 0:
+        return [(0, total_target)]
+
+    # Quantized start time of every source frame on the target timeline
+    starts = []
+    elapsed = 0
+    for duration in durations:
+        starts.append(int(round(elapsed * total_target / total_source / resolution)) * resolution)
+        elapsed += duration
+
+    kept = []  # (source index, start time)
+    for i, start in enumerate(starts):
+        if not kept or start - kept[-1][1] >= min_delay:
+            kept.append((i, start))
+        elif start == kept[-1][1]:
+            kept[-1] = (i, start)  # The frame before takes no time at all, this one is what shows
+    if len(kept) > 1 and total_target - kept[-1][1] < min_delay:
+        # Last frame would be too short, let the one before it run to the end
+        kept.pop()
+
+    ends = [start for _, start in kept[1:]] + [total_target]
+    return [(index, end - start) for (index, start), end in zip(kept, ends)]
+
+
+def iter_rgba_frames(gif_path):
+    """Yield (rgba_image, duration) for every frame of a GIF, decoding one at a time"""
+    with Image.open(gif_path) as pil_img:
+        for frame in ImageSequence.Iterator(pil_img):
+            yield frame.convert("RGBA"), frame.info.get("duration", 100)
+
+
+def palette_sample(frame):
+    """Opaque RGB pixels of a frame, strided down to about PALETTE_SAMPLE_SIZE on its longest side"""
+    # Stride instead of resampling so no blended in-between colors get into the palette
+    stride = max(1, max(frame.size) // PALETTE_SAMPLE_SIZE)
+    rgba = np.asarray(frame)[::stride, ::stride].reshape(-1, 4)
+    return rgba[rgba[:, 3] >= ALPHA_THRESHOLD, :3]
+
+
+def build_shared_palette(samples, colors):
+    """Quantize the sampled pixels of several frames into one palette image with `colors` entries"""
+    pixels = np.concatenate(samples) if samples else np.zeros((0, 3), dtype=np.uint8)
+    if len(pixels) == 0:
+        pixels = np.zeros((1, 3), dtype=np.uint8)
+    mosaic = Image.fromarray(pixels.reshape(1, -1, 3), "RGB")
+    palette_img = mosaic.quantize(colors=colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    palette = palette_img.getpalette()[:768]
+    palette_img.putpalette(palette + [0] * (768 - len(palette)))
+    return palette_img
+
+
+def select_frames(frames, indices):
+    """Yield the frames at the (increasing) source indices from a frame iterator"""
+    wanted = iter(indices)
+    target = next(wanted, None)
+    for i, frame in enumerate(frames):
+        if target is None:
+            return
+        if i == target:
+            yield frame
+            target = next(wanted, None)
+
+
+def scan_frames(frames, frame_count):
+    """First export pass: build the shared palette and pick each frame's disposal.
+
+    Returns (palette_img, transparency_index, disposals). Transparent pixels
+    get a reserved index; a frame is disposed to background only when the
+    next frame needs pixels it covered to become transparent again. Only the
+    current and first frame's alpha masks are kept, never the frames.
+    """
+    step = max(1, frame_count // PALETTE_SAMPLE_FRAMES)
+    samples = []
+    disposals = []
+    first_alpha = previous_alpha = None
+    has_alpha = False
+    for i, frame in enumerate(frames):
+        alpha = np.asarray(frame.getchannel("A")) < ALPHA_THRESHOLD
+        has_alpha = has_alpha or bool(alpha.any())
+        if i % step == 0:
+            samples.append(palette_sample(frame))
+        if previous_alpha is None:
+            first_alpha = alpha
+        else:
+            # Leaving a frame in place is only wrong if the next one clears pixels it drew
+            disposals.append(2 if np.any(alpha & ~previous_alpha) else 1)
+        previous_alpha = alpha
+    if previous_alpha is None:
+        raise ValueError("no frames to export")
+    disposals.append(2 if np.any(first_alpha & ~previous_alpha) else 1)  # The loop wraps to the first frame
+    transparency = 255 if has_alpha else None
+    return build_shared_palette(samples, 255 if has_alpha else 256), transparency, disposals
+
+
+def quantize_frame(frame, palette_img, transparency):
+    """Map an RGBA frame onto the shared palette; returns an (h, w) array of indices"""
+    indices = np.array(frame.convert("RGB").quantize(palette=palette_img, dither=Image.Dither.NONE))
+    if transparency is not None:
+        indices[np.asarray(frame.getchannel("A")) < ALPHA_THRESHOLD] = transparency
+    return indices
+
+
+class GifWriter:
+    """Writes a looping GIF with one global palette a frame at a time.
+
+    A frame drawn over a frame that is left in place is cropped to the region
+    that changed. Frames disposed to background are written whole, so the
+    disposal clears the entire canvas, and so is the frame after them.
+    """
+
+    def __init__(self, fp, palette_img, transparency):
+        self.fp = fp
+        self.palette = palette_img.getpalette()[:768]
+        self.transparency = transparency
+        self.previous = None  # Indices of the last frame if it was left in place
+        self.started = False
+
+    def _image(self, indices):
+        image = Image.fromarray(np.ascontiguousarray(indices), "P")
+        image.putpalette(self.palette)
+        return image
+
+    def write(self, indices, duration, disposal):
+        params = {"duration": duration, "disposal": disposal}
+        if self.transparency is not None:
+            params["transparency"] = self.transparency
+        if not self.started:
+            info = {"loop": 0}
+            if self.transparency is not None:
+                info["transparency"] = self.transparency
+            header, _ = GifImagePlugin.getheader(self._image(indices), info=info)
+            self.fp.write(b"".join(header))
+            self.started = True
+        offset = (0, 0)
+        region = indices
+        if self.previous is not None and disposal == 1:
+            changed = indices != self.previous
+            rows = np.flatnonzero(changed.any(axis=1))
+            if len(rows):
+                cols = np.flatnonzero(changed.any(axis=0))
+                top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            else:
+                top, bottom, left, right = 0, 1, 0, 1  # Nothing changed, keep a 1x1 frame for its delay
+            offset = (int(left), int(top))
+            region = indices[top:bottom, left:right]
+        for chunk in GifImagePlugin.getdata(self._image(region), offset, **params):
+            self.fp.write(chunk)
+        self.previous = indices if disposal == 1 else None
+
+    def close(self):
+        self.fp.write(b";")
+
+
+def write_retimed_gif(open_frames, durations, target_loop_ms, path):
+    """Write a GIF to path so one loop lasts target_loop_ms, holding one frame at a time.
+
+    open_frames() returns a fresh iterator over the source's RGBA frames in
+    order; it is called twice, once to sample the palette and once to
+    quantize and write. Consecutive frames that come out identical are
+    merged, and the file only replaces path once it is complete.
+    """
+    timeline = retime_durations(durations, target_loop_ms)
+    source_indices = [i for i, _ in timeline]
+    palette_img, transparency, disposals = scan_frames(select_frames(open_frames(), source_indices),
+                                                       len(source_indices))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        writer = GifWriter(fp, palette_img, transparency)
+        pending = None  # [indices, duration, disposal] waiting for identical frames to merge into it
+        frames = select_frames(open_frames(), source_indices)
+        for frame, (_, duration), disposal in zip(frames, timeline, disposals):
+            quantized = quantize_frame(frame, palette_img, transparency)
+            if pending is not None and pending[2] == 1 and np.array_equal(quantized, pending[0]):
+                pending[1] += duration
+                pending[2] = disposal
+                continue
+            if pending is not None:
+                writer.write(*pending)
+            pending = [quantized, duration, disposal]
+        writer.write(*pending)
+        writer.close()
+    os.replace(tmp_path, path)
+
+
+def save_retimed_gif(frames, durations, target_loop_ms, path):
+    """Write a list of RGBA frames to path so one loop lasts target_loop_ms"""
+    write_retimed_gif(lambda: iter(frames), durations, target_loop_ms, path)
+
+
+def decode_alpha(path):
+    """Composited alpha masks of every frame of a GIF, as a player shows them"""
+    with Image.open(path) as pil_img:
+        return [np.asarray(frame.convert("RGBA"))[:, :, 3] >= ALPHA_THRESHOLD
+                for frame in ImageSequence.Iterator(pil_img)]
+
+
+def selftest_clips(size=40):
+    """Synthetic RGBA clips whose transparency changes from frame to frame"""
+    clips = {}
+    frames = []
+    for i in range(3):
+        rgba = np.zeros((size, size, 4), dtype=np.uint8)
+        rgba[:] = (200, 40, 40, 255)
+        rgba[:4, size - 10:] = (40, 200, 40, 255) if i else (200, 40, 40, 255)
+        if i == 2:
+            rgba[:, :size // 2, 3] = 0  # Transparency appears where both frames before were opaque
+        frames.append(rgba)
+    clips["transparency appears"] = frames
+    frames = []
+    for i in range(8):
+        rgba = np.zeros((size, size, 4), dtype=np.uint8)
+        rgba[10:20, i * 3:i * 3 + 12] = (255, 200, 0, 255)
+        if i % 3 == 0:
+            rgba[30:36, :] = (0, 0, 255, 255)
+        frames.append(rgba)
+    clips["moving sprite"] = frames
+    clips["opaque"] = [np.full((size, size, 4), (i * 30, 100, 200, 255), dtype=np.uint8) for i in range(5)]
+    return clips
+
+
+def selftest():
+    """Export synthetic clips and compare the decoded alpha with the source; returns the number of failures"""
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, frames in selftest_clips().items():
+            path = os.path.join(tmp, "export.gif")
+            images = [Image.fromarray(rgba, "RGBA") for rgba in frames]
+            save_retimed_gif(images, [100] * len(images), 100 * len(images), path)
+            decoded = decode_alpha(path)
+            bad = [i for i, (alpha, rgba) in enumerate(zip(decoded, frames))
+                   if not np.array_equal(alpha, rgba[:, :, 3] >= ALPHA_THRESHOLD)]
+            ok = len(decoded) == len(frames) and not bad
+            failures += not ok
+            detail = f"{len(decoded)}/{len(frames)} frames" + (f", alpha differs in {bad}" if bad else "")
+            print(f"{'ok  ' if ok else 'FAIL'} {name}: {detail}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Retimed GIF export")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("selftest", help="export synthetic clips and check their transparency survives")
+    parser.parse_args(argv)
+    failures = selftest()
+    print("All exports match their source" if not failures else f"{failures} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
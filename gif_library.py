@@ -0,0 +1,359 @@
+import io
+import os
+import sqlite3
+import threading
+
+import pygame
+import pygame_gui
+from PIL import Image
+
+from frame_disk_cache import DEFAULT_CACHE_DIR
+from gif_stream import index_gif
+from sync_math import extract_beats_from_filename
+
+DEFAULT_LIBRARY_PATH = os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), "library.sqlite3")
+THUMBNAIL_SIZE = (96, 72)
+SCAN_COMMIT_EVERY = 50  # Clips indexed between commits, so the panel sees a big scan fill in
+SEARCH_LIMIT = 200
+PANEL_WIDTH = 380
+PANEL_REFRESH_SECONDS = 0.5  # Re-run the search at most this often while a scan adds clips
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS clips (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    frame_count INTEGER NOT NULL,  -- 0 for files that couldn't be read
+    loop_ms INTEGER NOT NULL,
+    beats REAL NOT NULL,
+    thumbnail BLOB  -- PNG of the first frame, at most THUMBNAIL_SIZE
+);
+CREATE INDEX IF NOT EXISTS clips_name ON clips (name COLLATE NOCASE);
+"""
+
+
+class LibraryClip:
+    """One indexed GIF"""
+
+    __slots__ = ('path', 'name', 'size', 'width', 'height', 'frame_count', 'loop_ms', 'beats', 'thumbnail')
+
+    def __init__(self, path, name, size, width, height, frame_count, loop_ms, beats, thumbnail):
+        self.path = path
+        self.name = name
+        self.size = size
+        self.width = width
+        self.height = height
+        self.frame_count = frame_count
+        self.loop_ms = loop_ms
+        self.beats = beats
+        self.thumbnail = thumbnail
+
+    def summary(self):
+        return (f"{self.width}x{self.height}, {self.frame_count} frames, {self.loop_ms / 1000:.2f}s, "
+                f"{self.beats:g} beats, {self.size / (1024 * 1024):.1f} MB")
+
+
+def index_clip(path, mtime, size):
+    """Row for the clips table: layout from the GIF index plus a first-frame thumbnail"""
+    name = os.path.basename(path)
+    beats = extract_beats_from_filename(path)
+    try:
+        index = index_gif(path)
+        with Image.open(path) as pil_img:
+            thumb = pil_img.convert("RGBA")
+        thumb.thumbnail(THUMBNAIL_SIZE)
+        png = io.BytesIO()
+        thumb.save(png, "PNG")
+    except (OSError, ValueError, EOFError):
+        # Remember broken files too, so rescans skip them until they change
+        return (path, name, mtime, size, 0, 0, 0, 0, beats, None)
+    return (path, name, mtime, size, index.width, index.height, index.frame_count, sum(index.durations),
+            beats, png.getvalue())
+
+
+class GifLibrary:
+    """Persistent index of the GIFs under a set of root folders.
+
+    A background thread walks the roots and (re)indexes only files whose mtime
+    or size changed since the last scan, so rescanning a big library is
+    mostly stat() calls. Files that disappeared are dropped, but only from
+    folders that could be walked, so an unplugged drive keeps its entries
+    until it is back. The scanner has
+    its own SQLite connection; searches run on the caller's connection and see
+    each batch as it is committed.
+    """
+
+    def __init__(self, db_path=DEFAULT_LIBRARY_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._db = self._connect()
+        self._db.executescript(SCHEMA)
+        self.generation = 0  # Bumped on every scanner commit, so views know to search again
+        self.scanned = 0  # Files looked at by the current scan
+        self.indexed = 0  # Files (re)indexed by the current scan
+        self._pending_roots = []
+        self._running = False  # Set while a scanner thread will still take roots off _pending_roots
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=10.0, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    @property
+    def scanning(self):
+        return self._running
+
+    def roots(self):
+        return [row[0] for row in self._db.execute("SELECT path FROM roots ORDER BY path")]
+
+    def add_root(self, path):
+        """Remember a folder for future scans; returns its absolute path"""
+        path = os.path.abspath(path)
+        with self._db:
+            self._db.execute("INSERT OR IGNORE INTO roots (path) VALUES (?)", (path,))
+        return path
+
+    def scan(self, roots=None):
+        """Rescan roots (default: every remembered folder) on the background thread"""
+        with self._lock:
+            self._pending_roots.extend(self.roots() if roots is None else roots)
+            if not self._running:
+                self._running = True
+                self.scanned = 0
+                self.indexed = 0
+                self._thread = threading.Thread(target=self._scan, name="gif-library-scan", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    def count(self):
+        return self._db.execute("SELECT COUNT(*) FROM clips WHERE frame_count > 0").fetchone()[0]
+
+    def search(self, text="", limit=SEARCH_LIMIT):
+        """Clips whose file name contains every word of text, by name"""
+        words = text.split()
+        where = " AND ".join(["frame_count > 0"] + ["name LIKE ? ESCAPE '\\'"] * len(words))
+        params = ["%" + w.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%" for w in words]
+        rows = self._db.execute(
+            f"SELECT path, name, size, width, height, frame_count, loop_ms, beats, thumbnail FROM clips "
+            f"WHERE {where} ORDER BY name COLLATE NOCASE LIMIT ?", params + [limit])
+        return [LibraryClip(*row) for row in rows]
+
+    def _next_root(self):
+        """The next root to scan; None (and the scanner stops) once the queue is empty"""
+        with self._lock:
+            if self._pending_roots and not self._stopped.is_set():
+                return self._pending_roots.pop(0)
+            # Decided under the same lock scan() queues roots with, so none are left behind
+            self._running = False
+            return None
+
+    def _scan(self):
+        db = self._connect()
+        try:
+            root = self._next_root()
+            while root is not None:
+                self._scan_root(db, root)
+                root = self._next_root()
+        except sqlite3.Error as e:
+            print(f"Library scan failed: {e}")
+            with self._lock:
+                self._pending_roots.clear()
+                self._running = False
+        finally:
+            db.close()
+
+    def _scan_root(self, db, root):
+        if not os.path.isdir(root):
+            print(f"Library: skipping {root}, the folder is not there (unplugged?)")
+            return
+        prefix = os.path.join(root, "")
+        known = {path: (mtime, size) for path, mtime, size in
+                 db.execute("SELECT path, mtime, size FROM clips WHERE substr(path, 1, ?) = ?",
+                            (len(prefix), prefix))}
+        seen = set()
+        batch = []
+        walk_errors = []
+        for folder, _, files in os.walk(root, onerror=walk_errors.append):
+            for file_name in files:
+                if self._stopped.is_set():
+                    return
+                if not file_name.lower().endswith(".gif"):
+                    continue
+                path = os.path.join(folder, file_name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                self.scanned += 1
+                if known.get(path) == (st.st_mtime, st.st_size):
+                    continue
+                batch.append(index_clip(path, st.st_mtime, st.st_size))
+                self.indexed += 1
+                if len(batch) >= SCAN_COMMIT_EVERY:
+                    self._commit(db, batch, [])
+                    batch = []
+        if walk_errors:
+            # Files under a folder that couldn't be listed weren't seen, but may well still be there
+            print(f"Library: kept missing clips of {root}, {walk_errors[0]}")
+            self._commit(db, batch, [])
+        else:
+            self._commit(db, batch, [(path,) for path in known.keys() - seen])
+
+    def _commit(self, db, rows, removed):
+        if not rows and not removed:
+            return
+        with db:
+            db.executemany("INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            db.executemany("DELETE FROM clips WHERE path = ?", removed)
+        self.generation += 1
+
+
+class LibraryPanel:
+    """Search-and-load panel over the right side of the stage.
+
+    Runs inside the main loop like the rest of the controls: typing filters the
+    index, selecting a clip previews its thumbnail, and double-clicking (or
+    Load) hands the path to load_clip, which starts an ordinary background load.
+    """
+
+    def __init__(self, library, load_clip, choose_folder):
+        self.library = library
+        self.load_clip = load_clip
+        self.choose_folder = choose_folder
+        self.visible = False
+        self.panel = None
+        self.search_text = ""  # Kept across rebuilds
+        self._clips = {}  # object id -> LibraryClip of the listed results
+        self._shown_generation = None
+        self._shown_scanning = None
+        self._next_refresh = 0.0
+
+    @property
+    def rect(self):
+        return self.panel.rect if self.panel is not None else pygame.Rect(0, 0, 0, 0)
+
+    @property
+    def is_focused(self):
+        return self.panel is not None and self.search_input.is_focused
+
+    def toggle(self, manager, stage_rect):
+        self.visible = not self.visible
+        if self.visible:
+            self.build(manager, stage_rect)
+        else:
+            self.kill()
+
+    def kill(self):
+        if self.panel is not None:
+            self.search_text = self.search_input.get_text()
+            self.panel.kill()
+            self.panel = None
+
+    def build(self, manager, stage_rect):
+        """(Re)create the panel's elements, e.g. after the controls were rebuilt for a resize"""
+        self.kill()
+        if not self.visible:
+            return
+        width = min(PANEL_WIDTH, stage_rect.width)
+        rect = pygame.Rect(stage_rect.right - width, stage_rect.top, width, stage_rect.height)
+        self.panel = pygame_gui.elements.UIPanel(rect, manager=manager, starting_height=2)
+        inner = width - 16
+        self.search_input = pygame_gui.elements.UITextEntryLine(
+            pygame.Rect(5, 5, inner, 28), manager=manager, container=self.panel, placeholder_text="Search clips")
+        self.search_input.set_text(self.search_text)
+        self.status_label = pygame_gui.elements.UILabel(
+            pygame.Rect(5, 36, inner, 20), "", manager=manager, container=self.panel)
+        preview_top = max(60, rect.height - THUMBNAIL_SIZE[1] - 60)
+        self.results = pygame_gui.elements.UISelectionList(
+            pygame.Rect(5, 60, inner, preview_top - 65), [], manager=manager, container=self.panel)
+        self.preview = pygame_gui.elements.UIImage(
+            pygame.Rect(5, preview_top, *THUMBNAIL_SIZE), pygame.Surface(THUMBNAIL_SIZE, pygame.SRCALPHA),
+            manager=manager, container=self.panel)
+        self.details_label = pygame_gui.elements.UITextBox(
+            "", pygame.Rect(THUMBNAIL_SIZE[0] + 10, preview_top, inner - THUMBNAIL_SIZE[0] - 5, THUMBNAIL_SIZE[1]),
+            manager=manager, container=self.panel)
+        button_width = (inner - 5) // 2
+        self.load_button = pygame_gui.elements.UIButton(
+            pygame.Rect(5, rect.height - 38, button_width, 28), "Load into slot",
+            manager=manager, container=self.panel)
+        self.add_folder_button = pygame_gui.elements.UIButton(
+            pygame.Rect(10 + button_width, rect.height - 38, button_width, 28), "Add folder",
+            manager=manager, container=self.panel)
+        self._shown_generation = None
+        self.refresh()
+
+    def refresh(self):
+        """Re-run the search and update the status line"""
+        clips = self.library.search(self.search_input.get_text())
+        self._clips = {f"#clip_{i}": clip for i, clip in enumerate(clips)}
+        self.results.set_item_list([(clip.name, object_id) for object_id, clip in self._clips.items()])
+        self._shown_generation = self.library.generation
+        self._shown_scanning = self.library.scanning
+        status = f"{self.library.count()} clips"
+        if self.search_input.get_text().strip():
+            status = f"{len(clips)} of {status} match"
+        if len(clips) >= SEARCH_LIMIT:
+            status += f", showing the first {SEARCH_LIMIT}"
+        if self._shown_scanning:
+            status += f" (scanning, {self.library.scanned} files checked)"
+        elif not self.library.roots():
+            status = "No folders yet: Add folder to index your GIFs"
+        self.status_label.set_text(status)
+
+    def update(self, now):
+        """Pick up clips the scanner committed; returns True if the panel changed"""
+        if self.panel is None or now < self._next_refresh:
+            return False
+        self._next_refresh = now + PANEL_REFRESH_SECONDS
+        if self.library.generation == self._shown_generation and self.library.scanning == self._shown_scanning:
+            return False
+        self.refresh()
+        return True
+
+    def selected_clip(self):
+        selection = self.results.get_single_selection(include_object_id=True)
+        return self._clips.get(selection[1]) if selection else None
+
+    def show_preview(self, clip):
+        thumb = pygame.Surface(THUMBNAIL_SIZE, pygame.SRCALPHA)
+        if clip is not None and clip.thumbnail:
+            image = pygame.image.load(io.BytesIO(clip.thumbnail), "thumb.png")
+            thumb.blit(image, ((THUMBNAIL_SIZE[0] - image.get_width()) // 2,
+                               (THUMBNAIL_SIZE[1] - image.get_height()) // 2))
+        self.preview.set_image(thumb)
+        self.details_label.set_text(clip.summary() if clip is not None else "")
+
+    def process_event(self, event):
+        """Handle events for the panel's elements (call after the UI manager saw them)"""
+        if self.panel is None:
+            return
+        if event.type == pygame_gui.UI_TEXT_ENTRY_CHANGED and event.ui_element == self.search_input:
+            self.refresh()
+        elif event.type == pygame_gui.UI_SELECTION_LIST_NEW_SELECTION and event.ui_element == self.results:
+            self.show_preview(self.selected_clip())
+        elif event.type == pygame_gui.UI_SELECTION_LIST_DOUBLE_CLICKED_SELECTION and event.ui_element == self.results:
+            clip = self.selected_clip()
+            if clip is not None:
+                self.load_clip(clip.path)
+        elif event.type == pygame_gui.UI_BUTTON_PRESSED:
+            if event.ui_element == self.load_button:
+                clip = self.selected_clip()
+                if clip is not None:
+                    self.load_clip(clip.path)
+            elif event.ui_element == self.add_folder_button:
+                folder = self.choose_folder()
+                if folder:
+                    self.library.scan([self.library.add_root(folder)])
+                    self.refresh()
@@ -0,0 +1,280 @@
+import concurrent.futures
+import glob
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from gif_slot import pack_indexed
+from gif_stream import FrameStream, index_gif
+from thumbnail_strip import scale_thumbnails
+
+DECODE_WORKERS = max(2, min(4, os.cpu_count() or 1))
+STREAM_FIRST_FRAME_TIMEOUT = 10.0  # Seconds to wait for a streamed GIF's first frame
+
+
+def iter_gif_frames(gif_path):
+    """Yield (rgba_array, duration) for every frame of a GIF"""
+    with Image.open(gif_path) as pil_img:
+        for frame in ImageSequence.Iterator(pil_img):
+            yield np.asarray(frame.convert("RGBA")), frame.info.get("duration", 100)
+
+
+class GifLoadJob:
+    """One GIF being decoded in the background for a slot"""
+
+    def __init__(self, gif_path, slot_index, indexed=False, beats=None):
+        self.gif_path = gif_path
+        self.slot_index = slot_index
+        self.indexed = indexed
+        self.beats = beats
+        self.from_cache = False
+        self.frame_count = 0  # Total frames, known once the worker opens the file
+        self.size = None
+        self.pixels = None  # (n, h, w, 4) RGBA, (n, h, w) indices when indexed, or a FrameStream
+        self.palettes = None
+        self.thumbnails = None  # (n, h, w, 4) RGBA thumbnails, scaled to fit thumbnail_box
+        self.thumbnail_box = None
+        self.durations = []
+        self.decoded = 0
+        self.done = False
+        self.error = None
+        self.cancelled = threading.Event()
+
+    def progress(self):
+        if not self.frame_count:
+            return 0.0
+        return min(1.0, self.decoded / self.frame_count)
+
+
+def decode_into(job):
+    """Decode job.gif_path straight into the job's preallocated frame buffer.
+
+    Yields after every frame so the caller can report progress or stop early.
+    Indexed jobs fall back to RGBA storage as soon as a frame has more than
+    256 colors.
+    """
+    with Image.open(job.gif_path) as pil_img:
+        job.size = pil_img.size
+        job.frame_count = getattr(pil_img, "n_frames", 1)
+    width, height = job.size
+    if job.indexed:
+        job.pixels = np.empty((job.frame_count, height, width), dtype=np.uint8)
+        job.palettes = np.empty((job.frame_count, 256, 4), dtype=np.uint8)
+    else:
+        job.pixels = np.empty((job.frame_count, height, width, 4), dtype=np.uint8)
+
+    for i, (frame_rgba, duration) in enumerate(iter_gif_frames(job.gif_path)):
+        if i >= job.frame_count:
+            break
+        if job.palettes is not None:
+            packed = pack_indexed(frame_rgba)
+            if packed is None:
+                # Too many colors, expand what we have and continue as RGBA
+                rgba = np.empty((job.frame_count, height, width, 4), dtype=np.uint8)
+                for j in range(i):
+                    rgba[j] = job.palettes[j][job.pixels[j]]
+                job.pixels = rgba
+                job.palettes = None
+            else:
+                job.pixels[i], job.palettes[i] = packed
+        if job.palettes is None:
+            job.pixels[i] = frame_rgba
+        job.durations.append(duration)
+        job.decoded = i + 1
+        yield i
+
+    if job.decoded < job.frame_count:
+        # Trust the frames we actually got over the header's frame count
+        job.frame_count = job.decoded
+        job.pixels = job.pixels[:job.decoded]
+        if job.palettes is not None:
+            job.palettes = job.palettes[:job.decoded]
+
+
+def load_cached(job, disk_cache, key):
+    """Fill a job from the disk cache; returns False on a miss"""
+    cached = disk_cache.load(key)
+    if cached is None:
+        return False
+    job.pixels = cached.pixels
+    job.palettes = cached.palettes
+    job.durations = list(cached.durations)
+    job.size = cached.size
+    job.frame_count = job.decoded = len(job.durations)
+    if job.beats is None:
+        job.beats = cached.beats
+    job.from_cache = True
+    return True
+
+
+def prewarm_disk_cache(disk_cache, directory, indexed=False, beats_for=None, max_workers=DECODE_WORKERS):
+    """Decode every GIF under directory into the disk cache, skipping ones already there"""
+    paths = sorted(p for p in glob.glob(os.path.join(directory, "**", "*"), recursive=True)
+                   if p.lower().endswith(".gif") and os.path.isfile(p))
+    if not paths:
+        print(f"No GIFs found in {directory}")
+        return
+
+    def warm(path):
+        start = time.perf_counter()
+        key = disk_cache.key_for(path, indexed)
+        if disk_cache.contains(key):
+            return path, "already cached", time.perf_counter() - start
+        job = GifLoadJob(path, -1, indexed, beats_for(path) if beats_for else None)
+        try:
+            for _ in decode_into(job):
+                pass
+        except Exception as e:
+            return path, f"error: {e}", time.perf_counter() - start
+        disk_cache.store(key, job.pixels, job.durations, job.palettes, job.beats)
+        return path, f"{job.frame_count} frames", time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for n, (path, status, elapsed) in enumerate(pool.map(warm, paths), 1):
+            print(f"[{n}/{len(paths)}] {path}: {status} ({elapsed * 1000:.0f} ms)")
+    print(disk_cache.summary())
+
+
+class GifLoader:
+    """Decode GIFs on a thread pool and hand the finished buffers to the main loop.
+
+    Workers do the expensive part (LZW decode, RGBA conversion, copying into
+    the slot's contiguous frame buffer) and post progress on a queue. The main
+    loop calls poll() once per tick; surfaces are created lazily on the main
+    thread as views into the buffer the first time a frame is drawn. With a
+    disk cache, a GIF seen before is memory-mapped instead of decoded. GIFs
+    that would decode to more than stream_budget bytes are indexed and handed
+    over as a FrameStream as soon as their first frame is decoded. With a
+    thumbnail_box set, workers also scale every frame down to a thumbnail, so
+    the main loop never has to.
+    """
+
+    def __init__(self, max_workers=DECODE_WORKERS, indexed=False, disk_cache=None,
+                 stream_budget=None, stream_window=64, thumbnail_box=None):
+        self.indexed = indexed
+        self.thumbnail_box = thumbnail_box  # (max width, max height) of the thumbnail strip cells
+        self.disk_cache = disk_cache
+        self.stream_budget = stream_budget
+        self.stream_window = stream_window
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix="gif-decode")
+        self._results = queue.SimpleQueue()
+        self._jobs = {}  # slot_index -> newest job for that slot
+
+    def submit(self, gif_path, slot_index, beats=None):
+        """Start decoding gif_path for a slot, superseding any load already running there.
+
+        slot_index can be any hashable key; the set list prefetches under (bank, slot).
+        """
+        previous = self._jobs.get(slot_index)
+        if previous is not None:
+            previous.cancelled.set()
+        job = GifLoadJob(gif_path, slot_index, self.indexed, beats)
+        self._jobs[slot_index] = job
+        self._executor.submit(self._decode, job)
+        return job
+
+    def reassign(self, slot_index, new_slot_index):
+        """Deliver a load still running for one slot to another slot instead"""
+        job = self._jobs.pop(slot_index, None)
+        if job is None:
+            return None
+        self.cancel(new_slot_index)
+        job.slot_index = new_slot_index
+        self._jobs[new_slot_index] = job
+        return job
+
+    def cancel(self, slot_index):
+        """Stop a load that is still running for a slot"""
+        job = self._jobs.pop(slot_index, None)
+        if job is not None:
+            job.cancelled.set()
+
+    def pending(self, slot_index):
+        """Return the job still loading into a slot, or None"""
+        return self._jobs.get(slot_index)
+
+    def queue_depth(self):
+        return len(self._jobs)
+
+    def _decode(self, job):
+        try:
+            key = None
+            if self.disk_cache is not None:
+                key = self.disk_cache.key_for(job.gif_path, job.indexed)
+                if load_cached(job, self.disk_cache, key):
+                    self._scale_thumbnails(job)
+                    self._results.put(job)
+                    return
+            if self.stream_budget is not None and self._stream(job):
+                return
+            for _ in decode_into(job):
+                if job.cancelled.is_set():
+                    return
+            if job.decoded == 0:
+                raise ValueError("no frames decoded")
+            if key is not None:
+                self.disk_cache.store(key, job.pixels, job.durations, job.palettes, job.beats)
+            self._scale_thumbnails(job)
+        except Exception as e:
+            job.error = e
+        self._results.put(job)
+
+    def _scale_thumbnails(self, job):
+        box = self.thumbnail_box
+        if box is None:
+            return
+        if job.palettes is not None:
+            frames = (job.palettes[i][job.pixels[i]] for i in range(job.frame_count))
+        else:
+            frames = job.pixels
+        job.thumbnails = scale_thumbnails(frames, job.frame_count, job.size, box, job.cancelled)
+        job.thumbnail_box = box
+
+    def _stream(self, job):
+        """Hand a GIF over as a FrameStream if it is over the budget; returns False otherwise"""
+        try:
+            index = index_gif(job.gif_path)
+        except ValueError:
+            return False  # Let the full decoder report what is wrong with the file
+        if index.decoded_bytes() <= self.stream_budget:
+            return False
+        stream = FrameStream(job.gif_path, index, self.stream_window)
+        job.size = (index.width, index.height)
+        job.frame_count = index.frame_count
+        job.durations = list(index.durations)
+        job.pixels = stream
+        stream.start()
+        # Playback can start as soon as there is a first frame
+        if not stream.wait_ready(0, STREAM_FIRST_FRAME_TIMEOUT):
+            stream.close()
+            raise stream.error or TimeoutError("first frame took too long to decode")
+        job.decoded = 1
+        self._results.put(job)
+        return True
+
+    def poll(self):
+        """Return the jobs that finished (or failed) since the last poll"""
+        finished = []
+        while True:
+            try:
+                job = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if job.cancelled.is_set() or self._jobs.get(job.slot_index) is not job:
+                if isinstance(job.pixels, FrameStream):
+                    job.pixels.close()
+                continue
+            job.done = True
+            del self._jobs[job.slot_index]
+            finished.append(job)
+        return finished
+
+    def shutdown(self):
+        for job in self._jobs.values():
+            job.cancelled.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
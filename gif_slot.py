@@ -0,0 +1,140 @@
+import numpy as np
+import pygame
+from PIL import Image
+
+from gif_export import iter_rgba_frames
+from gif_stream import FrameStream
+from sync_math import DEFAULT_BEATS
+
+PLACEHOLDER_SIZE = (300, 300)
+
+
+class GifSlot:
+    """One GIF slot backed by a single contiguous frame buffer.
+
+    pixels is either an (n, h, w, 4) RGBA array or, in indexed mode, an
+    (n, h, w) array of palette indices with one (256, 4) RGBA palette per
+    frame in palettes. Pygame surfaces and PIL export frames are built on
+    demand as views into the RGBA buffer (indexed frames are expanded first).
+    Very long GIFs use a FrameStream instead, which only holds a window of
+    decoded frames around the playhead.
+    """
+
+    __slots__ = ('index', 'beats', 'durations', 'width', 'height', 'frame_idx',
+                 'original_loop_duration', 'is_loaded', 'original_size',
+                 'pixels', 'palettes', '_surfaces')
+
+    def __init__(self, index):
+        self.index = index
+        self.beats = DEFAULT_BEATS
+        self.frame_idx = 0
+        self.clear()
+
+    def clear(self):
+        """Drop the slot's GIF and show the empty placeholder"""
+        self.is_loaded = False
+        self.original_size = PLACEHOLDER_SIZE
+        placeholder = np.empty((1, PLACEHOLDER_SIZE[1], PLACEHOLDER_SIZE[0], 4), dtype=np.uint8)
+        placeholder[:] = (30, 30, 30, 255)
+        self.set_frames(placeholder, [100])
+
+    def set_frames(self, pixels, durations, palettes=None):
+        """Replace the slot's frames with a new buffer and its frame durations"""
+        if isinstance(getattr(self, 'pixels', None), FrameStream):
+            self.pixels.close()
+        self.pixels = pixels
+        self.palettes = palettes
+        self.durations = list(durations)
+        self.height, self.width = pixels.shape[1:3]
+        self.original_loop_duration = sum(self.durations)
+        self.frame_idx = 0
+        self._surfaces = [None] * len(self.durations)
+
+    @property
+    def frame_count(self):
+        return len(self.durations)
+
+    @property
+    def is_indexed(self):
+        return self.palettes is not None
+
+    @property
+    def is_mapped(self):
+        return isinstance(self.pixels, np.memmap)
+
+    @property
+    def is_streaming(self):
+        return isinstance(self.pixels, FrameStream)
+
+    def prepare_frame(self, frame_idx):
+        """Return the frame to show when the schedule wants frame_idx.
+
+        Fully decoded slots always show frame_idx. A streaming slot moves its
+        decode window to frame_idx and shows the newest decoded frame up to it,
+        holding the current frame if nothing newer is ready yet.
+        """
+        if not self.is_streaming:
+            return frame_idx
+        shown = self.pixels.best_ready(self.frame_idx, frame_idx)
+        self.pixels.set_playhead(frame_idx, keep=shown)
+        return shown
+
+    def frame_array(self, frame_idx):
+        """RGBA pixels of a frame as an (h, w, 4) array (a view unless indexed)"""
+        if self.palettes is not None:
+            return self.palettes[frame_idx][self.pixels[frame_idx]]
+        return self.pixels[frame_idx]
+
+    def get_frame(self, frame_idx):
+        """Pygame surface for a frame, sharing memory with the frame buffer"""
+        surface = self._surfaces[frame_idx]
+        if surface is None:
+            surface = pygame.image.frombuffer(self.frame_array(frame_idx), (self.width, self.height), "RGBA")
+            if self.palettes is None and not self.is_streaming:
+                # Views are free to keep; expanded indexed and streamed frames are rebuilt on demand
+                self._surfaces[frame_idx] = surface
+        return surface
+
+    def get_frame_pil(self, frame_idx):
+        """PIL RGBA image for a frame (zero-copy view for RGBA storage)"""
+        return Image.frombuffer("RGBA", (self.width, self.height), self.frame_array(frame_idx),
+                                "raw", "RGBA", 0, 1)
+
+    def export_frames(self):
+        """A function that returns a fresh iterator over the GIF's frames as PIL RGBA images.
+
+        It holds on to the current frame buffer, so it can run on another
+        thread even after the slot has moved on to another GIF. Streaming
+        slots only have a window of frames, so theirs rereads the file.
+        """
+        if self.is_streaming:
+            gif_path = self.pixels.gif_path
+            return lambda: (frame for frame, _ in iter_rgba_frames(gif_path))
+        pixels, palettes, size = self.pixels, self.palettes, (self.width, self.height)
+
+        def frames():
+            for i in range(len(pixels)):
+                rgba = palettes[i][pixels[i]] if palettes is not None else pixels[i]
+                yield Image.frombuffer("RGBA", size, rgba, "raw", "RGBA", 0, 1)
+        return frames
+
+    def memory_bytes(self):
+        total = self.pixels.nbytes
+        if self.palettes is not None:
+            total += self.palettes.nbytes
+        return total
+
+
+def pack_indexed(frame_rgba):
+    """Losslessly split an (h, w, 4) RGBA frame into indices and a 256-entry palette.
+
+    Returns None when the frame uses more than 256 distinct colors.
+    """
+    packed = np.ascontiguousarray(frame_rgba).view(np.uint32).reshape(-1)
+    colors, indices = np.unique(packed, return_inverse=True)
+    if len(colors) > 256:
+        return None
+    palette = np.zeros(256, dtype=np.uint32)
+    palette[:len(colors)] = colors
+    return (indices.astype(np.uint8).reshape(frame_rgba.shape[:2]),
+            palette.view(np.uint8).reshape(256, 4))
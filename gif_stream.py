@@ -0,0 +1,219 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_FRAME_DURATION = 100  # ms, what the full decoder uses for frames without a delay
+
+
+class GifIndex:
+    """Frame layout of a GIF file found without decoding any image data"""
+
+    def __init__(self, width, height, durations, offsets):
+        self.width = width
+        self.height = height
+        self.durations = durations
+        self.offsets = offsets  # File offset of every frame's image descriptor
+
+    @property
+    def frame_count(self):
+        return len(self.durations)
+
+    def decoded_bytes(self):
+        """Size of the whole GIF decoded to RGBA"""
+        return self.frame_count * self.width * self.height * 4
+
+
+def _skip_sub_blocks(data, pos):
+    """Return the position just past a chain of data sub-blocks"""
+    while True:
+        size = data[pos]
+        pos += 1
+        if size == 0:
+            return pos
+        pos += size
+
+
+def index_gif(gif_path):
+    """Walk a GIF's block structure and return its GifIndex.
+
+    Only block headers are read; LZW data is skipped sub-block by sub-block, so
+    this takes a fraction of the time a full decode does. Raises ValueError for
+    files that aren't GIFs or have no complete frame.
+    """
+    with open(gif_path, "rb") as f:
+        data = f.read()
+    if data[:6] not in (b"GIF87a", b"GIF89a"):
+        raise ValueError(f"{gif_path} is not a GIF")
+    width = int.from_bytes(data[6:8], "little")
+    height = int.from_bytes(data[8:10], "little")
+    flags = data[10]
+    pos = 13
+    if flags & 0x80:
+        pos += 3 * (1 << ((flags & 0x07) + 1))
+
+    durations = []
+    offsets = []
+    duration = DEFAULT_FRAME_DURATION
+    try:
+        while pos < len(data):
+            block = data[pos]
+            if block == 0x21:  # Extension
+                label = data[pos + 1]
+                if label == 0xF9 and data[pos + 2] >= 4:  # Graphic control: carries the frame delay
+                    duration = int.from_bytes(data[pos + 4:pos + 6], "little") * 10
+                pos = _skip_sub_blocks(data, pos + 2)
+            elif block == 0x2C:  # Image descriptor
+                start = pos
+                image_flags = data[pos + 9]
+                pos += 10
+                if image_flags & 0x80:
+                    pos += 3 * (1 << ((image_flags & 0x07) + 1))
+                pos = _skip_sub_blocks(data, pos + 1)  # Past the LZW minimum code size
+                offsets.append(start)
+                durations.append(duration)
+            elif block == 0x3B:  # Trailer
+                break
+            else:
+                break  # Garbage after the last frame
+    except IndexError:
+        pass  # Truncated file: keep the frames that were complete
+    if not durations:
+        raise ValueError(f"{gif_path} has no complete frames")
+    return GifIndex(width, height, durations, offsets)
+
+
+class FrameStream:
+    """Frames of a long GIF decoded on demand into a sliding window.
+
+    A background thread decodes the frames from the playhead up to `window`
+    frames ahead (in loop order, so it wraps to the start near the end) and
+    frames that fall behind the playhead are dropped. Only the window is ever
+    in memory. GIF frames can only be decoded in order, so when playback
+    outruns the decoder it keeps every frame newer than the one on screen and
+    playback falls back to the decoder's pace instead of freezing.
+    Quacks like the (n, h, w, 4) buffer GifSlot normally holds: stream[i]
+    returns frame i, which must be ready().
+    """
+
+    def __init__(self, gif_path, index, window):
+        self.gif_path = gif_path
+        self.index = index
+        self.window = max(2, min(window, index.frame_count))
+        self.shape = (index.frame_count, index.height, index.width, 4)
+        self.frame_bytes = index.width * index.height * 4
+        self.decoded_total = 0
+        self.seeks = 0  # Decodes that didn't follow on from the previous frame
+        self.error = None
+        self._frames = {}  # frame index -> (h, w, 4) RGBA array
+        self._playhead = 0
+        self._keep = 0  # Frame on screen, kept even if the playhead moved past it
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="gif-stream", daemon=True)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return len(self._frames) * self.frame_bytes
+
+    def __getitem__(self, frame_idx):
+        with self._cond:
+            return self._frames[frame_idx]
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._frames.clear()
+            self._cond.notify_all()
+
+    def ready(self, frame_idx):
+        return frame_idx in self._frames
+
+    def wait_ready(self, frame_idx, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: frame_idx in self._frames or self._stopped or self.error, timeout)
+            return frame_idx in self._frames
+
+    def best_ready(self, current, wanted):
+        """The decoded frame closest to wanted, going back no further than current"""
+        span = (wanted - current) % len(self)
+        best = current
+        best_distance = -1
+        with self._cond:
+            for i in self._frames:
+                distance = (i - current) % len(self)
+                if best_distance < distance <= span:
+                    best, best_distance = i, distance
+        return best
+
+    def _ahead(self, frame_idx):
+        return (frame_idx - self._playhead) % len(self)
+
+    def _useful(self, frame_idx):
+        """True if frame_idx is in the window or newer than the frame on screen"""
+        if self._ahead(frame_idx) < self.window:
+            return True
+        keep = self._playhead if self._keep is None else self._keep
+        return (frame_idx - keep) % len(self) < (self._playhead - keep) % len(self)
+
+    def set_playhead(self, frame_idx, keep=None):
+        """Move the window to start at frame_idx, dropping frames behind it (except keep)"""
+        with self._cond:
+            if frame_idx == self._playhead and keep == self._keep:
+                return
+            self._playhead = frame_idx
+            self._keep = keep
+            for i in [i for i in self._frames if i != keep and self._ahead(i) >= self.window]:
+                del self._frames[i]
+            self._cond.notify_all()
+
+    def _next_missing(self):
+        for k in range(self.window):
+            i = (self._playhead + k) % len(self)
+            if i not in self._frames:
+                return i
+        return None
+
+    def _run(self):
+        try:
+            with Image.open(self.gif_path) as pil_img:
+                position = -1
+                last = None
+                while True:
+                    with self._cond:
+                        self._cond.wait_for(lambda: self._stopped or self._next_missing() is not None)
+                        if self._stopped:
+                            return
+                        target = self._next_missing()
+                    if 0 <= position < target:
+                        # Pillow decodes every frame in between anyway, so step through
+                        # them one at a time and keep the ones that are still useful
+                        target = position + 1
+                    else:
+                        # Seeking backwards makes Pillow replay from frame 0 (frames build on each other)
+                        self.seeks += 1
+                    try:
+                        pil_img.seek(target)
+                        last = np.asarray(pil_img.convert("RGBA"))
+                    except EOFError:
+                        # The index found more frames than Pillow can decode; repeat the last good one
+                        if last is None:
+                            raise
+                    position = target
+                    with self._cond:
+                        if self._stopped:
+                            return
+                        if self._useful(target):
+                            self._frames[target] = last
+                            self.decoded_total += 1
+                            self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self.error = e
+                self._cond.notify_all()
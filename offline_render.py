@@ -0,0 +1,232 @@
+"""Offline stage render: a frame-accurate PNG sequence or video of the stage, no window needed.
+
+Every output frame is placed on the beat grid from its frame number, not the
+wall clock, so N beats at a BPM always come out the same length with the same
+frames. Chunks of frames are rendered in parallel worker processes.
+
+Example:
+    python offline_render.py dance_4B.gif --bpm 128 --length 16 --size 1920x1080 -o frames/
+    python offline_render.py dance_4B.gif --bpm 128 --length 16 --squad --ffmpeg dance_128.mp4
+    python offline_render.py dance_4B.gif --bpm 128 --squad rows --crowd 50 --zoom 0.5 --ffmpeg crowd.mp4
+    python offline_render.py dance_4B.gif --bpm 128 --length 16 --effects pulse,flash,hue --ffmpeg fx.mp4
+"""
+import os
+
+# Rendering goes to off-screen surfaces, so never open a window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import argparse
+import collections
+import concurrent.futures
+import shutil
+import subprocess
+import sys
+import time
+
+import pygame
+
+from beat_effects import BeatEffects, EFFECTS, parse_effects
+from crowd import DEFAULT_CROWD_SIZE, FORMATIONS, MAX_CROWD_SIZE
+from frame_cache import ScaledFrameCache
+from frame_disk_cache import FrameDiskCache, DEFAULT_CACHE_DIR
+from frame_scheduler import FrameScheduler
+from gif_loader import GifLoadJob, decode_into, load_cached
+from gif_slot import GifSlot
+from stage_output import parse_size
+from stage_render import DEFAULT_BACKGROUND_COLOR, StageBackground, draw_gif_on_stage
+from sync_math import extract_beats_from_filename
+
+PNG_CHUNK_FRAMES = 30  # Frames per worker task when writing a PNG sequence
+PIPE_CHUNK_FRAMES = 8  # Smaller tasks when raw frames travel back for the ffmpeg pipe
+SCALED_CACHE_MB = 256
+EFFECT_CACHE_MB = 128
+
+_worker = None  # Per-process render state, set up by init_worker
+
+
+def load_slot(gif_path, beats, disk_cache=None):
+    """Decode (or map from the disk cache) a GIF into a ready-to-draw slot"""
+    job = GifLoadJob(gif_path, 0, beats=beats)
+    key = disk_cache.key_for(gif_path) if disk_cache is not None else None
+    if key is None or not load_cached(job, disk_cache, key):
+        for _ in decode_into(job):
+            pass
+        if job.decoded == 0:
+            raise ValueError(f"no frames decoded from {gif_path}")
+        if key is not None:
+            disk_cache.store(key, job.pixels, job.durations, job.palettes, job.beats)
+    slot = GifSlot(0)
+    slot.beats = beats
+    slot.original_size = job.size
+    slot.set_frames(job.pixels, job.durations, job.palettes)
+    slot.is_loaded = True
+    return slot
+
+
+class StageRender:
+    """Everything one worker needs to draw stage frames at fixed beat times"""
+
+    def __init__(self, settings):
+        pygame.init()
+        self.settings = settings
+        disk_cache = FrameDiskCache(settings["cache_dir"]) if settings["cache_dir"] else None
+        self.slot = load_slot(settings["gif"], settings["beats"], disk_cache)
+        self.scheduler = FrameScheduler(settings["bpm"])
+        self.frame_cache = ScaledFrameCache(SCALED_CACHE_MB * 1024 * 1024)
+        self.effects = BeatEffects(settings["effects"], EFFECT_CACHE_MB * 1024 * 1024)
+        # Keep the background at full resolution, the output may be bigger than any monitor
+        self.background = StageBackground(settings["bg_color"], downscale_on_load=False)
+        if settings["bg_image"]:
+            self.background.set_image(settings["bg_image"])
+        self.target = pygame.Surface(settings["size"])
+        self.stage_rect = self.target.get_rect()
+
+    def beat_at(self, frame_number):
+        settings = self.settings
+        return settings["start_beat"] + frame_number * settings["bpm"] / (60.0 * settings["fps"])
+
+    def render(self, frame_number):
+        """Draw output frame frame_number onto self.target, exactly like the main stage"""
+        settings = self.settings
+        beat = self.beat_at(frame_number)
+        self.slot.frame_idx = self.scheduler.frame_for(self.slot, beat)
+        self.effects.set_beat(beat)
+        self.background.draw(self.target, self.stage_rect)
+        draw_gif_on_stage(self.target, self.stage_rect, self.slot, self.frame_cache, settings["zoom"],
+                          settings["squad"], settings["spacing"], settings["squad_size"], settings["flip"],
+                          settings["crowd"], self.effects)
+        return self.target
+
+
+def init_worker(settings):
+    global _worker
+    _worker = StageRender(settings)
+
+
+def render_chunk(start, stop, png_dir=None):
+    """Render frames [start, stop); writes PNGs to png_dir or returns the raw RGB bytes"""
+    raw = []
+    for frame_number in range(start, stop):
+        surface = _worker.render(frame_number)
+        if png_dir is not None:
+            pygame.image.save(surface, os.path.join(png_dir, f"frame_{frame_number:06d}.png"))
+        else:
+            raw.append(pygame.image.tobytes(surface, "RGB"))
+    return start, stop, b"".join(raw) if png_dir is None else None
+
+
+def parse_color(text):
+    color = tuple(int(c) for c in text.split(","))
+    if len(color) != 3 or not all(0 <= c <= 255 for c in color):
+        raise argparse.ArgumentTypeError("colors are R,G,B with values 0-255")
+    return color
+
+
+def parse_effect_list(text):
+    try:
+        return parse_effects(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def ffmpeg_command(output, size, fps):
+    return ["ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}", "-r", str(fps), "-i", "-",
+            "-c:v", "libx264", "-pix_fmt", "yuv420p", output]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the stage offline at a fixed frame rate")
+    parser.add_argument("gif", help="GIF to put on the stage")
+    parser.add_argument("--bpm", type=float, required=True, help="tempo to sync the GIF to")
+    parser.add_argument("--beats", type=float, help="beats per GIF loop (default: parsed from _XB.gif names)")
+    parser.add_argument("--length", type=float, help="beats to render (default: one loop)")
+    parser.add_argument("--start-beat", type=float, default=0.0, help="beat position of the first frame")
+    parser.add_argument("--fps", type=int, default=60, help="output frame rate")
+    parser.add_argument("--size", type=parse_size, default=(1920, 1080), help="output size, e.g. 1280x720")
+    parser.add_argument("--zoom", type=float, default=1.0)
+    parser.add_argument("--squad", nargs="?", const=FORMATIONS[0], default=False, choices=FORMATIONS,
+                        help="add backup dancers, in a formation (default: squad)")
+    parser.add_argument("--crowd", type=int, default=DEFAULT_CROWD_SIZE,
+                        help=f"dancers in the formation, lead included (up to {MAX_CROWD_SIZE})")
+    parser.add_argument("--spacing", type=float, default=0.5, help="squad spacing 0-1")
+    parser.add_argument("--squad-size", type=int, default=80, help="backup dancer size 0-100")
+    parser.add_argument("--flip", action="store_true", help="flip the GIF horizontally")
+    parser.add_argument("--effects", type=parse_effect_list, default=[],
+                        help=f"beat effects, comma separated ({', '.join(EFFECTS)})")
+    parser.add_argument("--bg-color", type=parse_color, default=DEFAULT_BACKGROUND_COLOR, help="R,G,B")
+    parser.add_argument("--bg-image", help="background image")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("-o", "--output-dir", help="write a PNG sequence here")
+    output.add_argument("--ffmpeg", metavar="VIDEO", help="pipe frames to ffmpeg and write VIDEO")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--no-disk-cache", action="store_true", help="decode the GIF instead of using the disk cache")
+    args = parser.parse_args(argv)
+
+    if args.bpm <= 0 or args.fps <= 0:
+        raise SystemExit("--bpm and --fps must be positive")
+    if not 1 <= args.crowd <= MAX_CROWD_SIZE:
+        raise SystemExit(f"--crowd must be between 1 and {MAX_CROWD_SIZE}")
+    beats = args.beats if args.beats is not None else extract_beats_from_filename(args.gif)
+    length = args.length if args.length is not None else beats
+    frame_total = max(1, int(round(length * 60.0 / args.bpm * args.fps)))
+
+    cache_dir = None
+    if not args.no_disk_cache:
+        # Decode once here so every worker maps the same cached frames instead of decoding
+        cache_dir = DEFAULT_CACHE_DIR
+        load_slot(args.gif, beats, FrameDiskCache(cache_dir))
+
+    settings = {
+        "gif": args.gif, "beats": beats, "bpm": args.bpm, "fps": args.fps, "size": args.size,
+        "start_beat": args.start_beat, "zoom": args.zoom, "squad": args.squad, "spacing": args.spacing,
+        "squad_size": args.squad_size, "crowd": args.crowd, "flip": args.flip, "effects": args.effects,
+        "bg_color": args.bg_color, "bg_image": args.bg_image, "cache_dir": cache_dir,
+    }
+
+    ffmpeg = None
+    if args.ffmpeg:
+        if shutil.which("ffmpeg") is None:
+            raise SystemExit("ffmpeg not found on PATH; use -o to write a PNG sequence instead")
+        ffmpeg = subprocess.Popen(ffmpeg_command(args.ffmpeg, args.size, args.fps), stdin=subprocess.PIPE)
+        chunk_frames = PIPE_CHUNK_FRAMES
+    else:
+        os.makedirs(args.output_dir, exist_ok=True)
+        chunk_frames = PNG_CHUNK_FRAMES
+
+    print(f"Rendering {frame_total} frames ({length:g} beats at {args.bpm:g} BPM, {args.fps} fps, "
+          f"{args.size[0]}x{args.size[1]}) with {args.workers} workers")
+    start = time.perf_counter()
+    chunks = [(s, min(s + chunk_frames, frame_total)) for s in range(0, frame_total, chunk_frames)]
+    done = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                                                initargs=(settings,)) as pool:
+        # Keep a bounded number of chunks in flight; ffmpeg needs them back in order
+        pending = collections.deque()
+        next_chunk = 0
+        while next_chunk < len(chunks) or pending:
+            while next_chunk < len(chunks) and len(pending) < args.workers * 2:
+                chunk_start, chunk_stop = chunks[next_chunk]
+                pending.append(pool.submit(render_chunk, chunk_start, chunk_stop, args.output_dir))
+                next_chunk += 1
+            chunk_start, chunk_stop, raw = pending.popleft().result()
+            if ffmpeg is not None:
+                ffmpeg.stdin.write(raw)
+            done += chunk_stop - chunk_start
+            print(f"\r{done}/{frame_total} frames", end="", flush=True)
+    print()
+
+    if ffmpeg is not None:
+        ffmpeg.stdin.close()
+        if ffmpeg.wait() != 0:
+            raise SystemExit("ffmpeg failed")
+    elapsed = time.perf_counter() - start
+    duration = frame_total / args.fps
+    print(f"Done: {frame_total} frames ({duration:.2f}s of video) in {elapsed:.2f}s, "
+          f"{frame_total / elapsed:.1f} fps, {duration / elapsed:.1f}x real time -> {args.ffmpeg or args.output_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
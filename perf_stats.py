@@ -0,0 +1,169 @@
+import bisect
+import collections
+import csv
+import json
+import time
+
+import numpy as np
+import pygame
+
+FRAME_TIME_BUCKETS_MS = (8.3, 16.7, 33.3, 50.0, 100.0)  # Upper bounds; the last bucket is everything slower
+OVERLAY_REFRESH_SECONDS = 0.25  # Re-render the overlay text at most this often
+OVERLAY_TEXT_COLOR = (220, 220, 220)
+OVERLAY_BACKGROUND = (0, 0, 0, 170)
+
+
+class PerfStats:
+    """Rolling per-phase timings, a frame-time histogram and loop counters.
+
+    The main loop calls begin_frame() once per tick and mark(phase) after each
+    phase, so a phase's time is the time since the previous mark. Timings keep
+    the last `window` frames; the histogram and counters cover the session.
+    """
+
+    def __init__(self, window=600, clock=time.perf_counter):
+        self._clock = clock
+        self.window = window
+        self.phases = {}  # phase name -> deque of ms, in the order the loop first ran them
+        self.frame_times = collections.deque(maxlen=window)
+        self.histogram = [0] * (len(FRAME_TIME_BUCKETS_MS) + 1)
+        self.frames = 0
+        self.late_frames = 0
+        self.gauges = {}
+        self._gauge_formats = {}  # gauge name -> format spec for the overlay
+        self._frame_start = None
+        self._last_mark = None
+        self._skip_interval = True
+
+    def begin_frame(self):
+        now = self._clock()
+        if self._frame_start is not None and not self._skip_interval:
+            frame_ms = (now - self._frame_start) * 1000.0
+            self.frame_times.append(frame_ms)
+            self.histogram[bisect.bisect_left(FRAME_TIME_BUCKETS_MS, frame_ms)] += 1
+        self._skip_interval = False
+        self._frame_start = now
+        self._last_mark = now
+        self.frames += 1
+
+    def mark(self, phase):
+        """Charge the time since the previous mark to phase"""
+        now = self._clock()
+        samples = self.phases.get(phase)
+        if samples is None:
+            samples = self.phases[phase] = collections.deque(maxlen=self.window)
+        samples.append((now - self._last_mark) * 1000.0)
+        self._last_mark = now
+
+    def skip_interval(self):
+        """Leave the current frame interval out of the histogram (it includes a deliberate idle wait)"""
+        self._skip_interval = True
+
+    def record_late(self, late):
+        """Count a presented frame that showed a different GIF frame than the beat schedule wanted"""
+        if late:
+            self.late_frames += 1
+
+    def set_gauge(self, name, value, fmt=""):
+        """Record a value shown on the overlay as format(value, fmt), e.g. fmt=".1%" for ratios"""
+        self.gauges[name] = value
+        self._gauge_formats[name] = fmt
+
+    @staticmethod
+    def percentiles(samples):
+        """(p50, p95, p99, max) of a sample list in ms"""
+        if not samples:
+            return 0.0, 0.0, 0.0, 0.0
+        values = np.fromiter(samples, dtype=np.float64, count=len(samples))
+        p50, p95, p99 = np.percentile(values, (50, 95, 99))
+        return float(p50), float(p95), float(p99), float(values.max())
+
+    def histogram_labels(self):
+        labels = []
+        lower = 0.0
+        for upper in FRAME_TIME_BUCKETS_MS:
+            labels.append(f"{lower:g}-{upper:g} ms")
+            lower = upper
+        labels.append(f">{lower:g} ms")
+        return labels
+
+    def summary(self):
+        phases = {}
+        for name, samples in self.phases.items():
+            p50, p95, p99, worst = self.percentiles(samples)
+            phases[name] = {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'max_ms': worst,
+                            'mean_ms': float(np.mean(samples)) if samples else 0.0}
+        p50, p95, p99, worst = self.percentiles(self.frame_times)
+        return {
+            'frames': self.frames,
+            'late_frames': self.late_frames,
+            'frame_time': {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'max_ms': worst},
+            'frame_time_histogram': dict(zip(self.histogram_labels(), self.histogram)),
+            'phases': phases,
+            'gauges': dict(self.gauges),
+        }
+
+    def overlay_lines(self):
+        p50, p95, p99, worst = self.percentiles(self.frame_times)
+        lines = [f"frame  p50 {p50:5.1f}  p95 {p95:5.1f}  p99 {p99:5.1f}  max {worst:5.1f} ms",
+                 f"late frames {self.late_frames} of {self.frames}"]
+        for name, samples in self.phases.items():
+            p50, p95, p99, worst = self.percentiles(samples)
+            lines.append(f"{name:<10} p50 {p50:5.2f}  p95 {p95:5.2f}  p99 {p99:5.2f} ms")
+        total = sum(self.histogram) or 1
+        lines.append("  ".join(f"{label}: {count / total:.0%}"
+                               for label, count in zip(self.histogram_labels(), self.histogram)))
+        for name, value in self.gauges.items():
+            lines.append(f"{name}: {format(value, self._gauge_formats[name])}")
+        return lines
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_csv(self, path):
+        """One row per phase (and the whole frame) with its rolling percentiles"""
+        summary = self.summary()
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["phase", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+            for name, stats in summary['phases'].items():
+                writer.writerow([name, f"{stats['mean_ms']:.3f}", f"{stats['p50_ms']:.3f}",
+                                 f"{stats['p95_ms']:.3f}", f"{stats['p99_ms']:.3f}", f"{stats['max_ms']:.3f}"])
+            frame = summary['frame_time']
+            mean = float(np.mean(self.frame_times)) if self.frame_times else 0.0
+            writer.writerow(["frame", f"{mean:.3f}", f"{frame['p50_ms']:.3f}", f"{frame['p95_ms']:.3f}",
+                             f"{frame['p99_ms']:.3f}", f"{frame['max_ms']:.3f}"])
+
+
+class PerfOverlay:
+    """On-screen text panel for a PerfStats, re-rendered a few times a second"""
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.visible = False
+        self.font = pygame.font.SysFont("monospace", 14)
+        self.surface = None
+        self._next_refresh = 0.0
+
+    def toggle(self):
+        self.visible = not self.visible
+        self._next_refresh = 0.0
+
+    def refresh(self, now):
+        """Rebuild the panel if it is due; returns True when it changed"""
+        if not self.visible or now < self._next_refresh:
+            return False
+        self._next_refresh = now + OVERLAY_REFRESH_SECONDS
+        rendered = [self.font.render(line, True, OVERLAY_TEXT_COLOR) for line in self.stats.overlay_lines()]
+        line_height = self.font.get_linesize()
+        width = max(text.get_width() for text in rendered) + 10
+        self.surface = pygame.Surface((width, line_height * len(rendered) + 10), pygame.SRCALPHA)
+        self.surface.fill(OVERLAY_BACKGROUND)
+        for i, text in enumerate(rendered):
+            self.surface.blit(text, (5, 5 + i * line_height))
+        return True
+
+    def draw(self, target, pos):
+        if self.visible and self.surface is not None:
+            target.blit(self.surface, pos)
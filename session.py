@@ -0,0 +1,317 @@
+import json
+import os
+
+from crowd import MAX_CROWD_SIZE, formation_for
+from gif_stream import FrameStream
+from sync_math import extract_beats_from_filename
+
+SESSION_VERSION = 1
+PREFETCH_BANKS = 1  # Banks after the current one decoded ahead of time
+PREFETCH_BUDGET_MB = 1024  # Prefetching pauses once the prefetched frames take this much memory
+CLIP_SETTINGS = ("bpm", "beats", "zoom", "squad", "squad_spacing", "squad_size", "crowd", "flip", "bg_color",
+                 "bg_image")
+
+
+class Bank:
+    """One bank of a set list: a GIF (or nothing) for every slot plus settings.
+
+    Settings given on the bank apply to all of its clips; a clip's own
+    settings override them. Only the settings that are present are applied,
+    the rest stay as they were.
+    """
+
+    def __init__(self, name, clips, settings=None):
+        self.name = name
+        self.clips = clips  # Per slot: {"path": ..., settings...} or None
+        self.settings = settings or {}
+
+    def path(self, slot_index):
+        clip = self.clips[slot_index]
+        return clip["path"] if clip is not None else None
+
+    def settings_for(self, slot_index):
+        """Bank settings merged with the clip's own"""
+        settings = dict(self.settings)
+        clip = self.clips[slot_index]
+        if clip is not None:
+            settings.update((key, value) for key, value in clip.items() if key in CLIP_SETTINGS)
+        return settings
+
+
+def check_settings(settings, where):
+    unknown = set(settings) - set(CLIP_SETTINGS) - {"path", "name", "slots"}
+    if unknown:
+        raise ValueError(f"{where}: unknown setting(s) {', '.join(sorted(unknown))}")
+    for key in ("bpm", "beats", "zoom", "squad_spacing", "squad_size"):
+        if key in settings and not isinstance(settings[key], (int, float)):
+            raise ValueError(f"{where}: {key} must be a number")
+    if "squad" in settings:
+        try:
+            formation_for(settings["squad"])
+        except ValueError as e:
+            raise ValueError(f"{where}: squad: {e}") from None
+    if "crowd" in settings and not (isinstance(settings["crowd"], int) and 1 <= settings["crowd"] <= MAX_CROWD_SIZE):
+        raise ValueError(f"{where}: crowd must be a whole number from 1 to {MAX_CROWD_SIZE}")
+    if "bg_color" in settings:
+        color = settings["bg_color"]
+        if not isinstance(color, list) or len(color) != 3 or not all(isinstance(c, int) for c in color):
+            raise ValueError(f"{where}: bg_color must be [r, g, b]")
+        settings["bg_color"] = tuple(color)
+
+
+class Session:
+    """An ordered set list of slot banks, stored as a JSON session file.
+
+    GIF and background image paths are stored relative to the session file,
+    so a show folder can be moved or copied to another machine as a whole.
+    """
+
+    def __init__(self, banks, slot_count, path=None):
+        self.banks = banks
+        self.slot_count = slot_count
+        self.path = path
+
+    @classmethod
+    def empty(cls, slot_count):
+        return cls([Bank("Bank 1", [None] * slot_count)], slot_count)
+
+    @classmethod
+    def load(cls, path, slot_count):
+        """Read a session file; raises OSError or ValueError"""
+        with open(path) as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"not a session file: {e}") from None
+        if not isinstance(data, dict) or not isinstance(data.get("banks"), list) or not data["banks"]:
+            raise ValueError("a session needs a non-empty \"banks\" list")
+        if data.get("version", SESSION_VERSION) > SESSION_VERSION:
+            raise ValueError(f"session format {data['version']} is newer than this version of the app")
+        base = os.path.dirname(os.path.abspath(path))
+        banks = []
+        for n, bank_data in enumerate(data["banks"], 1):
+            where = f"bank {n}"
+            if not isinstance(bank_data, dict) or not isinstance(bank_data.get("slots", []), list):
+                raise ValueError(f"{where}: a bank is an object with a \"slots\" list")
+            settings = {key: value for key, value in bank_data.items() if key not in ("name", "slots")}
+            check_settings(settings, where)
+            resolve_paths(settings, base)
+            clips = [None] * slot_count
+            slot_data = bank_data.get("slots", [])
+            if len(slot_data) > slot_count:
+                raise ValueError(f"{where}: {len(slot_data)} slots, there are only {slot_count}")
+            for i, clip in enumerate(slot_data):
+                if clip is None:
+                    continue
+                if isinstance(clip, str):
+                    clip = {"path": clip}
+                if not isinstance(clip, dict) or not isinstance(clip.get("path"), str):
+                    raise ValueError(f"{where}, slot {i + 1}: a clip needs a \"path\"")
+                clip = dict(clip)
+                check_settings(clip, f"{where}, slot {i + 1}")
+                resolve_paths(clip, base)
+                clips[i] = clip
+            banks.append(Bank(str(bank_data.get("name", f"Bank {n}")), clips, settings))
+        return cls(banks, slot_count, path)
+
+    def save(self, path=None):
+        """Write the session file (to path, which then becomes the session's file)"""
+        path = path or self.path
+        base = os.path.dirname(os.path.abspath(path))
+        banks = []
+        for bank in self.banks:
+            data = {"name": bank.name}
+            data.update(relative_paths(bank.settings, base))
+            slots = [relative_paths(clip, base) if clip is not None else None for clip in bank.clips]
+            while slots and slots[-1] is None:
+                slots.pop()
+            data["slots"] = slots
+            banks.append(data)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": SESSION_VERSION, "banks": banks}, f, indent=2)
+        os.replace(tmp_path, path)
+        self.path = path
+
+
+def resolve_paths(settings, base):
+    for key in ("path", "bg_image"):
+        if settings.get(key):
+            settings[key] = os.path.normpath(os.path.join(base, os.path.expanduser(settings[key])))
+
+
+def relative_paths(settings, base):
+    settings = dict(settings)
+    for key in ("path", "bg_image"):
+        if settings.get(key):
+            try:
+                settings[key] = os.path.relpath(settings[key], base)
+            except ValueError:
+                pass  # Different drive on Windows, keep it absolute
+    if "bg_color" in settings:
+        settings["bg_color"] = list(settings["bg_color"])
+    return settings
+
+
+def job_bytes(job):
+    if job.pixels is None or job.error is not None:
+        return 0
+    total = job.pixels.nbytes
+    if job.palettes is not None:
+        total += job.palettes.nbytes
+    if job.thumbnails is not None:
+        total += job.thumbnails.nbytes
+    return total
+
+
+def job_prepared(job, thumbnail_box):
+    """True if a finished job needs no more work on the main thread to go into a slot"""
+    if job.error is not None or thumbnail_box is None or isinstance(job.pixels, FrameStream):
+        return True  # Streaming GIFs scale their thumbnails as frames are shown
+    return job.thumbnails is not None and job.thumbnail_box == thumbnail_box
+
+
+def discard_job(job):
+    if isinstance(job.pixels, FrameStream):
+        job.pixels.close()
+
+
+class SetListPlayer:
+    """Steps through a session bank by bank with the next banks decoded ahead.
+
+    Prefetching goes through the app's GifLoader under (bank, slot) keys, one
+    GIF at a time and only while no slot load is waiting, so it never delays
+    what the user asked for. Workers scale the thumbnails too, and a prefetch
+    whose thumbnails no longer fit the strip (the window was resized) is done
+    again, so switching to a prefetched bank only hands finished jobs to the
+    slots. Banks that were left behind are evicted, so
+    memory stays bounded by the current bank plus PREFETCH_BANKS banks (and
+    prefetching stops early past budget_bytes).
+    """
+
+    def __init__(self, session, loader, prefetch_banks=PREFETCH_BANKS,
+                 budget_bytes=PREFETCH_BUDGET_MB * 1024 * 1024):
+        self.session = session
+        self.loader = loader
+        self.prefetch_banks = prefetch_banks
+        self.budget_bytes = budget_bytes
+        self.current = 0
+        self._ready = {}  # (bank, slot) -> finished job
+        self._in_flight = None  # (bank, slot) key being prefetched
+
+    @property
+    def bank(self):
+        return self.session.banks[self.current]
+
+    def prefetched_bytes(self):
+        return sum(job_bytes(job) for job in self._ready.values())
+
+    def _wanted(self):
+        """(bank, slot) keys that should be decoded ahead, nearest bank first"""
+        banks = self.session.banks
+        for b in range(self.current + 1, min(len(banks), self.current + 1 + self.prefetch_banks)):
+            for slot_index in range(self.session.slot_count):
+                path = banks[b].path(slot_index)
+                # A clip that stays in its slot from the bank before needs no second copy
+                if path is not None and path != banks[b - 1].path(slot_index):
+                    yield b, slot_index
+
+    def update(self):
+        """Start the next prefetch when the loader is idle (call once per tick)"""
+        if self._in_flight is not None or self.loader.queue_depth() > 0:
+            return
+        over_budget = self.prefetched_bytes() >= self.budget_bytes
+        for key in self._wanted():
+            job = self._ready.get(key)
+            if job is None and over_budget:
+                continue  # Only redo stale prefetches, they replace memory already counted
+            if job is None or not job_prepared(job, self.loader.thumbnail_box):
+                bank = self.session.banks[key[0]]
+                path = bank.path(key[1])
+                beats = bank.settings_for(key[1]).get("beats", extract_beats_from_filename(path))
+                self.loader.submit(path, key, beats)
+                self._in_flight = key
+                return
+
+    def collect(self, job):
+        """Keep a finished prefetch job; returns False for ordinary slot loads"""
+        if not isinstance(job.slot_index, tuple):
+            return False
+        if job.slot_index == self._in_flight:
+            self._in_flight = None
+        if job.slot_index in set(self._wanted()):
+            previous = self._ready.pop(job.slot_index, None)
+            if previous is not None:
+                discard_job(previous)
+            self._ready[job.slot_index] = job
+        else:
+            discard_job(job)
+        return True
+
+    def switch(self, bank_index, loaded_paths):
+        """Make bank_index current; returns one (action, value) per slot.
+
+        Actions: ("keep", None) when the slot already holds the clip,
+        ("ready", job) for a prefetched GIF, ("loading", None) when its
+        prefetch was handed over to the slot and is still decoding,
+        ("load", path) when nothing was prefetched and ("clear", None) for
+        an empty slot.
+        """
+        self.current = bank_index
+        bank = self.bank
+        actions = []
+        for slot_index in range(self.session.slot_count):
+            path = bank.path(slot_index)
+            key = (bank_index, slot_index)
+            job = self._ready.pop(key, None)
+            if path is None:
+                actions.append(("clear", None))
+            elif path == loaded_paths[slot_index]:
+                actions.append(("keep", None))
+            elif job is not None:
+                job.slot_index = slot_index
+                actions.append(("ready", job))
+                job = None
+            elif key == self._in_flight:
+                self.loader.reassign(key, slot_index)
+                self._in_flight = None
+                actions.append(("loading", None))
+            else:
+                actions.append(("load", path))
+            if job is not None:
+                discard_job(job)
+        self._evict()
+        return actions
+
+    def _evict(self):
+        """Drop prefetched banks that are no longer ahead of the current one"""
+        wanted = set(self._wanted())
+        for key in list(self._ready):
+            if key not in wanted:
+                discard_job(self._ready.pop(key))
+        if self._in_flight is not None and self._in_flight not in wanted:
+            self.loader.cancel(self._in_flight)
+            self._in_flight = None
+
+    def set_clip(self, slot_index, path):
+        """Record a GIF loaded by hand into the current bank"""
+        clip = self.bank.clips[slot_index]
+        if clip is None or clip["path"] != path:
+            self.bank.clips[slot_index] = {"path": path}
+            self._evict()  # The next bank may now share this clip
+
+    def remember(self, slot_index, settings):
+        """Store the settings a clip is being shown with, for saving"""
+        clip = self.bank.clips[slot_index]
+        for key, value in settings.items():
+            if key == "bpm" and key not in clip:
+                self.bank.settings[key] = value  # The tempo belongs to the bank unless the clip has its own
+            elif self.bank.settings.get(key) == value:
+                clip.pop(key, None)
+            else:
+                clip[key] = value
+
+    def shutdown(self):
+        for job in self._ready.values():
+            discard_job(job)
+        self._ready.clear()
@@ -0,0 +1,284 @@
+"""Stage output window, run by the main app as its own process.
+
+The main app sends the stage state (slot GIFs, zoom, squad settings, beat
+effects, background and the beat clock anchor) as JSON lines on stdin. This
+process loads the same GIFs through the frame disk cache, so decoded frames are
+memory-mapped from the same files instead of decoded again, and renders at its
+own frame rate: UI work in the main window can never drop a stage frame.
+"""
+import argparse
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+
+import pygame
+
+from beat_effects import BeatEffects
+from crowd import DEFAULT_CROWD_SIZE
+from frame_cache import ScaledFrameCache
+from frame_disk_cache import FrameDiskCache, DEFAULT_CACHE_DIR
+from frame_scheduler import FrameScheduler
+from gif_loader import GifLoader
+from gif_slot import GifSlot
+from stage_render import StageBackground, draw_gif_on_stage
+
+STAGE_WINDOW_TITLE = "BPMdotGIF - Stage Window"
+STAGE_SLOTS = 10
+STAGE_FRAME_CACHE_MB = 256
+STAGE_EFFECT_CACHE_MB = 128
+STAGE_DISK_CACHE_MB = 2048
+STAGE_TEXTURE_CACHE_MB = 512
+STAGE_STREAMING_BUDGET_MB = 512  # Same sliding-window threshold as the main window
+STAGE_STREAMING_WINDOW_FRAMES = 64
+
+
+class StageOutput:
+    """Main-app handle on the stage output process.
+
+    start() launches the process, load() hands it a GIF for a slot and sync()
+    sends the stage state whenever it differs from what was last sent. If the
+    stage window is closed the process exits and running turns False.
+    """
+
+    def __init__(self, width, height, fps=60, vsync=True, disk_cache_dir=None, indexed=False, renderer="cpu"):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.vsync = vsync
+        self.renderer = renderer
+        self.disk_cache_dir = disk_cache_dir  # None: the stage process decodes GIFs itself
+        self.indexed = indexed
+        self._process = None
+        self._last_state = None
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        if self.running:
+            return
+        cmd = [sys.executable, os.path.abspath(__file__),
+               "--size", f"{self.width}x{self.height}", "--fps", str(self.fps), "--renderer", self.renderer]
+        if not self.vsync:
+            cmd.append("--no-vsync")
+        if self.disk_cache_dir is None:
+            cmd.append("--no-disk-cache")
+        else:
+            cmd += ["--cache-dir", self.disk_cache_dir]
+        if self.indexed:
+            cmd.append("--indexed")
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, text=True, bufsize=1)
+        self._last_state = None
+
+    def stop(self):
+        if self._process is None:
+            return
+        self._send({"cmd": "quit"})
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self._process.terminate()
+            self._process.wait()
+        self._process = None
+
+    def _send(self, message):
+        if not self.running:
+            return
+        try:
+            self._process.stdin.write(json.dumps(message) + "\n")
+            self._process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            # Stage window was closed between the check and the write
+            pass
+
+    def load(self, slot_index, gif_path, beats):
+        self._send({"cmd": "load", "slot": slot_index, "path": gif_path, "beats": beats})
+
+    def clear(self, slot_index):
+        self._send({"cmd": "clear", "slot": slot_index})
+
+    def sync(self, state):
+        """Send the stage state if it changed since the last call"""
+        if state != self._last_state:
+            self._last_state = state
+            self._send({"cmd": "state", **state})
+
+
+def read_commands(stream, commands):
+    """Queue every JSON line from the main app; None marks the end of the stream"""
+    for line in stream:
+        line = line.strip()
+        if line:
+            commands.put(json.loads(line))
+    commands.put(None)
+
+
+def open_stage_window(size, vsync):
+    """Open the stage window, falling back to no vsync where the driver can't do it"""
+    if vsync:
+        try:
+            # SDL only honours vsync on the SCALED (renderer-backed) display path
+            return pygame.display.set_mode(size, pygame.SCALED | pygame.RESIZABLE, vsync=1)
+        except pygame.error as e:
+            print(f"Stage window: vsync unavailable ({e}), running without it")
+    return pygame.display.set_mode(size, pygame.RESIZABLE)
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BPMdotGIF stage output window")
+    parser.add_argument("--size", type=parse_size, default=(800, 600), help="window size, e.g. 1280x720")
+    parser.add_argument("--fps", type=int, default=60, help="stage frame rate target")
+    parser.add_argument("--no-vsync", action="store_true", help="don't sync presents to the display")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="frame disk cache directory")
+    parser.add_argument("--no-disk-cache", action="store_true", help="decode GIFs instead of using the disk cache")
+    parser.add_argument("--indexed", action="store_true", help="store frames as palette indices")
+    parser.add_argument("--renderer", choices=("cpu", "gpu"), default="cpu",
+                        help="cpu scales frames with smoothscale, gpu draws them as SDL textures")
+    args = parser.parse_args(argv)
+
+    pygame.init()
+    screen = None
+    texture_stage = None
+    skipped_effects = set()  # Enabled effects the GPU renderer can't draw, reported when they change
+    if args.renderer == "gpu":
+        from texture_render import TEXTURE_EFFECTS, TextureStage
+        texture_stage = TextureStage(STAGE_WINDOW_TITLE, args.size, not args.no_vsync,
+                                     STAGE_TEXTURE_CACHE_MB * 1024 * 1024)
+    else:
+        screen = open_stage_window(args.size, not args.no_vsync)
+        pygame.display.set_caption(STAGE_WINDOW_TITLE)
+
+    disk_cache = None
+    if not args.no_disk_cache:
+        disk_cache = FrameDiskCache(args.cache_dir, STAGE_DISK_CACHE_MB * 1024 * 1024)
+    slots = [GifSlot(i) for i in range(STAGE_SLOTS)]
+    gif_loader = GifLoader(indexed=args.indexed, disk_cache=disk_cache,
+                           stream_budget=STAGE_STREAMING_BUDGET_MB * 1024 * 1024,
+                           stream_window=STAGE_STREAMING_WINDOW_FRAMES)
+    frame_scheduler = FrameScheduler(120)
+    frame_cache = ScaledFrameCache(STAGE_FRAME_CACHE_MB * 1024 * 1024)
+    background = StageBackground()
+    effects = BeatEffects(max_bytes=STAGE_EFFECT_CACHE_MB * 1024 * 1024)
+    state = {"active_slot": 0, "zoom": 1.0, "squad_mode": False, "squad_spacing": 0.5,
+             "squad_size": 80, "crowd_size": DEFAULT_CROWD_SIZE, "flip": False, "effects": []}
+
+    commands = queue.Queue()
+    threading.Thread(target=read_commands, args=(sys.stdin, commands), daemon=True).start()
+
+    print(f"{STAGE_WINDOW_TITLE} open")
+    print(f"For OBS: Use 'Window Capture' and select '{STAGE_WINDOW_TITLE}'")
+
+    clock = pygame.time.Clock()
+    last_drawn = None
+    running = True
+    while running:
+        clock.tick(args.fps)
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif (event.type == pygame.VIDEORESIZE and screen is not None
+                  and not screen.get_flags() & pygame.SCALED):
+                screen = pygame.display.get_surface()
+                frame_cache.clear()
+                background.clear_scaled()
+                last_drawn = None
+            elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                last_drawn = None
+
+        while True:
+            try:
+                message = commands.get_nowait()
+            except queue.Empty:
+                break
+            if message is None or message["cmd"] == "quit":
+                running = False
+                break
+            if message["cmd"] == "load":
+                gif_loader.submit(message["path"], message["slot"], message["beats"])
+            elif message["cmd"] == "clear":
+                gif_loader.cancel(message["slot"])
+                slots[message["slot"]].clear()
+                frame_cache.invalidate_slot(message["slot"])
+                effects.invalidate_slot(message["slot"])
+                if texture_stage is not None:
+                    texture_stage.frames.invalidate_slot(message["slot"])
+            elif message["cmd"] == "state":
+                if (message["zoom"] != state["zoom"] or message["squad_size"] != state["squad_size"]
+                        or message["crowd_size"] != state["crowd_size"]):
+                    frame_cache.clear()
+                if message["bg_image"] != background.image_path:
+                    if message["bg_image"]:
+                        background.set_image(message["bg_image"])
+                    else:
+                        background.clear_image()
+                background.color = tuple(message["bg_color"])
+                for slot, beats in zip(slots, message["beats"]):
+                    slot.beats = beats
+                frame_scheduler.set_anchor(*message["clock"])
+                effects.set_effects(message["effects"])
+                if texture_stage is not None and effects.enabled - set(TEXTURE_EFFECTS) != skipped_effects:
+                    skipped_effects = effects.enabled - set(TEXTURE_EFFECTS)
+                    if skipped_effects:
+                        print(f"Stage window: the GPU renderer can't draw {', '.join(sorted(skipped_effects))}; "
+                              f"use --stage-renderer cpu for color effects")
+                state = message
+
+        for job in gif_loader.poll():
+            if job.error is not None:
+                print(f"Stage window: error loading {job.gif_path}: {job.error}")
+                continue
+            slot = slots[job.slot_index]
+            slot.original_size = job.size
+            slot.set_frames(job.pixels, job.durations, job.palettes)
+            slot.is_loaded = True
+            frame_cache.invalidate_slot(job.slot_index)
+            effects.invalidate_slot(job.slot_index)
+            if texture_stage is not None:
+                texture_stage.frames.invalidate_slot(job.slot_index)
+
+        slot = slots[state["active_slot"]]
+        frame_scheduler.update(slots, [slot.index])
+        effects.set_beat(frame_scheduler.beat_position())
+
+        # Present only when the picture changed; presenting waits for vsync when it is on
+        drawn = (slot.index, slot.is_loaded, id(slot.pixels), slot.frame_idx, state["zoom"],
+                 state["squad_mode"], state["squad_spacing"], state["squad_size"], state["crowd_size"],
+                 state["flip"], background.color, id(background.image), effects.levels,
+                 texture_stage.size if texture_stage is not None else screen.get_size())
+        if drawn != last_drawn:
+            if texture_stage is not None:
+                texture_stage.draw(slot, background, state["zoom"], state["squad_mode"],
+                                   state["squad_spacing"], state["squad_size"], state["flip"], state["crowd_size"],
+                                   effects)
+            else:
+                stage_rect = screen.get_rect()
+                background.draw(screen, stage_rect)
+                draw_gif_on_stage(screen, stage_rect, slot, frame_cache, state["zoom"], state["squad_mode"],
+                                  state["squad_spacing"], state["squad_size"], state["flip"], state["crowd_size"],
+                                  effects)
+                pygame.display.flip()
+            last_drawn = drawn
+
+    if texture_stage is not None:
+        print(texture_stage.frames.summary())
+    gif_loader.shutdown()
+    pygame.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
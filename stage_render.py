@@ -0,0 +1,156 @@
+import functools
+import os
+
+import pygame
+
+from crowd import DEFAULT_CROWD_SIZE, crowd_layout, dancer_frame
+
+DEFAULT_BACKGROUND_COLOR = (20, 20, 20)
+
+
+def image_is_opaque(surface):
+    """True if every pixel of a per-pixel-alpha surface is fully opaque"""
+    width, height = surface.get_size()
+    return pygame.mask.from_surface(surface, 254).count() == width * height
+
+
+class StageBackground:
+    """The stage background: a solid color, optionally covered by an image.
+
+    The image is converted to the display format when it is loaded and scaled
+    once per stage size, so drawing it is a plain blit. Shared by the main
+    window and the stage output process.
+    """
+
+    def __init__(self, color=DEFAULT_BACKGROUND_COLOR, downscale_on_load=True):
+        self.color = color
+        self.downscale_on_load = downscale_on_load
+        self.image_path = None
+        self.image = None
+        self.downsample = 1  # Above 1, scaled images are built at lower resolution (frame governor)
+        self._scaled = {}  # (width, height) -> image scaled to that stage size
+
+    def set_image(self, image_path):
+        """Load a background image, keeping the color background if it fails"""
+        self._scaled.clear()
+        try:
+            if image_path and os.path.exists(image_path):
+                bg_image = pygame.image.load(image_path)
+                if self.downscale_on_load:
+                    # Never keep more pixels than the largest display can show
+                    max_w, max_h = max(pygame.display.get_desktop_sizes(), key=lambda size: size[0] * size[1])
+                    scale = min(1.0, max_w / bg_image.get_width(), max_h / bg_image.get_height())
+                    if scale < 1.0:
+                        new_size = (max(1, int(bg_image.get_width() * scale)), max(1, int(bg_image.get_height() * scale)))
+                        print(f"Downscaling background from {bg_image.get_width()}x{bg_image.get_height()} "
+                              f"to {new_size[0]}x{new_size[1]}")
+                        if pygame.display.get_surface() is not None:
+                            bg_image = bg_image.convert_alpha()
+                        bg_image = pygame.transform.smoothscale(bg_image, new_size)
+                # Convert to the display format; opaque images skip per-pixel alpha.
+                # Texture-rendered stages have no display surface and upload the image as is.
+                if pygame.display.get_surface() is not None:
+                    if bg_image.get_flags() & pygame.SRCALPHA and not image_is_opaque(bg_image):
+                        bg_image = bg_image.convert_alpha()
+                    else:
+                        bg_image = bg_image.convert()
+                self.image_path = image_path
+                self.image = bg_image
+                print(f"Background image loaded: {image_path}")
+            else:
+                self.image_path = None
+                self.image = None
+                print("No image file selected or file doesn't exist.")
+        except pygame.error as e:
+            print(f"Pygame error loading background image: {e}")
+            self.image_path = None
+            self.image = None
+        except Exception as e:
+            print(f"Error loading background image: {e}")
+            self.image_path = None
+            self.image = None
+
+    def clear_image(self):
+        self.image_path = None
+        self.image = None
+        self._scaled.clear()
+
+    def clear_scaled(self):
+        """Drop the scaled copies, e.g. after the window was resized"""
+        self._scaled.clear()
+
+    def set_downsample(self, factor):
+        """Build scaled images at 1/factor resolution, flattened onto the color"""
+        if factor != self.downsample:
+            self.downsample = factor
+            self._scaled.clear()
+
+    def scaled(self, size):
+        """Background image scaled to a stage size, scaled once and reused until resize"""
+        key = size if self.downsample == 1 else (size, self.color)
+        scaled_bg = self._scaled.get(key)
+        if scaled_bg is None:
+            if self.downsample == 1:
+                scaled_bg = pygame.transform.smoothscale(self.image, size)
+            else:
+                # Opaque, so drawing it is one copy with no color fill or alpha blending
+                low_res = (max(1, size[0] // self.downsample), max(1, size[1] // self.downsample))
+                low_res_bg = pygame.transform.smoothscale(self.image, low_res)
+                scaled_bg = pygame.Surface(size)
+                if pygame.display.get_surface() is not None:
+                    scaled_bg = scaled_bg.convert()
+                scaled_bg.fill(self.color)
+                scaled_bg.blit(pygame.transform.scale(low_res_bg, size), (0, 0))
+            self._scaled[key] = scaled_bg
+        return scaled_bg
+
+    def draw(self, target_screen, stage_rect):
+        """Draw the stage background (color or image)"""
+        if self.image is not None:
+            scaled_bg = self.scaled(stage_rect.size)
+            if scaled_bg.get_flags() & pygame.SRCALPHA:
+                # Transparent areas show the background color, not the previous frame
+                pygame.draw.rect(target_screen, self.color, stage_rect)
+            target_screen.blit(scaled_bg, (stage_rect.x, stage_rect.y))
+        else:
+            # Draw solid color background
+            pygame.draw.rect(target_screen, self.color, stage_rect)
+
+
+def stage_layout(stage_rect, slot, zoom_level, squad_mode, squad_spacing, squad_size,
+                 crowd_size=DEFAULT_CROWD_SIZE):
+    """Where to draw a slot on the stage: a list of (x, y, width, height, frame offset), back to front"""
+    return crowd_layout(tuple(stage_rect), (slot.width, slot.height), slot.frame_count, zoom_level,
+                        squad_mode, squad_spacing, squad_size, crowd_size)
+
+
+def draw_gif_on_stage(target_screen, stage_rect, slot, frame_cache, zoom_level, squad_mode,
+                      squad_spacing, squad_size, horizontal_flip, crowd_size=DEFAULT_CROWD_SIZE, effects=None):
+    """Draw a slot's current frame on the stage, with the backup dancers of a squad formation.
+
+    effects is an optional BeatEffects; it moves or hides the dancers and
+    supplies the effected frames in place of the plain scaled ones.
+    """
+    if not slot.is_loaded:
+        return
+    layout = stage_layout(stage_rect, slot, zoom_level, squad_mode, squad_spacing, squad_size, crowd_size)
+    get_frame = frame_cache.get
+    if effects is not None and effects.enabled:
+        layout = effects.layout(layout)
+        get_frame = functools.partial(effects.get, frame_cache)
+    if len(layout) == 1:
+        x, y, width, height, _ = layout[0]
+        target_screen.blit(get_frame(slot, slot.frame_idx, (width, height), horizontal_flip), (x, y))
+        return
+    # Each distinct (frame, size) is looked up once, then the whole crowd goes out in one blits call
+    scaled = {}
+    blits = []
+    for x, y, width, height, offset in layout:
+        frame_idx = dancer_frame(slot, offset)
+        key = (frame_idx, width, height)
+        scaled_frame = scaled.get(key)
+        if scaled_frame is None:
+            scaled_frame = get_frame(slot, frame_idx, (width, height), horizontal_flip)
+            scaled[key] = scaled_frame
+        blits.append((scaled_frame, (x, y)))
+    target_screen.blits(blits, doreturn=False)
@@ -0,0 +1,511 @@
+"""Publish the composited stage as a network stream and a shared-memory feed.
+
+The render loop hands each new stage picture to a FrameStore, which is one
+memcpy into a buffer nobody else is touching. A single encoder thread picks
+up the newest frame, copies it into the shared-memory feed and, while anyone
+is watching, JPEG-encodes it once. Every MJPEG viewer is served from that one
+encode by its own HTTP thread, which always sends the newest JPEG. A slow
+viewer skips frames instead of holding up the encoder or the other viewers.
+
+Shared-memory layout (little endian): a 32-byte header, then width*height*4
+bytes of RGBA. The header holds magic b"BPMS", version (u32), width (u32),
+height (u32), sequence (u64) and time.monotonic() of the frame (f64). The
+sequence is odd while a frame is being written, so a reader that sees the
+same even sequence before and after copying got a whole frame (see
+SharedFrameReader).
+
+Example:
+    python stage_stream.py bench --clients 8
+    python stage_stream.py read bpmdotgif-stage
+"""
+import argparse
+import http.server
+import io
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pygame
+from PIL import Image
+
+DEFAULT_STREAM_SIZE = (1280, 720)
+DEFAULT_STREAM_PORT = 8080
+DEFAULT_SHM_NAME = "bpmdotgif-stage"
+JPEG_QUALITY = 80
+MAX_ENCODE_FPS = 30  # The encoder skips frames that arrive faster than this
+CLIENT_TIMEOUT_SECONDS = 5.0  # A viewer that can't take a frame for this long is dropped
+SHM_MAGIC = b"BPMS"
+SHM_VERSION = 1
+SHM_HEADER = struct.Struct("<4sIIIQd")
+SHM_HEADER_SIZE = 32
+RGBA_MASKS = (0x000000FF, 0x0000FF00, 0x00FF0000, 0xFF000000)  # Surface bytes in R, G, B, A order
+
+
+def stage_surface(size):
+    """An off-screen surface whose raw pixels are RGBA bytes, for drawing the streamed stage"""
+    return pygame.Surface(size, pygame.SRCALPHA, 32, RGBA_MASKS)
+
+
+class FrameStore:
+    """The newest stage frame, handed from the render loop to the encoder.
+
+    Three buffers rotate so neither side ever waits for the other's copy:
+    the render loop writes one, the encoder reads another, and the third
+    holds the newest finished frame. Publishing and taking only swap buffer
+    indices under the lock.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._buffers = [bytearray(size[0] * size[1] * 4) for _ in range(3)]
+        self._write = 0
+        self._ready = 1
+        self._read = 2
+        self._fresh = False
+        self._woken = False
+        self.sequence = 0
+        self.frame_time = 0.0
+        self._ready_time = 0.0
+        self._condition = threading.Condition()
+
+    def publish(self, surface):
+        """Copy a finished stage surface (from stage_surface()) into the store"""
+        self._buffers[self._write][:] = surface.get_buffer()
+        with self._condition:
+            self._write, self._ready = self._ready, self._write
+            self._ready_time = time.monotonic()
+            self._fresh = True
+            self._condition.notify_all()
+
+    def take(self, timeout=None):
+        """Wait for a frame newer than the last one taken; returns its RGBA buffer or None.
+
+        Returns None on timeout or wake(). The buffer stays valid until the next take().
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._fresh or self._woken, timeout)
+            self._woken = False
+            if not self._fresh:
+                return None
+            self._read, self._ready = self._ready, self._read
+            self._fresh = False
+            self.sequence += 1
+            self.frame_time = self._ready_time
+        return self._buffers[self._read]
+
+    def wake(self):
+        """Make a waiting take() return now"""
+        with self._condition:
+            self._woken = True
+            self._condition.notify_all()
+
+
+class SharedFrameFeed:
+    """Raw RGBA frames in a named shared-memory block for other processes on this machine"""
+
+    def __init__(self, name, size):
+        self.size = size
+        nbytes = SHM_HEADER_SIZE + size[0] * size[1] * 4
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=nbytes)
+        except FileExistsError:
+            # Left over from a crashed run; take it over if it is big enough
+            self.shm = shared_memory.SharedMemory(name)
+            if self.shm.size < nbytes:
+                self.shm.close()
+                self.shm.unlink()
+                self.shm = shared_memory.SharedMemory(name, create=True, size=nbytes)
+        self.name = self.shm.name
+        self._pixels = np.ndarray(size[0] * size[1] * 4, dtype=np.uint8, buffer=self.shm.buf,
+                                  offset=SHM_HEADER_SIZE)
+        self.sequence = 0
+        self._write_header(0.0)
+
+    def _write_header(self, frame_time):
+        SHM_HEADER.pack_into(self.shm.buf, 0, SHM_MAGIC, SHM_VERSION, self.size[0], self.size[1],
+                             self.sequence, frame_time)
+
+    def write(self, rgba, frame_time):
+        self.sequence += 1  # Odd: frame being written
+        self._write_header(frame_time)
+        self._pixels[:] = np.frombuffer(rgba, dtype=np.uint8)
+        self.sequence += 1
+        self._write_header(frame_time)
+
+    def close(self):
+        self._pixels = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedFrameReader:
+    """Read frames from a SharedFrameFeed in another process"""
+
+    def __init__(self, name=DEFAULT_SHM_NAME):
+        self.shm = shared_memory.SharedMemory(name)
+        magic, version, width, height, _, _ = SHM_HEADER.unpack_from(self.shm.buf, 0)
+        if magic != SHM_MAGIC or version != SHM_VERSION:
+            self.shm.close()
+            raise ValueError(f"{name} is not a BPMdotGIF stage feed")
+        self.size = (width, height)
+        self.last_sequence = 0
+
+    def read(self, retries=10):
+        """(sequence, frame time, (h, w, 4) RGBA copy) of the newest whole frame, or None if none yet"""
+        width, height = self.size
+        for _ in range(retries):
+            before = SHM_HEADER.unpack_from(self.shm.buf, 0)[4]
+            if before == 0:
+                return None
+            if before % 2:
+                time.sleep(0.0005)
+                continue
+            pixels = np.frombuffer(self.shm.buf, dtype=np.uint8, count=width * height * 4,
+                                   offset=SHM_HEADER_SIZE).reshape(height, width, 4).copy()
+            _, _, _, _, after, frame_time = SHM_HEADER.unpack_from(self.shm.buf, 0)
+            if after == before:
+                self.last_sequence = before
+                return before, frame_time, pixels
+        return None
+
+    def close(self):
+        self.shm.close()
+
+
+class _StreamHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "BPMdotGIF"
+
+    def log_message(self, format, *args):
+        pass  # One line per request would flood the console with viewers reconnecting
+
+    def do_GET(self):
+        stream = self.server.stage_stream
+        path = self.path.split("?")[0]
+        if path == "/stream.mjpg":
+            self._stream(stream)
+        elif path == "/frame.jpg":
+            stream.add_viewer()
+            try:
+                jpeg = stream.wait_jpeg(stream.jpeg_sequence, CLIENT_TIMEOUT_SECONDS)
+            finally:
+                stream.remove_viewer()
+            if jpeg is None:
+                self.send_error(503, "No frame yet")
+                return
+            self._reply(200, "image/jpeg", jpeg[1])
+        elif path == "/stats":
+            self._reply(200, "application/json", json.dumps(stream.stats()).encode("utf-8"))
+        elif path == "/":
+            self._reply(200, "text/html", b"<html><body style='margin:0;background:#000'>"
+                                          b"<img src='/stream.mjpg' style='width:100%'></body></html>")
+        else:
+            self.send_error(404)
+
+    def _reply(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, stream):
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.connection.settimeout(CLIENT_TIMEOUT_SECONDS)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        stream.add_viewer()
+        sequence = 0
+        try:
+            while stream.running:
+                latest = stream.wait_jpeg(sequence, 1.0)
+                if latest is None:
+                    continue
+                # Whatever was encoded while we were sending the last frame is skipped
+                stream.count_skipped(latest[0] - sequence - 1 if sequence else 0)
+                sequence, jpeg = latest
+                self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg)
+                                 + jpeg + b"\r\n")
+        except (OSError, ValueError):
+            pass  # Viewer went away or stopped reading
+        finally:
+            stream.remove_viewer()
+
+
+class StageStream:
+    """Encoder thread, MJPEG HTTP server and shared-memory feed for the stage.
+
+    port None turns the HTTP stream off and shm_name None the shared-memory
+    feed. JPEGs are only encoded while at least one viewer is connected.
+    """
+
+    def __init__(self, size=DEFAULT_STREAM_SIZE, host="127.0.0.1", port=DEFAULT_STREAM_PORT,
+                 shm_name=None, quality=JPEG_QUALITY, max_fps=MAX_ENCODE_FPS):
+        self.size = size
+        self.quality = quality
+        self.max_fps = max_fps
+        self.store = FrameStore(size)
+        self.surface = stage_surface(size)
+        self.feed = SharedFrameFeed(shm_name, size) if shm_name else None
+        self.httpd = None
+        if port is not None:
+            self.httpd = http.server.ThreadingHTTPServer((host, port), _StreamHandler)
+            self.httpd.daemon_threads = True
+            self.httpd.stage_stream = self
+        self.running = False
+        self.encoded = 0
+        self.encode_seconds = 0.0
+        self.skipped = 0  # Frames viewers missed because they were still sending an older one
+        self._viewers = 0
+        self._refresh = False  # A viewer joined and needs a picture even if the stage is still
+        self._jpeg = None  # (encode number, bytes)
+        self._jpeg_condition = threading.Condition()
+        self._encoder = threading.Thread(target=self._encode_loop, name="stage-encoder", daemon=True)
+        self._http_thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1] if self.httpd is not None else None
+
+    @property
+    def viewers(self):
+        return self._viewers
+
+    @property
+    def jpeg_sequence(self):
+        return self._jpeg[0] if self._jpeg is not None else 0
+
+    def start(self):
+        self.running = True
+        self._encoder.start()
+        if self.httpd is not None:
+            self._http_thread = threading.Thread(target=self.httpd.serve_forever, name="stage-http", daemon=True)
+            self._http_thread.start()
+
+    def stop(self):
+        self.running = False
+        self.store.wake()
+        with self._jpeg_condition:
+            self._jpeg_condition.notify_all()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        self._encoder.join(timeout=2.0)
+        if self.feed is not None:
+            self.feed.close()
+
+    def publish(self):
+        """Hand the finished self.surface to the encoder (render loop; never blocks on viewers)"""
+        self.store.publish(self.surface)
+
+    def add_viewer(self):
+        with self._jpeg_condition:
+            self._viewers += 1
+        self._refresh = True
+        self.store.wake()
+
+    def remove_viewer(self):
+        with self._jpeg_condition:
+            self._viewers -= 1
+
+    def count_skipped(self, frames):
+        self.skipped += frames
+
+    def wait_jpeg(self, after, timeout):
+        """(sequence, JPEG bytes) of the newest encode past sequence after, or None on timeout"""
+        with self._jpeg_condition:
+            ready = self._jpeg_condition.wait_for(
+                lambda: not self.running or (self._jpeg is not None and self._jpeg[0] > after), timeout)
+            return self._jpeg if ready and self.running else None
+
+    def stats(self):
+        return {
+            "size": list(self.size),
+            "viewers": self._viewers,
+            "frames": self.store.sequence,
+            "encoded": self.encoded,
+            "encode_ms": self.encode_seconds / self.encoded * 1000 if self.encoded else 0.0,
+            "skipped": self.skipped,
+            "shm": self.feed.name if self.feed is not None else None,
+        }
+
+    def encode(self, rgba):
+        """One JPEG of an RGBA frame buffer"""
+        image = Image.frombuffer("RGB", self.size, rgba, "raw", "RGBX", 0, 1)
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=self.quality)
+        return out.getvalue()
+
+    def _encode_loop(self):
+        rgba = None
+        encoded_frame = 0
+        next_encode = 0.0
+        while self.running:
+            waiting = rgba is not None and self._viewers > 0 and encoded_frame != self.store.sequence
+            # A frame held back by the rate cap is encoded when the cap allows, even if no newer one comes
+            frame = self.store.take(max(0.0, next_encode - time.monotonic()) if waiting else 0.5)
+            if frame is not None:
+                rgba = frame
+                if self.feed is not None:
+                    self.feed.write(rgba, self.store.frame_time)
+            if rgba is None or self._viewers == 0:
+                continue
+            if encoded_frame == self.store.sequence and not self._refresh:
+                continue
+            now = time.monotonic()
+            if now < next_encode:
+                continue
+            self._refresh = False
+            next_encode = now + 1.0 / self.max_fps
+            encoded_frame = self.store.sequence
+            start = time.perf_counter()
+            jpeg = self.encode(rgba)
+            self.encode_seconds += time.perf_counter() - start
+            self.encoded += 1
+            with self._jpeg_condition:
+                self._jpeg = (self.encoded, jpeg)
+                self._jpeg_condition.notify_all()
+
+    def summary(self):
+        stats = self.stats()
+        return (f"Stage stream: {stats['frames']} frames, {stats['encoded']} encoded "
+                f"({stats['encode_ms']:.1f} ms each), {stats['skipped']} skipped by slow viewers")
+
+
+def read_mjpeg_frames(sock, count, delay=0.0):
+    """Read count JPEG parts from an MJPEG response on sock; returns how many arrived"""
+    sock.settimeout(CLIENT_TIMEOUT_SECONDS)
+    stream = sock.makefile("rb")
+    while stream.readline() not in (b"\r\n", b""):
+        pass  # Response headers
+    received = 0
+    while received < count:
+        length = None
+        while True:
+            line = stream.readline()
+            if not line:
+                return received
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+            if line == b"\r\n" and length is not None:
+                break
+        stream.read(length + 2)
+        received += 1
+        if delay:
+            time.sleep(delay)
+    return received
+
+
+def bench(clients=8, seconds=5.0, size=(1920, 1080), fps=60, slow_clients=1):
+    """Render moving frames into a stream and watch it with loopback viewers.
+
+    Reports the render loop's publish cost, the single per-frame encode, and
+    frames per viewer; slow viewers sleep between frames to show they only
+    lose frames themselves.
+    """
+    pygame.init()
+    stream = StageStream(size, port=0, shm_name=f"{DEFAULT_SHM_NAME}-bench")
+    stream.start()
+    results = {}
+    threads = []
+
+    def viewer(name, delay):
+        sock = socket.create_connection(("127.0.0.1", stream.port))
+        sock.sendall(b"GET /stream.mjpg HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        start = time.monotonic()
+        received = read_mjpeg_frames(sock, 10 ** 9 if not delay else int(seconds / delay), delay)
+        results[name] = received / (time.monotonic() - start)
+        sock.close()
+
+    for i in range(clients):
+        slow = i < slow_clients
+        thread = threading.Thread(target=viewer, args=(f"{'slow' if slow else 'viewer'} {i + 1}", 0.2 if slow else 0.0),
+                                  daemon=True)
+        thread.start()
+        threads.append(thread)
+    reader = SharedFrameReader(stream.feed.name)
+    publish_times = []
+    rng = np.random.default_rng(1234)
+    tiles = [pygame.Surface((160, 160)) for _ in range(8)]
+    for tile in tiles:
+        tile.fill(tuple(int(c) for c in rng.integers(0, 256, 3)))
+    end = time.monotonic() + seconds
+    frame = 0
+    while time.monotonic() < end:
+        stream.surface.fill((20, 20, 20, 255))
+        for i, tile in enumerate(tiles):
+            stream.surface.blit(tile, ((frame * 7 + i * 230) % size[0], (i * 120 + frame * 3) % size[1]))
+        start = time.perf_counter()
+        stream.publish()
+        publish_times.append(time.perf_counter() - start)
+        frame += 1
+        time.sleep(1.0 / fps)
+    shm_frame = reader.read()
+    reader.close()
+    stream.running = False
+    for thread in threads:
+        thread.join(timeout=CLIENT_TIMEOUT_SECONDS + 1)
+    stream.stop()
+    pygame.quit()
+    stats = stream.stats()
+    print(f"{size[0]}x{size[1]} at {fps} fps for {seconds:.0f}s, {clients} viewers ({slow_clients} slow)")
+    print(f"publish (render loop)   {np.median(publish_times) * 1000:8.3f} ms median, "
+          f"{max(publish_times) * 1000:.3f} ms max")
+    print(f"JPEG encode             {stats['encode_ms']:8.3f} ms per frame, {stats['encoded']} encodes "
+          f"for {stats['frames']} frames")
+    for name, rate in sorted(results.items()):
+        print(f"{name:<24}{rate:8.1f} frames/s")
+    print(f"shared memory feed      sequence {shm_frame[0] if shm_frame else 'none'}")
+    return 0
+
+
+def read_feed(name):
+    """Print the frames arriving on a shared-memory feed until interrupted"""
+    reader = SharedFrameReader(name)
+    print(f"{name}: {reader.size[0]}x{reader.size[1]} RGBA")
+    try:
+        while True:
+            previous = reader.last_sequence
+            frame = reader.read()
+            if frame is not None and frame[0] != previous:
+                sequence, frame_time, pixels = frame
+                print(f"frame {sequence // 2}: {(time.monotonic() - frame_time) * 1000:.1f} ms old, "
+                      f"mean RGB {pixels[..., :3].mean(axis=(0, 1)).round(1).tolist()}")
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    reader.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage streaming tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench_parser = commands.add_parser("bench", help="measure publish and encode cost with loopback viewers")
+    bench_parser.add_argument("--clients", type=int, default=8, help="MJPEG viewers")
+    bench_parser.add_argument("--slow-clients", type=int, default=1, help="viewers that read at 5 fps")
+    bench_parser.add_argument("--seconds", type=float, default=5.0)
+    bench_parser.add_argument("--size", default="1920x1080")
+    bench_parser.add_argument("--fps", type=int, default=60, help="rate the fake render loop publishes at")
+    read_parser = commands.add_parser("read", help="print frames from a shared-memory feed")
+    read_parser.add_argument("name", nargs="?", default=DEFAULT_SHM_NAME)
+    args = parser.parse_args(argv)
+    if args.command == "bench":
+        width, height = args.size.lower().split("x")
+        return bench(args.clients, args.seconds, (int(width), int(height)), args.fps, args.slow_clients)
+    try:
+        return read_feed(args.name)
+    except FileNotFoundError:
+        print(f"No shared-memory feed named {args.name}; start the app with --shm-feed")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
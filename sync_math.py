@@ -0,0 +1,26 @@
+import os
+import re
+
+DEFAULT_BEATS = 2
+
+
+def extract_beats_from_filename(filepath):
+    """Extract number of beats from filename pattern _XB.gif where X is a number"""
+    filename = os.path.basename(filepath)
+    match = re.search(r'_(\d+)B\.gif$', filename, re.IGNORECASE)
+    if match:
+        try:
+            return float(match.group(1))
+        except ValueError:
+            pass
+    return DEFAULT_BEATS
+
+
+def target_loop_duration(beats, bpm):
+    """Length in ms of a loop spanning `beats` beats at `bpm`"""
+    return (beats / bpm) * 60000
+
+
+def speed_multiplier(beats, bpm, original_loop_duration):
+    """How much faster than its native timing a GIF must play to loop in `beats` beats at `bpm`"""
+    return original_loop_duration / target_loop_duration(beats, bpm)
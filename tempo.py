@@ -0,0 +1,182 @@
+import math
+import time
+
+import numpy as np
+
+MIN_BPM = 30.0
+MAX_BPM = 600.0
+MIN_TAPS = 3  # Taps needed before tap tempo sets the BPM
+TAP_HISTORY = 16  # Most recent taps the tempo is fitted to
+TAP_RESET_SECONDS = 2.0  # A pause this long between taps starts a new tap sequence
+TAP_OUTLIER_FRACTION = 0.2  # Taps further than this fraction of a beat off the fitted grid are dropped
+
+
+def format_bpm(bpm):
+    """BPM for display: '128', '127.5'"""
+    return f"{bpm:.1f}".rstrip("0").rstrip(".")
+
+
+def fit_beats(times):
+    """Fit a beat grid to tap times; returns (seconds per beat, time of the beat on the last tap) or None.
+
+    Each tap is numbered by the beat it lands nearest to, so a skipped tap
+    leaves a gap in the numbering instead of halving the tempo. The grid is a
+    least-squares line through (beat number, time); the tap furthest off it is
+    dropped and the line refitted until every remaining tap is close.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    period = float(np.median(np.diff(times)))
+    if period <= 0:
+        return None
+    keep = np.ones(len(times), dtype=bool)
+    while True:
+        beats = np.rint((times - times[0]) / period)
+        if len(np.unique(beats[keep])) < 2:
+            return None
+        period, first = np.polyfit(beats[keep], times[keep], 1)
+        if period <= 0:
+            return None
+        residuals = np.where(keep, np.abs(times - (first + period * beats)), -1.0)
+        worst = int(np.argmax(residuals))
+        if residuals[worst] <= TAP_OUTLIER_FRACTION * period or keep.sum() <= MIN_TAPS:
+            return float(period), float(first + period * beats[-1])
+        keep[worst] = False
+
+
+class TapTempo:
+    """Tap times of the current tap sequence"""
+
+    def __init__(self, history=TAP_HISTORY, reset_seconds=TAP_RESET_SECONDS):
+        self.history = history
+        self.reset_seconds = reset_seconds
+        self.times = []
+
+    def tap(self, t):
+        """Record a tap at time t; returns fit_beats() of the sequence once there are enough taps"""
+        if self.times and t - self.times[-1] > self.reset_seconds:
+            self.times = []
+        self.times.append(t)
+        del self.times[:-self.history]
+        if len(self.times) < MIN_TAPS:
+            return None
+        return fit_beats(self.times)
+
+    def reset(self):
+        self.times = []
+
+
+class TempoEngine:
+    """Fractional BPM and the beat-phase anchor the beat clock runs from.
+
+    The clock is stored as an anchor (monotonic time, beat position). Tempo
+    changes re-anchor at the current beat so playback never jumps. Halving and
+    doubling keep the beat grid on the music instead: after halving, beats
+    land on every other old beat, after doubling on every old beat and
+    halfway between, which costs a jump of at most half a beat. Taps and
+    the beat tracker set both the tempo and the phase.
+    """
+
+    def __init__(self, bpm=120.0, clock=time.monotonic, min_bpm=MIN_BPM, max_bpm=MAX_BPM):
+        self._clock = clock
+        self.min_bpm = min_bpm
+        self.max_bpm = max_bpm
+        self.bpm = float(bpm)
+        self.paused = False
+        self.taps = TapTempo()
+        self._anchor_time = clock()
+        self._anchor_beat = 0.0
+
+    def beat_position(self, now=None):
+        """Beats elapsed on the clock (frozen while paused)"""
+        if self.paused:
+            return self._anchor_beat
+        if now is None:
+            now = self._clock()
+        return self._anchor_beat + (now - self._anchor_time) * self.bpm / 60.0
+
+    def _reanchor(self):
+        now = self._clock()
+        self._anchor_beat = self.beat_position(now)
+        self._anchor_time = now
+
+    def clamp(self, bpm):
+        bpm = float(bpm)
+        if not math.isfinite(bpm):
+            raise ValueError(f"invalid BPM {bpm}")
+        return max(self.min_bpm, min(bpm, self.max_bpm))
+
+    def set_bpm(self, bpm):
+        """Change tempo without moving the current beat phase"""
+        bpm = self.clamp(bpm)
+        if bpm == self.bpm:
+            return
+        self._reanchor()
+        self.bpm = bpm
+
+    def nudge(self, delta):
+        self.set_bpm(self.bpm + delta)
+
+    def set_paused(self, paused):
+        if paused == self.paused:
+            return
+        self._reanchor()
+        self.paused = paused
+
+    def _rescale(self, factor):
+        bpm = self.clamp(self.bpm * factor)
+        if bpm != self.bpm * factor:
+            self.set_bpm(bpm)  # Hit a limit, so there is no whole-beat grid to keep
+            return
+        now = self._clock()
+        beat = self.beat_position(now)
+        whole = round(beat)
+        # Renumber so whole beats still fall on (every other / twice as many) old whole beats
+        self._anchor_beat = (beat + whole) / 2.0 if factor < 1 else 2.0 * beat - whole
+        self._anchor_time = now
+        self.bpm = bpm
+
+    def halve(self):
+        self._rescale(0.5)
+
+    def double(self):
+        self._rescale(2.0)
+
+    def align_beat(self, beat_time, tolerance=0.0):
+        """Shift the phase so a beat lands exactly at monotonic time beat_time.
+
+        The clock moves to the nearest whole beat, so the shift is never more
+        than half a beat; shifts within tolerance beats are skipped.
+        """
+        if self.paused:
+            return
+        beat = self.beat_position(beat_time)
+        shift = round(beat) - beat
+        if abs(shift) > tolerance:
+            self._anchor_beat += shift
+
+    def tap(self, t=None):
+        """Register a tapped beat; returns True once the taps set a new tempo and phase"""
+        if t is None:
+            t = self._clock()
+        fit = self.taps.tap(t)
+        if fit is None:
+            return False
+        period, last_beat = fit
+        self.set_bpm(60.0 / period)
+        self.align_beat(last_beat)
+        return True
+
+    def anchor(self):
+        """(anchor time, anchor beat, bpm, paused): everything needed to rebuild this clock"""
+        return self._anchor_time, self._anchor_beat, self.bpm, self.paused
+
+    def set_anchor(self, anchor_time, anchor_beat, bpm, paused):
+        """Follow another clock.
+
+        time.monotonic is system-wide, so an engine in another process that
+        adopts this anchor lands on the same beat at the same moment.
+        """
+        self._anchor_time = anchor_time
+        self._anchor_beat = anchor_beat
+        self.bpm = bpm
+        self.paused = paused
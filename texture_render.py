@@ -0,0 +1,134 @@
+import collections
+import os
+
+import pygame
+from pygame._sdl2 import error as SDLError
+from pygame._sdl2.video import Renderer, Texture, Window
+
+from beat_effects import TRAIL_ALPHA
+from crowd import DEFAULT_CROWD_SIZE, dancer_frame
+from stage_render import stage_layout
+
+# Linear filtering when textures are stretched, the renderer's counterpart of smoothscale
+os.environ.setdefault("SDL_RENDER_SCALE_QUALITY", "1")
+TEXTURE_EFFECTS = ("pulse", "strobe", "trails")  # Beat effects the renderer can draw; flash and hue need the CPU
+
+
+def open_renderer(window, vsync):
+    """Create a hardware renderer for window, falling back to SDL's software renderer"""
+    try:
+        return Renderer(window, accelerated=1, vsync=vsync)
+    except SDLError as e:
+        print(f"No accelerated renderer ({e}), using the software renderer")
+        return Renderer(window, accelerated=0)
+
+
+class TextureFrameCache:
+    """Bounded LRU cache of GIF frames uploaded to the renderer as textures.
+
+    Every frame is uploaded once at its source size; scaling, flipping and
+    squad duplicates are done by the renderer when the texture is drawn, so
+    there is one entry per frame rather than one per size and flip.
+    """
+
+    def __init__(self, renderer, max_bytes):
+        self.renderer = renderer
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # (slot index, frame index) -> (frame buffer, texture)
+
+    def get(self, slot, frame_idx):
+        key = (slot.index, frame_idx)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is slot.pixels:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        if entry is not None:
+            # Slot was reloaded since this frame was uploaded
+            self._drop(key)
+        texture = Texture.from_surface(self.renderer, slot.get_frame(frame_idx))
+        self._entries[key] = (slot.pixels, texture)
+        self.current_bytes += texture.width * texture.height * 4
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+        return texture
+
+    def _drop(self, key):
+        _, texture = self._entries.pop(key)
+        self.current_bytes -= texture.width * texture.height * 4
+
+    def invalidate_slot(self, slot_index):
+        for key in [k for k in self._entries if k[0] == slot_index]:
+            self._drop(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def summary(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return (f"Texture frame cache: {self.hits} hits, {self.misses} uploads ({hit_rate:.1%} hit rate), "
+                f"{len(self._entries)} frames, {self.current_bytes / (1024 * 1024):.1f}/"
+                f"{self.max_bytes / (1024 * 1024):.0f} MB")
+
+
+class TextureStage:
+    """A stage window drawn with an SDL renderer instead of CPU blits.
+
+    GIF frames and the background image are uploaded once as textures and
+    drawn into destination rects, so zoom, flip and squad mode cost no CPU
+    scaling. Layout comes from stage_layout, so it matches the CPU stage.
+    Of the beat effects, pulse and strobe move or hide the dancers and trails
+    draw the previous frames with alpha modulation; the per-pixel color
+    effects (see TEXTURE_EFFECTS) are not drawn.
+    """
+
+    def __init__(self, title, size, vsync, max_texture_bytes):
+        self.window = Window(title, size, resizable=True)
+        self.renderer = open_renderer(self.window, vsync)
+        self.frames = TextureFrameCache(self.renderer, max_texture_bytes)
+        self._background = None  # (background surface, its texture)
+
+    @property
+    def size(self):
+        return self.window.size
+
+    def background_texture(self, image):
+        if self._background is None or self._background[0] is not image:
+            self._background = (image, Texture.from_surface(self.renderer, image))
+        return self._background[1]
+
+    def draw(self, slot, background, zoom_level, squad_mode, squad_spacing, squad_size, horizontal_flip,
+             crowd_size=DEFAULT_CROWD_SIZE, effects=None):
+        """Draw the background and a slot's current frame, then present"""
+        stage_rect = pygame.Rect((0, 0), self.size)
+        self.renderer.draw_color = (*background.color, 255)
+        self.renderer.clear()
+        if background.image is not None:
+            self.background_texture(background.image).draw(dstrect=stage_rect)
+        if slot.is_loaded:
+            layout = stage_layout(stage_rect, slot, zoom_level, squad_mode, squad_spacing, squad_size, crowd_size)
+            trails = 0
+            if effects is not None and effects.enabled:
+                layout = effects.layout(layout)
+                trails = effects.levels.trails
+            for x, y, width, height, offset in layout:
+                frame_idx = dancer_frame(slot, offset)
+                dstrect = (x, y, width, height)
+                # Oldest ghost first, so the newest frames end up on top
+                for age in range(trails, 0, -1):
+                    ghost_idx = (frame_idx - age) % slot.frame_count
+                    if slot.is_streaming and not slot.pixels.ready(ghost_idx):
+                        continue
+                    ghost = self.frames.get(slot, ghost_idx)
+                    ghost.alpha = round(255 * TRAIL_ALPHA[age - 1])
+                    ghost.draw(dstrect=dstrect, flip_x=horizontal_flip)
+                    ghost.alpha = 255  # The texture is shared with every other use of this frame
+                self.frames.get(slot, frame_idx).draw(dstrect=dstrect, flip_x=horizontal_flip)
+        self.renderer.present()
@@ -0,0 +1,140 @@
+import numpy as np
+import pygame
+from PIL import Image
+
+STRIP_COLOR = (40, 40, 40)
+ACTIVE_CELL_COLOR = (60, 60, 60)
+LABEL_COLOR = (200, 200, 200)
+LOADING_TRACK_COLOR = (20, 20, 20)
+LOADING_BAR_COLOR = (80, 200, 120)
+
+
+def thumbnail_size(box, width, height):
+    """Size of a width x height frame scaled to fit a (max width, max height) box"""
+    thumb_scale = min(box[0] / width, box[1] / height)
+    return max(1, int(width * thumb_scale)), max(1, int(height * thumb_scale))
+
+
+def scale_thumbnails(frames, frame_count, size, box, cancelled=None):
+    """Downscale a GIF's RGBA frames to thumbnails; runs on loader workers.
+
+    Returns an (n, h, w, 4) array, or None if cancelled was set first.
+    """
+    thumb_width, thumb_height = thumbnail_size(box, *size)
+    thumbnails = np.empty((frame_count, thumb_height, thumb_width, 4), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        if i >= frame_count:
+            break
+        if cancelled is not None and cancelled.is_set():
+            return None
+        thumb = Image.fromarray(np.asarray(frame), "RGBA").resize((thumb_width, thumb_height), Image.BILINEAR)
+        thumbnails[i] = np.asarray(thumb)
+    return thumbnails
+
+
+class ThumbnailStrip:
+    """The slot thumbnail strip as a persistent, incrementally redrawn layer.
+
+    Slot labels are rendered once, every slot gets a set of thumbnail frames
+    (downscaled by the loader worker, or scaled here the first time a frame is
+    shown), and update() only redraws the cells whose contents changed
+    (active slot, new GIF, frame, flip, loading progress). The layer itself is
+    only rebuilt by resize().
+    """
+
+    def __init__(self, width, height, slot_count):
+        self.slot_count = slot_count
+        self.font = pygame.font.SysFont(None, 24)
+        self.labels = [self.font.render(str(i + 1), True, LABEL_COLOR) for i in range(slot_count)]
+        self._thumbs = {}  # slot index -> (frame buffer, thumb size, {flip: [surface or None]}, thumbnail array)
+        self.resize(width, height)
+
+    def resize(self, width, height):
+        """Rebuild the layer for a new window size (thumbnail sizes change with it)"""
+        self.width = width
+        self.height = height
+        self.cell_width = width // self.slot_count
+        self.surface = pygame.Surface((width, height))
+        self.surface.fill(STRIP_COLOR)
+        self._cell_state = [None] * self.slot_count
+        self._thumbs.clear()
+
+    def cell_rect(self, index):
+        return pygame.Rect(index * self.cell_width, 0, self.cell_width, self.height)
+
+    def thumbnail_box(self):
+        """The (max width, max height) a thumbnail may take up in a cell"""
+        return self.cell_width - 10, self.height - 20
+
+    def _thumb_size(self, slot):
+        return thumbnail_size(self.thumbnail_box(), slot.width, slot.height)
+
+    def build_thumbnails(self, slot, flip=False, thumbnails=None):
+        """Take a freshly loaded slot's thumbnails (from scale_thumbnails) without scaling anything here.
+
+        Without thumbnails, or with ones scaled for an older strip size, each
+        frame is scaled the first time it is shown.
+        """
+        size = self._thumb_size(slot)
+        if thumbnails is not None and thumbnails.shape[1:3] != (size[1], size[0]):
+            thumbnails = None
+        self._thumbs[slot.index] = (slot.pixels, size, {flip: [None] * slot.frame_count}, thumbnails)
+
+    def _thumbnail(self, slot, frame_idx, flip):
+        entry = self._thumbs.get(slot.index)
+        if entry is None or entry[0] is not slot.pixels:
+            entry = (slot.pixels, self._thumb_size(slot), {}, None)
+            self._thumbs[slot.index] = entry
+        frames = entry[2].setdefault(flip, [None] * slot.frame_count)
+        thumb = frames[frame_idx]
+        if thumb is None:
+            if entry[3] is not None:
+                thumb = pygame.image.frombuffer(entry[3][frame_idx], entry[1], "RGBA")
+            else:
+                thumb = pygame.transform.smoothscale(slot.get_frame(frame_idx), entry[1])
+            if flip:
+                thumb = pygame.transform.flip(thumb, True, False)
+            if pygame.display.get_surface() is not None:
+                thumb = thumb.convert_alpha()
+            if not slot.is_streaming:
+                frames[frame_idx] = thumb
+        return thumb
+
+    def invalidate_slot(self, index):
+        self._thumbs.pop(index, None)
+        self._cell_state[index] = None
+
+    def update(self, slots, active_slot, flip, loading_progress):
+        """Redraw changed cells; returns their rects in layer coordinates"""
+        dirty = []
+        for i, slot in enumerate(slots[:self.slot_count]):
+            progress = loading_progress[i]
+            state = (i == active_slot, slot.is_loaded, id(slot.pixels), slot.frame_idx, flip,
+                     None if progress is None else int(progress * 100))
+            if state == self._cell_state[i]:
+                continue
+            self._cell_state[i] = state
+            rect = self.cell_rect(i)
+            self._draw_cell(slot, rect, i == active_slot, flip, progress)
+            dirty.append(rect)
+        return dirty
+
+    def _draw_cell(self, slot, rect, active, flip, progress):
+        pygame.draw.rect(self.surface, ACTIVE_CELL_COLOR if active else STRIP_COLOR, rect)
+
+        if progress is not None:
+            # Loading bar along the bottom of the cell
+            bar_width = int((rect.width - 10) * progress)
+            pygame.draw.rect(self.surface, LOADING_TRACK_COLOR, (rect.x + 5, rect.bottom - 8, rect.width - 10, 4))
+            pygame.draw.rect(self.surface, LOADING_BAR_COLOR, (rect.x + 5, rect.bottom - 8, bar_width, 4))
+
+        if slot.is_loaded:
+            thumb = self._thumbnail(slot, slot.frame_idx, flip)
+            # Center thumbnail in its cell
+            self.surface.blit(thumb, (rect.x + (rect.width - thumb.get_width()) // 2,
+                                      rect.y + (rect.height - thumb.get_height()) // 2))
+
+        self.surface.blit(self.labels[slot.index], (rect.x + 5, rect.y + 5))
+
+    def draw(self, target, y):
+        target.blit(self.surface, (0, y))